@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from "react";
-import { api, frigateProxy } from "../../services/api";
+import { api, frigateProxy, snapshotSrc } from "../../services/api";
 import { Button } from "../../components/ui/Button";
 import { Card } from "../../components/ui/Card";
 import { Badge } from "../../components/ui/Badge";
@@ -168,9 +168,9 @@ export function CameraList({ onAddCamera, onEditCamera }) {
                             }}
                         >
                             <div style={{ position: "relative", height: 160, background: "#f1f5f9" }}>
-                                {camera.last_snapshot ? (
+                                {camera.last_snapshot_url || camera.last_snapshot ? (
                                     <img
-                                        src={`data:image/jpeg;base64,${camera.last_snapshot}`}
+                                        src={snapshotSrc(camera.last_snapshot_url, camera.last_snapshot)}
                                         alt={`Vista de ${camera.name}`}
                                         style={{ width: "100%", height: "100%", objectFit: "cover" }}
                                     />
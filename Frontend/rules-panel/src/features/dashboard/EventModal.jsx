@@ -1,6 +1,7 @@
 import React, { useEffect } from "react";
 import { X, ChevronLeft, ChevronRight, Calendar, Clock, Camera, Tag, AlertTriangle } from "lucide-react";
 import { Badge } from "../../components/ui/Badge";
+import { snapshotSrc } from "../../services/api";
 
 export function EventModal({ isOpen, onClose, event, onNext, onPrev, hasNext, hasPrev }) {
     // Keyboard navigation
@@ -31,6 +32,7 @@ export function EventModal({ isOpen, onClose, event, onNext, onPrev, hasNext, ha
     if (!isOpen || !event) return null;
 
     const {
+        snapshot_url,
         snapshot_base64,
         id,
         triggered_at,
@@ -75,9 +77,9 @@ export function EventModal({ isOpen, onClose, event, onNext, onPrev, hasNext, ha
 
                 {/* Left: Image */}
                 <div className="relative flex-1 bg-black flex items-center justify-center min-h-[300px] md:min-h-full group">
-                    {snapshot_base64 ? (
+                    {snapshot_url || snapshot_base64 ? (
                         <img
-                            src={`data:image/jpeg;base64,${snapshot_base64}`}
+                            src={snapshotSrc(snapshot_url, snapshot_base64)}
                             alt="Event Snapshot"
                             className="w-full h-full object-contain"
                         />
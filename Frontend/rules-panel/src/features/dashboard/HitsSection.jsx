@@ -1,5 +1,5 @@
-import React, { useState, useEffect } from "react";
-import { api } from "../../services/api";
+import React, { useState, useEffect, useRef } from "react";
+import { api, snapshotSrc } from "../../services/api";
 import { Card } from "../../components/ui/Card";
 import { Badge } from "../../components/ui/Badge";
 import { MultiSelect } from "../../components/ui/MultiSelect";
@@ -98,6 +98,8 @@ export function HitsSection() {
     const [totalPages, setTotalPages] = useState(1);
     const [totalCount, setTotalCount] = useState(0);
     const pageSize = 20;
+    // Cursor con el que se carga cada página (paginación keyset del backend)
+    const cursorsRef = useRef({ 1: null });
 
     // Filters & Options
     const [availableCameras, setAvailableCameras] = useState([]);
@@ -165,14 +167,21 @@ export function HitsSection() {
         }
     }, [hits, loading, page, lastLoadedPage, pendingNavigation]);
 
-    const loadHits = async () => {
+    const loadHits = async (targetPage = page) => {
         setLoading(true);
         try {
             // Custom serialization for FastAPI (repeating keys for arrays)
             const params = new URLSearchParams();
-            params.append('page', page);
             params.append('page_size', pageSize);
 
+            const cursor = cursorsRef.current[targetPage];
+            if (cursor) {
+                params.append('cursor', cursor);
+                params.append('include_total', 'false');
+            } else {
+                params.append('page', targetPage);
+            }
+
             if (filters.camera && filters.camera.length > 0) {
                 filters.camera.forEach(c => params.append('camera', c));
             }
@@ -185,12 +194,13 @@ export function HitsSection() {
             const res = await api.get("/api/rules/hits", { params });
 
             setHits(res.data.hits);
-            setTotalPages(res.data.total_pages);
-            setTotalCount(res.data.total);
-            setLastLoadedPage(page);
-
-            if (res.data.cameras) setAvailableCameras(res.data.cameras);
-            if (res.data.labels) setAvailableLabels(res.data.labels);
+            // El total solo viene en la primera página (sin cursor)
+            if (res.data.total !== undefined) {
+                setTotalPages(res.data.total_pages);
+                setTotalCount(res.data.total);
+            }
+            cursorsRef.current[targetPage + 1] = res.data.next_cursor;
+            setLastLoadedPage(targetPage);
 
         } catch (err) {
             console.error(err);
@@ -200,6 +210,20 @@ export function HitsSection() {
         }
     };
 
+    const loadFacets = async () => {
+        try {
+            const res = await api.get("/api/rules/hits/facets");
+            setAvailableCameras(res.data.cameras || []);
+            setAvailableLabels(res.data.labels || []);
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
+    useEffect(() => {
+        loadFacets();
+    }, []);
+
     useEffect(() => {
         loadHits();
     }, [page]); // Reload on page change
@@ -209,8 +233,9 @@ export function HitsSection() {
     };
 
     const applyFilters = () => {
+        cursorsRef.current = { 1: null }; // Los cursores dependen de los filtros
         setPage(1); // Reset to page 1
-        loadHits();
+        loadHits(1);
     };
 
     const clearFilters = () => {
@@ -220,6 +245,7 @@ export function HitsSection() {
             start_date: "",
             end_date: ""
         });
+        cursorsRef.current = { 1: null };
         setPage(1);
         // We need to trigger load, either via effect or calling loadHits
         // Since state update is async, best to rely on effect? 
@@ -227,7 +253,7 @@ export function HitsSection() {
         // Let's call loadHits manually after a short delay or use another effect.
         // Or just set state and then call loadHits with NEW state? (Closure issue).
         // Best approach: reset state and rely on explicit action.
-        setTimeout(() => loadHits(), 0);
+        setTimeout(() => loadHits(1), 0);
     };
 
     return (
@@ -327,7 +353,7 @@ export function HitsSection() {
                             {totalCount} Total
                         </Badge>
                     </h3>
-                    <ButtonRefresh onClick={loadHits} loading={loading} />
+                    <ButtonRefresh onClick={() => loadHits()} loading={loading} />
                 </div>
 
                 <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 gap-4">
@@ -337,10 +363,10 @@ export function HitsSection() {
                             onClick={() => handleEventClick(index)}
                             className="group relative overflow-hidden rounded-xl border bg-card text-card-foreground shadow transition-all hover:shadow-lg hover:-translate-y-1 cursor-pointer ring-offset-background focus-visible:outline-none focus-visible:ring-2 focus-visible:ring-ring focus-visible:ring-offset-2"
                         >
-                            {hit.snapshot_base64 && (
+                            {(hit.snapshot_url || hit.snapshot_base64) && (
                                 <div className="aspect-video w-full overflow-hidden bg-muted">
                                     <img
-                                        src={`data:image/jpeg;base64,${hit.snapshot_base64}`}
+                                        src={snapshotSrc(hit.snapshot_url, hit.snapshot_base64)}
                                         alt="Snapshot"
                                         className="h-full w-full object-cover transition-transform duration-300 group-hover:scale-105"
                                     />
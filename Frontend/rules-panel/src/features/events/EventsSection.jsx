@@ -1,10 +1,12 @@
-import React, { useState, useEffect, useCallback } from "react";
-import { api } from "../../services/api";
+import React, { useState, useEffect, useCallback, useRef } from "react";
+import { api, snapshotSrc, liveStreamUrl } from "../../services/api";
 import { Card } from "../../components/ui/Card";
 import { Badge } from "../../components/ui/Badge";
 import { Modal } from "../../components/ui/Modal";
 import { useToast } from "../../context/ToastContext";
 
+const FEED_LIMIT = 50;
+
 export function EventsSection() {
     const [events, setEvents] = useState([]);
     const [loading, setLoading] = useState(false);
@@ -14,7 +16,7 @@ export function EventsSection() {
     const loadEvents = async () => {
         setLoading(true);
         try {
-            const res = await api.get("/api/events/db?limit=50");
+            const res = await api.get(`/api/events/db?limit=${FEED_LIMIT}`);
             setEvents(res.data.events);
         } catch (err) {
             console.error(err);
@@ -28,6 +30,26 @@ export function EventsSection() {
         loadEvents();
     }, []);
 
+    // Eventos en vivo por SSE: cada evento terminado llega ya guardado (con id y
+    // snapshot_url, igual que /api/events/db) y se agrega al feed sin recargarlo.
+    // EventSource reconecta solo y reanuda desde el último id recibido.
+    const retriedSnapshot = useRef(null);
+    const eventsRef = useRef(events);
+    eventsRef.current = events;
+    useEffect(() => {
+        if (typeof EventSource === "undefined") return;
+        const source = new EventSource(liveStreamUrl());
+        source.addEventListener("live", (msg) => {
+            const item = JSON.parse(msg.data);
+            if (item.event?.type !== "end" || item.id == null) return;
+            if (eventsRef.current.some((ev) => ev.id === item.id)) return;  // Reenviado al reconectar
+            setEvents((prev) => [item, ...prev.filter((ev) => ev.id !== item.id)].slice(0, FEED_LIMIT));
+            // El modal abierto sigue mostrando el mismo evento (se corrió un lugar)
+            setSelectedEventIndex((prev) => (prev === null || prev + 1 >= FEED_LIMIT ? null : prev + 1));
+        });
+        return () => source.close();
+    }, []);
+
     const handleEventClick = (index) => {
         setSelectedEventIndex(index);
     };
@@ -189,9 +211,15 @@ export function EventsSection() {
                         boxShadow: "0 20px 25px -5px rgba(0, 0, 0, 0.1), 0 10px 10px -5px rgba(0, 0, 0, 0.04)",
                     }}>
                         <div style={{ position: "relative", background: "#000", minHeight: "300px", display: "flex", alignItems: "center", justifyContent: "center" }}>
-                            {selectedEvent.snapshot_base64 ? (
+                            {selectedEvent.snapshot_url || selectedEvent.snapshot_base64 ? (
                                 <img
-                                    src={`data:image/jpeg;base64,${selectedEvent.snapshot_base64}`}
+                                    src={snapshotSrc(selectedEvent.snapshot_url, selectedEvent.snapshot_base64)}
+                                    onError={() => {
+                                        // Las URLs de snapshots vencen a los minutos: recargar el feed una vez por evento
+                                        if (retriedSnapshot.current === selectedEvent.id) return;
+                                        retriedSnapshot.current = selectedEvent.id;
+                                        loadEvents();
+                                    }}
                                     alt="Event Snapshot"
                                     style={{ width: "100%", height: "auto", maxHeight: "60vh", objectFit: "contain" }}
                                 />
@@ -25,6 +25,7 @@ export function RulesSection() {
         frigate_type: "end",
         min_score: "",
         min_duration_seconds: "",
+        dedup_window_seconds: "",
         custom_message: "",
         time_start_hour: "",
         time_start_minute: "",
@@ -124,6 +125,7 @@ export function RulesSection() {
             frigate_type: "end",
             min_score: "",
             min_duration_seconds: "",
+            dedup_window_seconds: "",
             custom_message: "",
             time_start_hour: "",
             time_start_minute: "",
@@ -166,6 +168,7 @@ export function RulesSection() {
                 frigate_type: form.frigate_type || null,
                 min_score: form.min_score ? parseFloat(form.min_score.toString().replace(',', '.')) : null,
                 min_duration_seconds: form.min_duration_seconds ? parseFloat(form.min_duration_seconds.toString().replace(',', '.')) : null,
+                dedup_window_seconds: form.dedup_window_seconds !== "" ? parseFloat(form.dedup_window_seconds.toString().replace(',', '.')) : null,
                 custom_message: form.custom_message || null,
                 time_start: localTimeStart ? convertLocalToUTC(localTimeStart, userTimezone) : null,
                 time_end: localTimeEnd ? convertLocalToUTC(localTimeEnd, userTimezone) : null,
@@ -192,6 +195,7 @@ export function RulesSection() {
             frigate_type: rule.frigate_type || "end",
             min_score: rule.min_score ? rule.min_score.toString() : "",
             min_duration_seconds: rule.min_duration_seconds ? rule.min_duration_seconds.toString() : "",
+            dedup_window_seconds: rule.dedup_window_seconds != null ? rule.dedup_window_seconds.toString() : "",
             custom_message: rule.custom_message || "",
             time_start_hour: timeStart.hour,
             time_start_minute: timeStart.minute,
@@ -220,6 +224,7 @@ export function RulesSection() {
                 frigate_type: form.frigate_type || null,
                 min_score: form.min_score ? parseFloat(form.min_score.toString().replace(',', '.')) : null,
                 min_duration_seconds: form.min_duration_seconds ? parseFloat(form.min_duration_seconds.toString().replace(',', '.')) : null,
+                dedup_window_seconds: form.dedup_window_seconds !== "" ? parseFloat(form.dedup_window_seconds.toString().replace(',', '.')) : null,
                 custom_message: form.custom_message || null,
                 time_start: localTimeStart ? convertLocalToUTC(localTimeStart, userTimezone) : null,
                 time_end: localTimeEnd ? convertLocalToUTC(localTimeEnd, userTimezone) : null,
@@ -503,6 +508,10 @@ export function RulesSection() {
                             <label style={labelStyle}>DURACIÓN (s)</label>
                             <Input placeholder="Segundos" type="number" value={form.min_duration_seconds} onChange={(e) => setForm({ ...form, min_duration_seconds: e.target.value })} />
                         </div>
+                        <div style={{ flex: 1 }}>
+                            <label style={labelStyle}>ANTI-SPAM (s)</label>
+                            <Input placeholder="60" type="number" min="0" value={form.dedup_window_seconds} onChange={(e) => setForm({ ...form, dedup_window_seconds: e.target.value })} />
+                        </div>
                     </div>
                     <div style={{ marginTop: 12 }}>
                         <label style={labelStyle}>HORA INICIO</label>
@@ -88,6 +88,19 @@ function buildApiUrl(path) {
   return `${baseURL}${cleanPath}`;
 }
 
+// Fuente de imagen para un snapshot: URL del snapshot store o base64 (eventos legacy)
+export function snapshotSrc(url, base64) {
+  if (url) return buildApiUrl(url);
+  if (base64) return `data:image/jpeg;base64,${base64}`;
+  return null;
+}
+
+// URL del stream SSE de eventos en vivo (EventSource no permite headers: el token va por query)
+export function liveStreamUrl() {
+  const token = localStorage.getItem("adminToken");
+  return buildApiUrl(`/api/events/stream?token=${encodeURIComponent(token || "")}`);
+}
+
 // Crear instancia de axios SIN baseURL
 // Usaremos URLs absolutas en cada petición para evitar problemas de Mixed Content
 export const api = axios.create({
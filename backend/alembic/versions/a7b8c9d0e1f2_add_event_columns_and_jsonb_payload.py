@@ -0,0 +1,179 @@
+"""add_event_columns_and_jsonb_payload
+
+Revision ID: a7b8c9d0e1f2
+Revises: f6a7b8c9d0e1
+Create Date: 2026-01-19 11:05:37.402916
+
+Columnas extraídas del payload (camera, label, frigate_event_id, ...) e índices
+compuestos para los listados. Las columnas de los eventos viejos se llenan
+aquí por lotes (keyset por id, un commit por lote en PostgreSQL) con
+extract_event_fields, igual que la ingesta: los listados por cámara y la grilla
+(camera_latest_state, que la migración siguiente arma desde estas columnas) ya
+ven todo el historial. Si la migración se corta a mitad del backfill,
+`python backfill_event_columns.py` completa lo que falte.
+
+En PostgreSQL, sin bloquear la ingesta:
+- Los índices se crean CONCURRENTLY.
+- payload pasa de TEXT a JSONB sin ALTER ... TYPE (que reescribe la tabla con
+  ACCESS EXCLUSIVE tomado): se agrega una columna payload_jsonb, un trigger la
+  mantiene al día para los INSERT/UPDATE que lleguen mientras tanto, se llena
+  por lotes (keyset por id, un commit por lote) y al final se intercambian los
+  nombres. El intercambio solo toca el catálogo (lock de milisegundos, con
+  lock_timeout para no quedar en cola detrás de una query larga).
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.event_fields import extract_event_fields
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7b8c9d0e1f2'
+down_revision: Union[str, Sequence[str], None] = 'f6a7b8c9d0e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+EVENT_INDEXES = [
+    ('ix_events_user_id_id', 'events', ['user_id', sa.text('id DESC')]),
+    ('ix_events_user_camera_id', 'events', ['user_id', 'camera', sa.text('id DESC')]),
+    ('ix_events_user_label_id', 'events', ['user_id', 'label', sa.text('id DESC')]),
+    ('ix_events_frigate_event_id', 'events', ['frigate_event_id']),
+    ('ix_rule_hits_rule_id_id', 'rule_hits', ['rule_id', sa.text('id DESC')]),
+    ('ix_rule_hits_event_id', 'rule_hits', ['event_id']),
+]
+
+PAYLOAD_BACKFILL_BATCH = 5000
+COLUMNS_BACKFILL_BATCH = 1000
+
+_EVENT_COLUMNS = sa.table(
+    'events',
+    sa.column('id', sa.Integer), sa.column('camera', sa.String), sa.column('label', sa.String),
+    sa.column('frigate_event_id', sa.String), sa.column('frigate_type', sa.String),
+    sa.column('top_score', sa.Float), sa.column('start_time', sa.Float),
+    sa.column('end_time', sa.Float), sa.column('duration_seconds', sa.Float),
+)
+
+_SYNC_FUNCTION = """
+CREATE OR REPLACE FUNCTION events_payload_jsonb_sync() RETURNS trigger AS $$
+BEGIN
+    NEW.payload_jsonb := NEW.payload::jsonb;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+_BACKFILL_BATCH = sa.text(
+    "UPDATE events SET payload_jsonb = payload::jsonb "
+    "WHERE id > :last_id AND id <= :next_id AND payload_jsonb IS NULL AND payload IS NOT NULL"
+)
+
+
+def _backfill_payload_jsonb(bind):
+    """Copia payload -> payload_jsonb por lotes; cada lote se confirma solo (autocommit)."""
+    last_id = 0
+    while True:
+        next_id = bind.execute(
+            sa.text("SELECT max(id) FROM (SELECT id FROM events WHERE id > :last_id ORDER BY id LIMIT :batch_size) b"),
+            {"last_id": last_id, "batch_size": PAYLOAD_BACKFILL_BATCH},
+        ).scalar()
+        if next_id is None:
+            break
+        bind.execute(_BACKFILL_BATCH, {"last_id": last_id, "next_id": next_id})
+        last_id = next_id
+
+
+def _backfill_event_columns(bind):
+    """Llena las columnas extraídas de los eventos existentes, por lotes (keyset por id)."""
+    update = (
+        _EVENT_COLUMNS.update()
+        .where(_EVENT_COLUMNS.c.id == sa.bindparam('row_id'))
+        .values({name: sa.bindparam(name) for name in (
+            'camera', 'label', 'frigate_event_id', 'frigate_type',
+            'top_score', 'start_time', 'end_time', 'duration_seconds',
+        )})
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, payload FROM events WHERE id > :last_id AND camera IS NULL "
+                "ORDER BY id LIMIT :batch_size"
+            ),  # Los que llegan durante la migración ya traen las columnas desde la ingesta
+            {"last_id": last_id, "batch_size": COLUMNS_BACKFILL_BATCH},
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        changes = [{'row_id': row_id, **extract_event_fields(payload)} for row_id, payload in rows]
+        changes = [c for c in changes if any(v is not None for k, v in c.items() if k != 'row_id')]
+        if changes:
+            bind.execute(update, changes)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('events', sa.Column('camera', sa.String(length=255), nullable=True))
+    op.add_column('events', sa.Column('label', sa.String(length=100), nullable=True))
+    op.add_column('events', sa.Column('frigate_event_id', sa.String(length=100), nullable=True))
+    op.add_column('events', sa.Column('frigate_type', sa.String(length=20), nullable=True))
+    op.add_column('events', sa.Column('top_score', sa.Float(), nullable=True))
+    op.add_column('events', sa.Column('start_time', sa.Float(), nullable=True))
+    op.add_column('events', sa.Column('end_time', sa.Float(), nullable=True))
+    op.add_column('events', sa.Column('duration_seconds', sa.Float(), nullable=True))
+
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    if is_postgres:
+        # 1. Columna nueva (sin default: no reescribe) + trigger para las filas que lleguen durante el backfill
+        op.execute('ALTER TABLE events ADD COLUMN payload_jsonb JSONB')
+        op.execute(_SYNC_FUNCTION)
+        op.execute(
+            'CREATE TRIGGER events_payload_jsonb_sync BEFORE INSERT OR UPDATE OF payload ON events '
+            'FOR EACH ROW EXECUTE PROCEDURE events_payload_jsonb_sync()'
+        )
+
+        # CREATE INDEX CONCURRENTLY y el backfill por lotes no pueden ir dentro de una transacción
+        with op.get_context().autocommit_block():
+            for name, table, columns in EVENT_INDEXES:
+                op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+            # 2. Filas existentes, por lotes
+            _backfill_payload_jsonb(op.get_bind())
+            _backfill_event_columns(op.get_bind())
+
+        # 3. Intercambio: solo catálogo (DROP COLUMN no reescribe la tabla)
+        op.execute("SET LOCAL lock_timeout = '10s'")
+        op.execute(
+            'UPDATE events SET payload_jsonb = payload::jsonb '
+            'WHERE payload_jsonb IS NULL AND payload IS NOT NULL'
+        )  # Red de seguridad: con el trigger activo no debería quedar ninguna
+        op.execute('DROP TRIGGER events_payload_jsonb_sync ON events')
+        op.execute('ALTER TABLE events RENAME COLUMN payload TO payload_text')
+        op.execute('ALTER TABLE events RENAME COLUMN payload_jsonb TO payload')
+        op.execute('ALTER TABLE events DROP COLUMN payload_text')
+        op.execute('DROP FUNCTION events_payload_jsonb_sync()')
+    else:
+        for name, table, columns in EVENT_INDEXES:
+            op.create_index(name, table, columns, unique=False)
+        _backfill_event_columns(op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table, _ in reversed(EVENT_INDEXES):
+        op.drop_index(name, table_name=table)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Volver atrás sí reescribe la tabla (solo para emergencias)
+        op.execute('ALTER TABLE events ALTER COLUMN payload TYPE TEXT USING payload::text')
+
+    op.drop_column('events', 'duration_seconds')
+    op.drop_column('events', 'end_time')
+    op.drop_column('events', 'start_time')
+    op.drop_column('events', 'top_score')
+    op.drop_column('events', 'frigate_type')
+    op.drop_column('events', 'frigate_event_id')
+    op.drop_column('events', 'label')
+    op.drop_column('events', 'camera')
@@ -0,0 +1,72 @@
+"""add_camera_latest_state
+
+Revision ID: b8c9d0e1f2a3
+Revises: a7b8c9d0e1f2
+Create Date: 2026-01-20 10:12:09.551370
+
+Tabla con el último evento y el último snapshot por (usuario, cámara), que la
+ingesta mantiene con un upsert. Se llena aquí desde las columnas extraídas de
+events (la migración anterior ya las llenó); backfill_event_columns.py también
+la recalcula al final.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8c9d0e1f2a3'
+down_revision: Union[str, Sequence[str], None] = 'a7b8c9d0e1f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'camera_latest_state',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('camera', sa.String(length=255), nullable=False),
+        sa.Column('last_event_id', sa.Integer(), nullable=True),
+        sa.Column('last_event_at', sa.DateTime(), nullable=True),
+        sa.Column('last_label', sa.String(length=100), nullable=True),
+        sa.Column('snapshot_event_id', sa.Integer(), nullable=True),
+        sa.Column('snapshot_hash', sa.String(length=64), nullable=True),
+        sa.Column('snapshot_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id', 'camera'),
+    )
+
+    # Estado inicial: último evento de cada (usuario, cámara)...
+    op.execute("""
+        INSERT INTO camera_latest_state (user_id, camera, last_event_id, last_event_at, last_label, updated_at)
+        SELECT e.user_id, e.camera, e.id, e.received_at, e.label, CURRENT_TIMESTAMP
+        FROM events e
+        JOIN (
+            SELECT MAX(id) AS id FROM events
+            WHERE user_id IS NOT NULL AND camera IS NOT NULL
+            GROUP BY user_id, camera
+        ) latest ON latest.id = e.id
+    """)
+    # ...y su último evento con snapshot (usa el índice (user_id, camera, id DESC))
+    op.execute("""
+        UPDATE camera_latest_state SET snapshot_event_id = (
+            SELECT MAX(e.id) FROM events e
+            WHERE e.user_id = camera_latest_state.user_id
+              AND e.camera = camera_latest_state.camera
+              AND (e.snapshot_hash IS NOT NULL OR e.snapshot_base64 IS NOT NULL)
+        )
+    """)
+    op.execute("""
+        UPDATE camera_latest_state SET
+            snapshot_hash = (SELECT e.snapshot_hash FROM events e WHERE e.id = camera_latest_state.snapshot_event_id),
+            snapshot_at = (SELECT e.received_at FROM events e WHERE e.id = camera_latest_state.snapshot_event_id)
+        WHERE snapshot_event_id IS NOT NULL
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('camera_latest_state')
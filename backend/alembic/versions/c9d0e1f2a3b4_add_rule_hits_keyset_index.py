@@ -0,0 +1,47 @@
+"""add_rule_hits_keyset_index
+
+Revision ID: c9d0e1f2a3b4
+Revises: b8c9d0e1f2a3
+Create Date: 2026-01-21 15:48:20.173655
+
+Índices para la paginación por cursor del historial de alertas
+(ORDER BY triggered_at DESC, id DESC):
+- (rule_id, triggered_at, id): el historial de un usuario solo recorre las
+  alertas de SUS reglas, sin pasar por las de los demás usuarios.
+- (triggered_at, id): global, para consultas por fecha sin filtro de regla.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9d0e1f2a3b4'
+down_revision: Union[str, Sequence[str], None] = 'b8c9d0e1f2a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+HIT_INDEXES = [
+    ('ix_rule_hits_rule_triggered_at_id', ['rule_id', sa.text('triggered_at DESC'), sa.text('id DESC')]),
+    ('ix_rule_hits_triggered_at_id', [sa.text('triggered_at DESC'), sa.text('id DESC')]),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, columns in HIT_INDEXES:
+                op.create_index(name, 'rule_hits', columns, unique=False, postgresql_concurrently=True)
+    else:
+        for name, columns in HIT_INDEXES:
+            op.create_index(name, 'rule_hits', columns, unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, _ in reversed(HIT_INDEXES):
+        op.drop_index(name, table_name='rule_hits')
@@ -0,0 +1,154 @@
+"""partition_events_and_rule_hits
+
+Revision ID: d0e1f2a3b4c5
+Revises: c9d0e1f2a3b4
+Create Date: 2026-01-23 09:31:52.208417
+
+- users.retention_days (retención por usuario, ver services/retention.py).
+- Solo PostgreSQL: events y rule_hits pasan a tablas particionadas por mes
+  (RANGE sobre received_at / triggered_at), sin copiar datos:
+
+  1. La tabla actual se renombra a <tabla>_legacy.
+  2. Se crea la tabla padre particionada con las mismas columnas, defaults
+     (la misma secuencia de ids) e índices.
+  3. <tabla>_legacy se adjunta como partición desde MINVALUE hasta el inicio
+     del mes siguiente. PostgreSQL reutiliza sus índices y solo la recorre
+     una vez para validar el rango.
+  4. Se crean las particiones de los próximos meses. No se crea una DEFAULT:
+     impediría DETACH PARTITION ... CONCURRENTLY en la retención, y las filas
+     que caen ahí bloquean la creación de la partición de su mes. El job de
+     retención crea las particiones futuras (ver services/retention.py).
+
+  La PK de una tabla particionada tiene que incluir la clave de partición:
+  la padre tiene PK (id, received_at) / (id, triggered_at) y cada partición la
+  hereda (al adjuntar la legacy se construye su índice único). Tampoco puede ser
+  destino de una FK sobre id solo, así que se elimina la FK
+  rule_hits.event_id -> events.id (la retención borra las alertas junto con
+  sus eventos); los ids siguen saliendo de la misma secuencia. Los modelos de
+  SQLAlchemy siguen declarando solo id como clave primaria (al ORM le alcanza
+  para la identidad de los objetos), pero ya no la FK (ver models/all_models.py).
+
+  Toma un lock exclusivo sobre ambas tablas mientras corre: ejecutar en una
+  ventana de poco tráfico (el listener reintenta lo que falle mientras tanto).
+
+- downgrade() en PostgreSQL vuelve a tablas simples COPIANDO los datos
+  (INSERT ... SELECT) y restaura la PK sobre id y la FK de rule_hits (borrando
+  antes las alertas cuyo evento ya no existe). Reescribe ambas tablas con lock
+  exclusivo: solo para emergencias, en una ventana de mantenimiento.
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd0e1f2a3b4c5'
+down_revision: Union[str, Sequence[str], None] = 'c9d0e1f2a3b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+PARTITIONED_TABLES = [('events', 'received_at'), ('rule_hits', 'triggered_at')]
+MONTHS_AHEAD = 2
+
+
+def _add_months(value: datetime, months: int) -> datetime:
+    index = value.year * 12 + (value.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _partition(table: str, key: str, legacy_upper: datetime):
+    bind = op.get_bind()
+    legacy = f'{table}_legacy'
+
+    # Una partición por rango no acepta NULL en la clave (y la PK de la padre la incluye)
+    op.execute(f"UPDATE {table} SET {key} = '1970-01-01' WHERE {key} IS NULL")
+    op.execute(f'ALTER TABLE {table} ALTER COLUMN {key} SET NOT NULL')
+    op.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+    # Libera el nombre {table}_pkey para la PK de la padre
+    op.execute(f'ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey')
+
+    indexes = bind.execute(sa.text(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = :t AND indexname NOT LIKE '%%_pkey'"
+    ), {'t': legacy}).all()
+
+    op.execute(f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})')
+    # La secuencia de ids pasa a la tabla padre: si no, se borraría al eliminar la partición legacy
+    op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {key})')
+
+    for name, definition in indexes:
+        # Mismo índice en la padre con el nombre original; al adjuntar, PostgreSQL reutiliza el de la legacy
+        op.execute(f'ALTER INDEX {name} RENAME TO {name[:50]}_legacy')
+        op.execute(definition.replace(f' ON {legacy} ', f' ON {table} ', 1)
+                   .replace(f' ON public.{legacy} ', f' ON public.{table} ', 1)
+                   .replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+
+    op.execute(
+        f"ALTER TABLE {table} ATTACH PARTITION {legacy} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{legacy_upper.isoformat()}')"
+    )
+
+    for offset in range(MONTHS_AHEAD + 1):
+        start = _add_months(legacy_upper, offset)
+        end = _add_months(start, 1)
+        op.execute(
+            f"CREATE TABLE {table}_y{start.year:04d}m{start.month:02d} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('retention_days', sa.Integer(), nullable=True))
+
+    if op.get_bind().dialect.name != 'postgresql':
+        return  # SQLite: sin particiones, la retención borra por lotes
+
+    op.execute('ALTER TABLE rule_hits DROP CONSTRAINT IF EXISTS rule_hits_event_id_fkey')
+    legacy_upper = _add_months(datetime.utcnow(), 1)
+    for table, key in PARTITIONED_TABLES:
+        _partition(table, key, legacy_upper)
+
+
+def _unpartition(table: str, key: str):
+    bind = op.get_bind()
+    plain = f'{table}_plain'
+
+    indexes = bind.execute(sa.text(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = :t AND indexname NOT LIKE '%%_pkey'"
+    ), {'t': table}).all()
+
+    op.execute(f'CREATE TABLE {plain} (LIKE {table} INCLUDING DEFAULTS)')
+    op.execute(f'INSERT INTO {plain} SELECT * FROM {table}')
+    # La secuencia vuelve a la tabla simple antes de borrar la particionada (si no, se borra con ella)
+    op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {plain}.id')
+    op.execute(f'DROP TABLE {table}')  # Borra también todas sus particiones y sus índices
+    op.execute(f'ALTER TABLE {plain} RENAME TO {table}')
+    op.execute(f'ALTER TABLE {table} ALTER COLUMN {key} DROP NOT NULL')
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)')
+    for _, definition in indexes:
+        op.execute(definition.replace(' ON ONLY ', ' ON ', 1))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        # Copia todos los datos a tablas simples (ver docstring): solo en una ventana de mantenimiento
+        for table, key in PARTITIONED_TABLES:
+            _unpartition(table, key)
+        # La retención borra eventos sin mirar sus alertas: las huérfanas impedirían restaurar la FK
+        op.execute(
+            'DELETE FROM rule_hits h WHERE h.event_id IS NOT NULL '
+            'AND NOT EXISTS (SELECT 1 FROM events e WHERE e.id = h.event_id)'
+        )
+        op.execute(
+            'ALTER TABLE rule_hits ADD CONSTRAINT rule_hits_event_id_fkey '
+            'FOREIGN KEY (event_id) REFERENCES events (id)'
+        )
+    op.drop_column('users', 'retention_days')
@@ -0,0 +1,32 @@
+"""add_snapshot_hash_to_events
+
+Revision ID: d4e5f6a7b8c9
+Revises: c3d4e5f6a7b8
+Create Date: 2026-01-12 16:40:03.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4e5f6a7b8c9'
+down_revision: Union[str, Sequence[str], None] = 'c3d4e5f6a7b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('events', sa.Column('snapshot_hash', sa.String(length=64), nullable=True))
+    op.add_column('events', sa.Column('snapshot_size', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_events_snapshot_hash'), 'events', ['snapshot_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_events_snapshot_hash'), table_name='events')
+    op.drop_column('events', 'snapshot_size')
+    op.drop_column('events', 'snapshot_hash')
@@ -0,0 +1,30 @@
+"""add_dedup_settings_to_rules
+
+Revision ID: e5f6a7b8c9d0
+Revises: d4e5f6a7b8c9
+Create Date: 2026-01-14 11:05:27.501934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5f6a7b8c9d0'
+down_revision: Union[str, Sequence[str], None] = 'd4e5f6a7b8c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('rules', sa.Column('dedup_window_seconds', sa.Float(), nullable=True))
+    op.add_column('rules', sa.Column('dedup_tolerance', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rules', 'dedup_tolerance')
+    op.drop_column('rules', 'dedup_window_seconds')
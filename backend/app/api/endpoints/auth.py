@@ -5,21 +5,16 @@ from typing import Optional
 from datetime import timedelta
 import logging
 import re
-from app.db.session import SessionLocal
+from app.db.session import get_db
 from app.models.all_models import UserDB
 from app.core.security import create_access_token, verify_token, hash_password, verify_password
 from app.utils.timezone_utils import get_timezone_from_phone
 from app.utils.email_utils import send_reset_password_email
+from app.services.rule_index import rule_index
+from app.services.principal_cache import principal_cache, token_fingerprint
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def get_current_user(
     authorization: Optional[str] = Header(None, alias="Authorization"),
     x_admin_token: Optional[str] = Header(None, alias="X-Admin-Token"),
@@ -50,7 +45,11 @@ def get_current_user(
     if not token:
         raise HTTPException(status_code=401, detail="Missing Authorization header or X-Admin-Token")
     
-    # Verificar token
+    return authenticate_token(token, db)
+
+
+def authenticate_token(token: str, db: Session) -> UserDB:
+    """Valida el JWT y retorna su usuario (también lo usa el stream SSE, que recibe el token por query)"""
     payload = verify_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
@@ -59,11 +58,19 @@ def get_current_user(
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token payload")
     
+    # CACHE: el mismo token en los últimos segundos no vuelve a consultar la BD
+    fingerprint = token_fingerprint(token)
+    user = principal_cache.get_user(db, user_id, fingerprint)
+    if user is not None:
+        return user
+
     user = db.query(UserDB).filter(UserDB.id == user_id).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     
+    principal_cache.put_user(user, fingerprint, payload.get("exp"))
     return user
+
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -183,6 +190,7 @@ def get_user_info(current_user: UserDB = Depends(get_current_user)):
         "whatsapp_number": current_user.whatsapp_number,
         "whatsapp_notifications_enabled": current_user.whatsapp_notifications_enabled,
         "timezone": current_user.timezone or "UTC",
+        "retention_days": current_user.retention_days,
         "created_at": current_user.created_at.isoformat() if current_user.created_at else None
     }
 
@@ -191,9 +199,16 @@ class UpdateProfileRequest(BaseModel):
     whatsapp_number: Optional[str] = None
     whatsapp_notifications_enabled: Optional[bool] = None
     timezone: Optional[str] = None
+    retention_days: Optional[int] = None  # 0 = usar el valor por defecto del servidor
     current_password: Optional[str] = None
     new_password: Optional[str] = None
 
+    @validator('retention_days')
+    def validate_retention_days(cls, v):
+        if v is not None and not 0 <= v <= 3650:
+            raise ValueError('La retención debe estar entre 0 y 3650 días (0 = valor por defecto del servidor)')
+        return v
+
     @validator('whatsapp_number')
     def validate_whatsapp(cls, v):
         if v and not re.match(r'^\+?[1-9]\d{1,14}$', v):
@@ -242,6 +257,9 @@ def update_user_profile(
     if req.timezone is not None:
         current_user.timezone = req.timezone if req.timezone else "UTC"
 
+    if req.retention_days is not None:
+        current_user.retention_days = req.retention_days or None
+
     # Cambiar contraseña (requiere contraseña actual)
     if req.new_password:
         if not req.current_password:
@@ -254,6 +272,9 @@ def update_user_profile(
 
     db.commit()
     db.refresh(current_user)
+    # El motor de reglas cachea el número/flag de WhatsApp del dueño
+    rule_index.invalidate_user(current_user.id)
+    principal_cache.invalidate_user(current_user.id)
 
     logging.info(f"✅ Perfil actualizado: {current_user.username}")
 
@@ -264,7 +285,8 @@ def update_user_profile(
             "username": current_user.username,
             "email": current_user.email,
             "whatsapp_number": current_user.whatsapp_number,
-            "whatsapp_notifications_enabled": current_user.whatsapp_notifications_enabled
+            "whatsapp_notifications_enabled": current_user.whatsapp_notifications_enabled,
+            "retention_days": current_user.retention_days
         }
     }
 
@@ -347,6 +369,7 @@ def reset_password(req: ResetPasswordRequest, db: Session = Depends(get_db)):
     # Actualizar contraseña
     user.password_hash = hash_password(req.new_password)
     db.commit()
+    principal_cache.invalidate_user(user.id)
     
     logging.info(f"✅ Contraseña restablecida para: {user.username}")
     
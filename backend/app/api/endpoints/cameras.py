@@ -7,23 +7,19 @@ import os
 import subprocess
 import json
 
-from app.db.session import SessionLocal
+from app.db.session import get_db
 from app.api.endpoints.auth import get_current_user
-from app.models.all_models import UserDB, CameraDB, EventDB
+from app.models.all_models import UserDB, CameraDB, EventDB, CameraLatestStateDB
 from app.api.endpoints import events as events_module
+from app.services.snapshot_store import snapshot_url
+from app.services.principal_cache import principal_cache
+from app.services import camera_state
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 CONFIG_PATH = "/config/config.yml"
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def add_camera_to_frigate_config(name: str, rtsp_url: str) -> bool:
     """Agrega una cámara a la configuración de Frigate"""
     try:
@@ -137,27 +133,35 @@ def list_cameras(
         # FILTRAR SOLO CÁMARAS DEL USUARIO ACTUAL
         cameras = db.query(CameraDB).filter(CameraDB.user_id == current_user.id).all()
 
+        # Último evento/snapshot de TODAS sus cámaras en una consulta por clave primaria
+        # (lo mantiene la ingesta, ver services/camera_state.py)
+        states = {
+            state.camera: state
+            for state in db.query(CameraLatestStateDB).filter(CameraLatestStateDB.user_id == current_user.id)
+        }
+
+        # LEGACY: snapshots que eran base64 al registrarse (quizá ya migrados al store)
+        legacy_ids = [s.snapshot_event_id for s in states.values() if s.snapshot_event_id and not s.snapshot_hash]
+        legacy = {}
+        if legacy_ids:
+            legacy = {
+                row.id: row
+                for row in db.query(EventDB.id, EventDB.snapshot_hash, EventDB.snapshot_base64)
+                .filter(EventDB.id.in_(legacy_ids), EventDB.user_id == current_user.id)
+            }
+
         result = []
         for camera in cameras:
-            # Buscar el último evento con snapshot de esta cámara usando SQL directo (más rápido)
+            state = states.get(camera.name)
             last_snapshot = None
-            last_event_time = None
-
-            # Query SQL optimizado con LIKE en lugar de parsear JSON
-            last_event = (
-                db.query(EventDB)
-                .filter(
-                    EventDB.user_id == current_user.id, # Strict Isolation
-                    EventDB.snapshot_base64.isnot(None),
-                    EventDB.payload.like(f'%"camera": "{camera.name}"%')
-                )
-                .order_by(EventDB.id.desc())
-                .first()  # Solo necesitamos el primero
-            )
-
-            if last_event:
-                last_snapshot = last_event.snapshot_base64
-                last_event_time = last_event.received_at.isoformat() if last_event.received_at else None
+            last_snapshot_url = None
+            if state is not None:
+                snapshot_hash = state.snapshot_hash
+                old = legacy.get(state.snapshot_event_id)
+                if old is not None:
+                    snapshot_hash = old.snapshot_hash
+                    last_snapshot = old.snapshot_base64
+                last_snapshot_url = snapshot_url(snapshot_hash, current_user.id)
 
             result.append({
                 "id": camera.id,
@@ -166,8 +170,11 @@ def list_cameras(
                 "description": camera.description or "",
                 "enabled": camera.enabled,
                 "created_at": camera.created_at.isoformat() if camera.created_at else None,
+                "last_snapshot_url": last_snapshot_url,
                 "last_snapshot": last_snapshot,
-                "last_event_time": last_event_time
+                "last_event_time": state.last_event_at.isoformat() if state and state.last_event_at else None,
+                "last_label": state.last_label if state else None,
+                "last_snapshot_time": state.snapshot_at.isoformat() if state and state.snapshot_at else None,
             })
 
         logger.info(f"🔒 Usuario {current_user.username} consultó sus {len(result)} cámaras.")
@@ -223,6 +230,7 @@ def add_camera(
         db.add(new_camera)
         db.commit()
         db.refresh(new_camera)
+        principal_cache.invalidate_cameras(current_user.id)
 
         logger.info(f"✅ Cámara '{name}' agregada a la base de datos por usuario {current_user.username}")
 
@@ -308,9 +316,19 @@ def update_camera(
         camera.name = new_name
         camera.description = camera_data.get("description", camera.description)
         camera.rtsp_url = new_rtsp_url
+
+        if new_name != old_name:
+            # Estado de la grilla: la fila del nombre viejo quedaría huérfana (los eventos
+            # viejos siguen con ese nombre); la del nuevo sale de sus eventos, si los hay
+            db.query(CameraLatestStateDB).filter(
+                CameraLatestStateDB.user_id == current_user.id,
+                CameraLatestStateDB.camera == old_name,
+            ).delete(synchronize_session=False)
+            camera_state.rebuild_camera(db, current_user.id, new_name)
         
         db.commit()
         db.refresh(camera)
+        principal_cache.invalidate_cameras(current_user.id)
         
         logger.info(f"📝 Cámara '{old_name}' actualizada a '{new_name}' por usuario {current_user.username}")
 
@@ -367,9 +385,14 @@ def delete_camera(
         # Eliminar de Frigate config
         remove_camera_from_frigate_config(camera_name)
 
-        # Eliminar de BD
+        # Eliminar de BD (y su estado en la grilla)
+        db.query(CameraLatestStateDB).filter(
+            CameraLatestStateDB.user_id == current_user.id,
+            CameraLatestStateDB.camera == camera_name,
+        ).delete(synchronize_session=False)
         db.delete(camera)
         db.commit()
+        principal_cache.invalidate_cameras(current_user.id)
 
         # Reiniciar Frigate
         restart_frigate()
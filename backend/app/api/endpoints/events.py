@@ -1,39 +1,46 @@
-from fastapi import APIRouter, Request, Header, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, Request, Header, HTTPException, Depends
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional, List, Dict, Any
+import asyncio
 import json
 import logging
 import os
+import time
+import zlib
 from datetime import datetime
 
-from app.db.session import SessionLocal
+from app.core import tracing
+from app.db.session import SessionLocal, AsyncSessionLocal, get_db
 from app.models.all_models import EventDB, UserDB
 from app.services.rule_engine import evaluate_rules
-from app.api.endpoints.auth import get_current_user
+from app.services.evaluation_pool import evaluation_pool
+from app.services.snapshot_store import snapshot_store, snapshot_url, is_valid_digest, verify_snapshot_signature
+from app.services.customer_cache import customer_cache
+from app.services.event_fields import extract_event_fields
+from app.services import camera_state
+from app.services.principal_cache import principal_cache
+from app.services.pipeline_metrics import INGEST_SECONDS, INGEST_PAYLOAD_BYTES, INGEST_EVENTS
+from app.services.live_buffer import live_buffer, camera_key
+from app.services.live_stream import (
+    live_stream,
+    format_sse,
+    LIVE_STREAM_HEARTBEAT_SECONDS,
+    LIVE_STREAM_CAMERAS_REFRESH_SECONDS,
+)
+from app.api.endpoints.auth import get_current_user, authenticate_token
 
 router = APIRouter()
 
 # SECURITY FIX: Use env var for API Key
 EXPECTED_API_KEY = os.getenv("API_SECRET_KEY")
-EVENTS_IN_MEMORY: List[Dict[str, Any]] = []
 
-
-#Este bloque prepara al router, le define una contrase, cuelga una pizarra borrable
-#y contrata un bibliotecario efeiciente que se asegura que nadie se robe los libros de la bd
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Límites del endpoint /batch (tamaño ya descomprimido)
+EVENTS_BATCH_MAX_EVENTS = int(os.getenv("EVENTS_BATCH_MAX_EVENTS", "500"))
+EVENTS_BATCH_MAX_BYTES = int(os.getenv("EVENTS_BATCH_MAX_BYTES", str(20 * 1024 * 1024)))
 
 
-@router.post("/")
-async def receive_event(
-    request: Request,
-    background_tasks: BackgroundTasks,
-    authorization: Optional[str] = Header(None)
-):
+def _check_ingest_api_key(authorization: Optional[str]):
     if EXPECTED_API_KEY:
         if not authorization:
             raise HTTPException(status_code=401, detail="Missing Authorization header")
@@ -45,7 +52,200 @@ async def receive_event(
         if scheme.lower() != "bearer" or token != EXPECTED_API_KEY:
             raise HTTPException(status_code=401, detail="Invalid API key")
 
+
+def _remember_live(body: Dict[str, Any], now: datetime, db_event: Optional[EventDB] = None):
+    # Sin el snapshot: la vista en vivo no lo muestra y ocuparía RAM/Redis por evento
+    event = {k: v for k, v in body.items() if k != 'snapshot_base64'}
+    key = camera_key(event)
+    item = {"received_at": now.isoformat() + "Z", "event": event}
+    if db_event is not None:
+        # Evento ya guardado: mismo formato que GET /api/events/db, el panel lo agrega sin recargar.
+        # La URL firmada del snapshot vence: se arma al leer el buffer (_live_view), no aquí
+        item["id"] = db_event.id
+        item["snapshot_hash"] = db_event.snapshot_hash
+    seq = live_buffer.append(key, item)
+    if seq:
+        # Push a los paneles conectados por SSE (solo a los del dueño de la cámara)
+        live_stream.publish(key, {"seq": seq, **item})
+
+
+def _live_view(item: Dict[str, Any], user_id: int) -> Dict[str, Any]:
+    """Item del buffer en vivo tal como se entrega: con snapshot_url firmada en vez del hash."""
+    if "snapshot_hash" not in item:
+        return item
+    view = {k: v for k, v in item.items() if k != "snapshot_hash"}
+    view["snapshot_url"] = snapshot_url(item["snapshot_hash"], user_id)
+    return view
+
+
+def _store_snapshots(snapshots: List[Optional[str]]) -> List[tuple]:
+    """Guarda los snapshots en el store (se ejecuta fuera del event loop)."""
+    stored = []
+    for snapshot_b64 in snapshots:
+        snapshot_hash, snapshot_size = None, None
+        if snapshot_b64:
+            try:
+                snapshot_hash, snapshot_size = snapshot_store.put_base64(snapshot_b64)
+            except Exception as e:
+                logging.error(f"❌ Snapshot inválido o no se pudo guardar: {e}")
+        stored.append((snapshot_hash, snapshot_size))
+    return stored
+
+
+def _trace_ingest(end_events: List[tuple], store_times: tuple, db_times: tuple) -> List[Optional[str]]:
+    """
+    Spans snapshot_store y db_insert de cada evento guardado, hijos del contexto
+    que trajo el evento (traceparent). Retorna el contexto con que sigue la evaluación.
+    """
+    if not tracing.TRACING_ENABLED:
+        return [None] * len(end_events)
+    contexts = []
+    for _, snapshot_b64, traceparent in end_events:
+        parent = tracing.parse_traceparent(traceparent)
+        if parent is None:
+            # Evento sin contexto (listener viejo): la traza empieza aquí
+            parent = tracing.new_trace()
+            tracing.record_span("ingest", parent, None, store_times[0], db_times[1])
+        if snapshot_b64:
+            tracing.record_span("snapshot_store", tracing.child_of(parent), parent, *store_times,
+                                bytes_b64=len(snapshot_b64))
+        db_context = tracing.child_of(parent)
+        tracing.record_span("db_insert", db_context, parent, *db_times, batch_size=len(end_events))
+        contexts.append(db_context.traceparent)
+    return contexts
+
+
+async def _ingest_events(bodies: List[Dict[str, Any]], traceparent: Optional[str] = None) -> List[int]:
+    """
+    Ingesta común para /events/ y /events/batch.
+
+    - Todos los eventos van a la vista en vivo (RAM); los 'end' recién después
+      de guardarse, con su id y snapshot_url.
+    - Solo los 'end' se guardan en BD, en UNA transacción (insert masivo).
+    - Cada 'end' guardado se encola en el pool de evaluación de reglas.
+    - El contexto de traza ("traceparent" del body, o el header en `traceparent`)
+      viaja aparte: no se guarda en el payload ni en la vista en vivo.
+    Retorna los ids de los eventos guardados.
+    """
+    now = datetime.utcnow()
+    end_events = []
+    for body in bodies:
+        # Extraer snapshot_base64 si viene en el body
+        snapshot_b64 = body.pop('snapshot_base64', None)
+        # Fuera del body (no se persiste); el header (estándar W3C) manda sobre el campo
+        body_traceparent = body.pop('traceparent', None)
+        event_traceparent = traceparent or body_traceparent
+
+        # DB FIX: Only save 'end' events to DB (PostgreSQL)
+        # 'new' and 'update' are kept in RAM only for live view
+        if body.get('type') == 'end':
+            end_events.append((body, snapshot_b64, event_traceparent))
+
+    # BACKPRESSURE: Si el pool de evaluación está saturado, pedimos al listener que reintente
+    # antes de guardar nada (así no quedan eventos en BD sin evaluar)
+    if end_events and not evaluation_pool.has_capacity(len(end_events)):
+        logging.warning("🚦 Pool de evaluación saturado, evento rechazado con 503")
+        INGEST_EVENTS.inc(len(end_events), storage="rejected")
+        raise HTTPException(
+            status_code=503,
+            detail="Rule evaluation queue is full, retry later",
+            headers={"Retry-After": "5"},
+        )
+
+    # Después del 503: el listener reintenta el lote entero y la vista en vivo lo vería duplicado
+    for body in bodies:
+        if body.get('type') != 'end':
+            _remember_live(body, now)
+
+    INGEST_EVENTS.inc(len(bodies) - len(end_events), storage="ram_only")
+    if not end_events:
+        return []
+
+    # ASYNC: La ingesta nunca bloquea el event loop con I/O de BD o disco
+    try:
+        # STORAGE: El JPEG va al snapshot store; el evento solo guarda hash + tamaño
+        store_started = time.time()
+        stored_snapshots = await asyncio.to_thread(_store_snapshots, [snap for _, snap, _ in end_events])
+        db_started = time.time()
+
+        async with AsyncSessionLocal() as db:
+            db_events = []
+            for (body, _, _), (snapshot_hash, snapshot_size) in zip(end_events, stored_snapshots):
+                # MULTI-TENANT FIX: Find user by customer_id (cacheado)
+                user_id = await customer_cache.resolve(db, body.get("customer_id"))
+                db_events.append(EventDB(
+                    received_at=now,
+                    payload=body,
+                    **extract_event_fields(body),
+                    snapshot_hash=snapshot_hash,
+                    snapshot_size=snapshot_size,
+                    user_id=user_id  # Save ownership
+                ))
+            db.add_all(db_events)
+            await db.flush()  # Ids para el estado por cámara
+            # Último evento/snapshot por cámara, en la misma transacción (grilla de cámaras)
+            await camera_state.record_events(db, db_events)
+            await db.commit()
+        INGEST_EVENTS.inc(len(db_events), storage="db")
+        for (body, _, _), db_event in zip(end_events, db_events):
+            _remember_live(body, now, db_event)
+        traceparents = _trace_ingest(end_events, (store_started, db_started), (db_started, time.time()))
+
+        # CONCURRENCY: Offload rule evaluation to the dedicated evaluation pool
+        # El hash del snapshot viaja con el trabajo: la evaluación no vuelve a leer el evento
+        for (body, _, _), db_event, eval_traceparent in zip(end_events, db_events, traceparents):
+            if not evaluation_pool.submit(evaluate_rules, body, db_event.id, db_event.snapshot_hash, eval_traceparent):
+                logging.error(f"❌ Evento {db_event.id} guardado pero no se pudo encolar su evaluación")
+
+        return [db_event.id for db_event in db_events]
+
+    except Exception as e:
+        logging.error(f"❌ Error guardando evento o evaluando reglas: {e}")
+        raise HTTPException(status_code=500, detail=f"Error saving event: {str(e)}")
+
+
+def _decode_batch_body(raw: bytes, content_encoding: Optional[str]) -> bytes:
+    """Descomprime el cuerpo del batch (gzip / zstd) con límite de tamaño."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("identity", ""):
+        data = raw
+    elif encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(raw, EVENTS_BATCH_MAX_BYTES + 1)
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="Invalid compressed body")
+    elif encoding == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise HTTPException(status_code=415, detail="zstd not supported by this server, use gzip")
+        try:
+            data = zstandard.ZstdDecompressor().decompress(raw, max_output_size=EVENTS_BATCH_MAX_BYTES + 1)
+        except zstandard.ZstdError:
+            raise HTTPException(status_code=400, detail="Invalid compressed body")
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+
+    if len(data) > EVENTS_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Batch too large")
+    return data
+
+
+@router.post("/")
+async def receive_event(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    traceparent: Optional[str] = Header(None)
+):
+    _check_ingest_api_key(authorization)
+
+    started = time.perf_counter()
+    raw = await request.body()
+    INGEST_PAYLOAD_BYTES.observe(len(raw), endpoint="single")
     body = await request.json()
+    if not tracing.parse_traceparent(traceparent):
+        traceparent = None  # Header ausente o inválido: se usa el del body, si viene
 
     # TEMPORAL: Validación deshabilitada para testing
     # TODO: Reactivar después de las pruebas
@@ -67,84 +267,179 @@ async def receive_event(
 
     logging.info(f"📨 Evento recibido en backend: {body.get('type')} - {body.get('label')}")
 
-    now = datetime.utcnow()
-
-    wrapped_event = {
-        "received_at": now.isoformat() + "Z",
-        "event": body,
-    }
-    
-    EVENTS_IN_MEMORY.append(wrapped_event)
-    
-    # MEMORY FIX: Limit memory usage
-    if len(EVENTS_IN_MEMORY) >= 500:
-        EVENTS_IN_MEMORY.pop(0) 
-
-    # Extraer snapshot_base64 si viene en el body
-    snapshot_b64 = body.pop('snapshot_base64', None)
-
-    # DB FIX: Only save 'end' events to DB (PostgreSQL)
-    # 'new' and 'update' are kept in RAM only for live view
-    if body.get('type') == 'end':
-        db = SessionLocal()
-        try:
-            # MULTI-TENANT FIX: Find user by customer_id
-            customer_id = body.get("customer_id")
-            user_id = None
-            if customer_id:
-                user = db.query(UserDB).filter(UserDB.username == customer_id).first()
-                if user:
-                    user_id = user.id
-            
-            db_event = EventDB(
-                received_at=now,
-                payload=json.dumps(body),
-                snapshot_base64=snapshot_b64,
-                user_id=user_id  # Save ownership
-            )
-            db.add(db_event)
-            db.commit()
-            db.refresh(db_event)
-
-            # CONCURRENCY: Offload rule evaluation to background task
-            background_tasks.add_task(evaluate_rules, body, db_event.id)
-
-        except Exception as e:
-            logging.error(f"❌ Error guardando evento o evaluando reglas: {e}")
-            raise HTTPException(status_code=500, detail=f"Error saving event: {str(e)}")
-        finally:
-            db.close()
-    else:
-        # For 'new'/'update', we don't save to DB and don't trigger rules (no DB ID)
-        pass
+    try:
+        await _ingest_events([body], traceparent)
+    finally:
+        INGEST_SECONDS.observe(time.perf_counter() - started, endpoint="single")
 
     return {"status": "ok", "stored": body.get('type') == 'end'}
 
 
+@router.post("/batch")
+async def receive_events_batch(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    content_encoding: Optional[str] = Header(None)
+):
+    """
+    Ingesta por lotes para el python-listener.
+
+    Acepta una lista JSON de eventos normalizados (o {"events": [...]}),
+    opcionalmente comprimida con Content-Encoding: gzip | zstd.
+    Los eventos 'end' se guardan en una sola transacción.
+    """
+    _check_ingest_api_key(authorization)
+
+    started = time.perf_counter()
+    raw = await request.body()
+    INGEST_PAYLOAD_BYTES.observe(len(raw), endpoint="batch")
+    data = await asyncio.to_thread(_decode_batch_body, raw, content_encoding)
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+
+    bodies = payload.get("events") if isinstance(payload, dict) else payload
+    if not isinstance(bodies, list) or not all(isinstance(b, dict) for b in bodies):
+        raise HTTPException(status_code=400, detail="Expected a list of events")
+    if len(bodies) > EVENTS_BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {EVENTS_BATCH_MAX_EVENTS} events")
+
+    logging.info(f"📦 Batch recibido en backend: {len(bodies)} eventos ({len(raw)} bytes, encoding={content_encoding or 'identity'})")
+
+    try:
+        event_ids = await _ingest_events(bodies)
+    finally:
+        INGEST_SECONDS.observe(time.perf_counter() - started, endpoint="batch")
+
+    return {"status": "ok", "received": len(bodies), "stored": len(event_ids), "event_ids": event_ids}
+
+
 @router.get("/")
 def list_events(
     limit: int = 50,
+    since: int = 0,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Lista eventos en memoria filtrados por cámaras del usuario autenticado"""
-    from app.models.all_models import CameraDB
-
-    # Obtener cámaras del usuario
-    user_cameras = db.query(CameraDB).filter(CameraDB.user_id == current_user.id).all()
-    user_camera_names = {cam.name for cam in user_cameras}
+    """
+    Lista eventos en memoria de las cámaras del usuario autenticado.
+    Con `since` (el last_seq de la respuesta anterior) solo retorna los eventos nuevos.
+    """
+    # Cámaras del usuario (cacheadas junto con su identidad)
+    user_camera_names = principal_cache.camera_names(db, current_user.id)
 
     if limit <= 0:
         limit = 50
+    limit = min(limit, 500)
+
+    # Solo los buffers de (este usuario, sus cámaras): no se recorre el resto
+    keys = [(current_user.username, name) for name in user_camera_names]
+    last_seq = live_buffer.last_seq  # Antes de leer: un evento que llega en el medio sale en el próximo poll
+    result = live_buffer.read(keys, limit, since_seq=max(since, 0))
+    if result:
+        last_seq = max(last_seq, result[-1]["seq"])
+    events = [_live_view(item, current_user.id) for item in result]
+    return {"count": len(events), "events": events, "last_seq": last_seq}
+
+
+def _authenticate_stream(token: str):
+    """Valida el token UNA vez por conexión (no por evento). Retorna (user_id, username, cámaras)."""
+    db = SessionLocal()
+    try:
+        user = authenticate_token(token, db)
+        return user.id, user.username, set(principal_cache.camera_names(db, user.id))
+    finally:
+        db.close()
+
+
+def _load_camera_names(user_id: int) -> set:
+    db = SessionLocal()
+    try:
+        return set(principal_cache.camera_names(db, user_id))
+    finally:
+        db.close()
 
-    # Filtrar eventos solo de cámaras del usuario
-    filtered_events = [
-        event for event in EVENTS_IN_MEMORY
-        if event.get("event", {}).get("camera") in user_camera_names
-    ]
 
-    result = filtered_events[-limit:]
-    return {"count": len(result), "events": result}
+async def _sse_events(request: Request, sub, user_id: int, since_seq: int):
+    last_sent = since_seq
+    refresh_at = time.monotonic() + LIVE_STREAM_CAMERAS_REFRESH_SECONDS
+    try:
+        yield "retry: 3000\n\n"
+
+        # Reanudar: lo que quede en el buffer desde el último seq (Last-Event-ID / since)
+        for item in await asyncio.to_thread(live_stream.catch_up, sub, last_sent):
+            yield format_sse(_live_view(item, user_id))
+            last_sent = item["seq"]
+
+        while not sub.closed:
+            if time.monotonic() >= refresh_at:
+                # Cámaras agregadas/borradas desde que se abrió la conexión
+                # (en cada vuelta: con tráfico constante el heartbeat nunca vence)
+                sub.cameras = await asyncio.to_thread(_load_camera_names, user_id)
+                refresh_at = time.monotonic() + LIVE_STREAM_CAMERAS_REFRESH_SECONDS
+            try:
+                item = await asyncio.wait_for(sub.queue.get(), timeout=LIVE_STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": ping\n\n"  # Mantiene viva la conexión a través de proxies
+                continue
+
+            if sub.overflowed:
+                # BACKPRESSURE: la cola se descartó; ponerse al día con lo más nuevo del buffer
+                sub.overflowed = False
+                for missed in await asyncio.to_thread(live_stream.catch_up, sub, last_sent):
+                    yield format_sse(_live_view(missed, user_id))
+                    last_sent = missed["seq"]
+                continue
+
+            if item is None or item["seq"] <= last_sent:
+                continue
+            yield format_sse(_live_view(item, user_id))
+            last_sent = item["seq"]
+    finally:
+        live_stream.unsubscribe(sub)
+        if sub.dropped:
+            logging.info(f"📡 Stream de {sub.customer_id} cerrado ({sub.dropped} eventos descartados por cliente lento)")
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    token: Optional[str] = None,
+    since: int = 0,
+    authorization: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    Eventos en vivo por Server-Sent Events (reemplaza el polling de GET /api/events/).
+
+    EventSource no permite headers, así que el JWT puede ir en ?token=. Al reconectar
+    el navegador manda Last-Event-ID y se reenvía lo que quede en el buffer desde ahí.
+    """
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization.split(None, 1)[1]
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing token")
+
+    user_id, username, cameras = await asyncio.to_thread(_authenticate_stream, token)
+
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    sub = live_stream.subscribe(username, cameras)
+    if sub is None:
+        raise HTTPException(status_code=503, detail="Too many live connections", headers={"Retry-After": "30"})
+
+    return StreamingResponse(
+        _sse_events(request, sub, user_id, max(since, 0)),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # nginx: no bufferear el stream
+        },
+    )
 
 
 @router.get("/db")
@@ -154,45 +449,82 @@ def list_events_db(
     db: Session = Depends(get_db)
 ):
     """Lista eventos de la BD filtrados por cámaras del usuario autenticado"""
-    from app.models.all_models import CameraDB
-
-    # Obtener cámaras del usuario
-    user_cameras = db.query(CameraDB).filter(CameraDB.user_id == current_user.id).all()
-    user_camera_names = {cam.name for cam in user_cameras}
+    # Cámaras del usuario (cacheadas junto con su identidad)
+    user_camera_names = principal_cache.camera_names(db, current_user.id)
 
     # Si el usuario no tiene cámaras, retornar vacío
     if not user_camera_names:
         logging.info(f"🔍 Usuario {current_user.username} no tiene cámaras asignadas.")
         return {"count": 0, "events": []}
 
+    # Índice (user_id, camera, id DESC): el filtro por cámara va en SQL, sin parsear payloads
     rows = (
         db.query(EventDB)
-        .filter(EventDB.user_id == current_user.id)  # Strict Multi-Tenant Filter
+        .filter(
+            EventDB.user_id == current_user.id,  # Strict Multi-Tenant Filter
+            EventDB.camera.in_(user_camera_names),
+        )
         .order_by(EventDB.id.desc())
         .limit(limit)
         .all()
     )
 
-    events = []
-    for row in rows:
-        payload = json.loads(row.payload)
-        camera_name = payload.get("camera")
+    events = [
+        {
+            "id": row.id,
+            "received_at": row.received_at.isoformat() + "Z",
+            "event": row.payload,
+            "snapshot_url": snapshot_url(row.snapshot_hash, current_user.id),
+            "snapshot_base64": row.snapshot_base64,  # LEGACY: solo eventos aún no migrados al store
+        }
+        for row in rows
+    ]
 
-        # Solo incluir eventos de cámaras del usuario
-        if camera_name in user_camera_names:
-            events.append(
-                {
-                    "id": row.id,
-                    "received_at": row.received_at.isoformat() + "Z",
-                    "event": payload,
-                    "snapshot_base64": row.snapshot_base64,  # Incluir snapshot para mostrar en frontend
-                }
-            )
+    logging.info(f"🔍 Consulta DB por usuario {current_user.username}: {len(events)} eventos.")
 
-        # Detener si alcanzamos el límite
-        if len(events) >= limit:
-            break
+    return {"count": len(events), "events": events}
 
-    logging.info(f"🔍 Consulta DB por usuario {current_user.username}: {len(events)} eventos filtrados de {len(rows)} totales.")
 
-    return {"count": len(events), "events": events}
+@router.get("/snapshots/{digest}")
+def get_snapshot(
+    digest: str,
+    u: int = 0,
+    exp: int = 0,
+    sig: str = "",
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Sirve el JPEG de un snapshot desde el snapshot store.
+
+    Las URLs las arma snapshot_url() en los listados del usuario: van firmadas
+    (HMAC) con el id del dueño y vencen en minutos, así funcionan en <img src>
+    sin headers de autenticación pero una URL filtrada (logs de proxies,
+    historial, un enlace compartido) deja de servir enseguida. Además el
+    snapshot tiene que pertenecer a un evento de ese usuario.
+    """
+    if not is_valid_digest(digest) or not verify_snapshot_signature(digest, u, exp, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired snapshot URL")
+
+    # Índice en snapshot_hash: el mismo JPEG puede ser de varios usuarios (store por contenido)
+    owned = db.query(EventDB.id).filter(EventDB.snapshot_hash == digest, EventDB.user_id == u).first()
+    if owned is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+
+    # Antes del 304: un snapshot borrado (retención) no debe seguir "existiendo" por la caché
+    path = snapshot_store.path_for(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+
+    etag = f'"{digest}"'
+    cache_headers = {
+        "ETag": etag,
+        # Imagen privada: caché solo del navegador y solo mientras la URL es válida
+        "Cache-Control": f"private, max-age={max(int(exp - time.time()), 0)}",
+        "Referrer-Policy": "no-referrer",
+    }
+
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=cache_headers)
+
+    return FileResponse(path, media_type="image/jpeg", headers=cache_headers)
@@ -6,18 +6,11 @@ import os
 
 from app.api.endpoints.auth import get_current_user
 from app.models.all_models import UserDB
-from app.db.session import SessionLocal
+from app.db.session import get_db
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # URL de Frigate (desde variable de entorno o por defecto)
 FRIGATE_HOST = os.getenv("FRIGATE_HOST", "http://frigate:5000")
 FRIGATE_API_URL = f"{FRIGATE_HOST}/api"
@@ -6,21 +6,15 @@ import logging
 import os
 from urllib.parse import urlencode
 
-from app.db.session import SessionLocal
+from app.db.session import get_db
 from app.models.all_models import UserDB
+from app.services.principal_cache import principal_cache
 from app.core.security import create_access_token
 from authlib.integrations.starlette_client import OAuth, OAuthError
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # Configuración OAuth
 oauth = OAuth()
 
@@ -82,6 +76,7 @@ def get_or_create_oauth_user(
         if avatar and not user.avatar_url:
             user.avatar_url = avatar
         db.commit()
+        principal_cache.invalidate_user(user.id)
         return user
     
     # Si no existe, buscar por email (puede ser que se registró con otro método)
@@ -96,6 +91,7 @@ def get_or_create_oauth_user(
             if avatar:
                 user.avatar_url = avatar
             db.commit()
+            principal_cache.invalidate_user(user.id)
             return user
     
     # Crear nuevo usuario
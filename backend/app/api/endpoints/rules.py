@@ -1,25 +1,27 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import Dict, Any, List
+from sqlalchemy import or_, tuple_
+from typing import Dict, Any, List, Optional, Tuple
+import base64
 import logging
-import json
 from datetime import datetime
 
-from app.db.session import SessionLocal
+from app.db.session import get_db
 from app.models.all_models import RuleDB, RuleHitDB, UserDB, EventDB
 from app.api.endpoints.events import get_current_user # Reutilizar dependency
 from app.utils.timezone_utils import convert_local_time_to_utc
+from app.services.rule_index import rule_index
+from app.services.snapshot_store import snapshot_url
+from app.services.hit_facets import hit_facets
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def _optional_float(value):
+    """"" / None -> None. A diferencia de los otros campos, 0 es un valor válido (dedup desactivado)."""
+    if value is None or value == "":
+        return None
+    return float(value)
 
 @router.post("/")
 def create_rule(
@@ -50,12 +52,16 @@ def create_rule(
         custom_message=rule.get("custom_message"),
         time_start=time_start,
         time_end=time_end,
+        dedup_window_seconds=_optional_float(rule.get("dedup_window_seconds")),
+        dedup_tolerance=_optional_float(rule.get("dedup_tolerance")),
         user_id=current_user.id,
     )
 
     db.add(new_rule)
     db.commit()
     db.refresh(new_rule)
+    rule_index.invalidate_user(current_user.id)
+    hit_facets.invalidate_user(current_user.id)
 
     logging.info(f"✅ Regla creada: {new_rule.name} (horas convertidas de {user_timezone} a UTC: {time_start} - {time_end})")
     
@@ -92,6 +98,8 @@ def list_rules(
                 "custom_message": r.custom_message,
                 "time_start": r.time_start,
                 "time_end": r.time_end,
+                "dedup_window_seconds": r.dedup_window_seconds,
+                "dedup_tolerance": r.dedup_tolerance,
                 "created_at": r.created_at.isoformat() + "Z",
             }
         )
@@ -99,6 +107,38 @@ def list_rules(
     return {"count": len(result), "rules": result}
 
 
+HITS_MAX_PAGE_SIZE = 100
+
+
+def _encode_cursor(direction: str, triggered_at: datetime, hit_id: int) -> str:
+    """Cursor opaco: 'n' = página siguiente (más viejos), 'p' = anterior (más nuevos)."""
+    raw = f"{direction}|{triggered_at.isoformat()}|{hit_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        direction, triggered_at, hit_id = raw.split("|")
+        if direction not in ("n", "p"):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(triggered_at), int(hit_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _local_to_utc(value: str, user_timezone: str) -> Optional[datetime]:
+    """Fecha del filtro (hora local del usuario, ISO) -> UTC naive como se guarda triggered_at."""
+    try:
+        import pytz
+        local_tz = pytz.timezone(user_timezone)
+        dt_local = local_tz.localize(datetime.fromisoformat(value.replace("Z", "")))
+        return dt_local.astimezone(pytz.UTC).replace(tzinfo=None)
+    except Exception as e:
+        logger.error(f"❌ Error parsing fecha de filtro '{value}': {e}")
+        return None
+
+
 @router.get("/hits")
 def list_rule_hits(
     page: int = 1,
@@ -107,9 +147,24 @@ def list_rule_hits(
     label: List[str] = Query(None),
     start_date: str | None = None,
     end_date: str | None = None,
+    cursor: str | None = None,
+    include_total: bool | None = None,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    """
+    Historial de alertas del usuario, del más nuevo al más viejo.
+
+    Paginación por cursor (keyset sobre (triggered_at, id)): pasar `next_cursor`
+    o `prev_cursor` de la respuesta anterior en `cursor`. El costo de una página
+    no depende de qué tan profunda sea. `page` sin cursor se mantiene por
+    compatibilidad (OFFSET). Las opciones de filtro están en /hits/facets.
+
+    `total` se cuenta por defecto solo sin cursor (primera página o filtros
+    nuevos); las páginas por cursor no lo traen salvo include_total=true.
+    """
+    page_size = max(1, min(page_size, HITS_MAX_PAGE_SIZE))
+
     # Query Base
     query = (
         db.query(RuleHitDB)
@@ -130,127 +185,106 @@ def list_rule_hits(
         query = query.filter(or_(*conditions))
 
     user_timezone = current_user.timezone or "UTC"
-
     if start_date:
-        try:
-            logger.info(f"📅 start_date recibido: {start_date}, Timezone: {user_timezone}")
-            dt_local_str = start_date.replace("Z", "")
-            
-            import pytz
-            local_tz = pytz.timezone(user_timezone)
-            
-            dt_naive = datetime.fromisoformat(dt_local_str)
-            dt_local = local_tz.localize(dt_naive)
-            dt_utc = dt_local.astimezone(pytz.UTC)
-            dt_query = dt_utc.replace(tzinfo=None)
-            
-            logger.info(f"✅ Filtro Start aplicado. Local: {dt_local} -> UTC Query: {dt_query}")
+        dt_query = _local_to_utc(start_date, user_timezone)
+        if dt_query is not None:
             query = query.filter(RuleHitDB.triggered_at >= dt_query)
-        except Exception as e:
-            logger.error(f"❌ Error parsing start_date: {e}")
-            pass
-
     if end_date:
-        try:
-            logger.info(f"📅 end_date recibido: {end_date}, Timezone: {user_timezone}")
-            dt_local_str = end_date.replace("Z", "")
-            import pytz
-            local_tz = pytz.timezone(user_timezone)
-            
-            dt_naive = datetime.fromisoformat(dt_local_str)
-            dt_local = local_tz.localize(dt_naive)
-            dt_utc = dt_local.astimezone(pytz.UTC)
-            dt_query = dt_utc.replace(tzinfo=None)
-
-            logger.info(f"✅ Filtro End aplicado. Local: {dt_local} -> UTC Query: {dt_query}")
+        dt_query = _local_to_utc(end_date, user_timezone)
+        if dt_query is not None:
             query = query.filter(RuleHitDB.triggered_at <= dt_query)
-        except Exception as e:
-            logger.error(f"❌ Error parsing end_date: {e}")
-            pass
 
-    # Total count (antes de paginacion)
-    total_count = query.count()
-    total_pages = (total_count + page_size - 1) // page_size
+    # COUNT(*) recorre todas las alertas del filtro: solo en la primera página, no en cada página
+    if include_total is None:
+        include_total = not cursor
+    total_count = query.count() if include_total else None
 
-    # Order and Pagination
-    rows = (
+    # Proyección: solo las columnas que se muestran, evento y regla en el mismo SELECT
+    page_query = (
         query
-        .order_by(RuleHitDB.id.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all()
-    )
-
-    # Get distinct available options for filter dropdowns
-    # Cameras
-    distinct_cameras_rows = (
-        db.query(RuleDB.camera)
-        .join(RuleHitDB, RuleHitDB.rule_id == RuleDB.id)
-        .filter(RuleDB.user_id == current_user.id)
-        .distinct()
-        .all()
+        .outerjoin(EventDB, EventDB.id == RuleHitDB.event_id)
+        .with_entities(
+            RuleHitDB.id, RuleHitDB.rule_id, RuleHitDB.event_id, RuleHitDB.triggered_at, RuleHitDB.action,
+            RuleDB.name.label("rule_name"),
+            EventDB.id.label("event_row_id"), EventDB.camera, EventDB.label, EventDB.top_score,
+            EventDB.frigate_type, EventDB.snapshot_hash,
+            EventDB.snapshot_base64,  # LEGACY: solo eventos aún no migrados al store (si no, NULL)
+        )
     )
-    unique_cameras = sorted([r[0] for r in distinct_cameras_rows if r[0]])
 
-    # Labels
-    distinct_labels_rows = (
-        db.query(RuleDB.label)
-        .join(RuleHitDB, RuleHitDB.rule_id == RuleDB.id)
-        .filter(RuleDB.user_id == current_user.id)
-        .distinct()
-        .all()
-    )
-    unique_labels_set = set()
-    for r in distinct_labels_rows:
-        if r[0]:
-            # Split commas and strip whitespace: "car, bus" -> ["car", "bus"]
-            parts = [p.strip() for p in r[0].split(',')]
-            unique_labels_set.update(parts)
-    unique_labels = sorted(list(unique_labels_set))
+    newest_first = (RuleHitDB.triggered_at.desc(), RuleHitDB.id.desc())
+    direction = None
+    if cursor:
+        direction, cursor_at, cursor_id = _decode_cursor(cursor)
+        if direction == "n":
+            page_query = page_query.filter(tuple_(RuleHitDB.triggered_at, RuleHitDB.id) < (cursor_at, cursor_id))
+            page_query = page_query.order_by(*newest_first)
+        else:
+            # Página anterior: se recorre hacia adelante y se invierte
+            page_query = page_query.filter(tuple_(RuleHitDB.triggered_at, RuleHitDB.id) > (cursor_at, cursor_id))
+            page_query = page_query.order_by(RuleHitDB.triggered_at.asc(), RuleHitDB.id.asc())
+        rows = page_query.limit(page_size + 1).all()
+    else:
+        # Compatibilidad: page > 1 sin cursor usa OFFSET
+        rows = page_query.order_by(*newest_first).offset((max(page, 1) - 1) * page_size).limit(page_size + 1).all()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == "p":
+        rows.reverse()
+
+    if direction == "p":
+        has_older, has_newer = True, has_more
+    else:
+        has_older, has_newer = has_more, direction == "n" or page > 1
 
     hits = []
-    for h in rows:
-        # Obtener información del evento asociado
+    for r in rows:
         event_data = None
-        snapshot_base64 = None
-        if h.event:
-            try:
-                event_payload = json.loads(h.event.payload)
-                event_data = {
-                    "camera": event_payload.get("camera"),
-                    "label": event_payload.get("label"),
-                    "score": event_payload.get("score") or event_payload.get("top_score"),
-                    "frigate_type": event_payload.get("frigate_type"),
-                }
-                snapshot_base64 = h.event.snapshot_base64
-            except Exception as e:
-                logger.error(f"Error parseando evento {h.event_id}: {e}")
-
-        # Obtener nombre de la regla
-        rule_name = h.rule.name if h.rule else "Desconocida"
+        if r.event_row_id is not None:
+            event_data = {
+                "camera": r.camera,
+                "label": r.label,
+                "score": r.top_score,
+                "frigate_type": r.frigate_type,
+            }
 
         hits.append(
             {
-                "id": h.id,
-                "rule_id": h.rule_id,
-                "rule_name": rule_name,
-                "event_id": h.event_id,
+                "id": r.id,
+                "rule_id": r.rule_id,
+                "rule_name": r.rule_name or "Desconocida",
+                "event_id": r.event_id,
                 "event_data": event_data,
-                "snapshot_base64": snapshot_base64,
-                "triggered_at": h.triggered_at.isoformat() + "Z",
-                "action": h.action,
+                "snapshot_url": snapshot_url(r.snapshot_hash, current_user.id),
+                # LEGACY: migrate_snapshots_to_store.py los mueve al store; un GET no escribe
+                "snapshot_base64": r.snapshot_base64 if not r.snapshot_hash else None,
+                "triggered_at": r.triggered_at.isoformat() + "Z",
+                "action": r.action,
             }
         )
 
-    return {
+    response = {
         "hits": hits,
-        "total": total_count,
-        "page": page,
         "page_size": page_size,
-        "total_pages": total_pages,
-        "cameras": unique_cameras,
-        "labels": unique_labels
+        "next_cursor": _encode_cursor("n", rows[-1].triggered_at, rows[-1].id) if rows and has_older else None,
+        "prev_cursor": _encode_cursor("p", rows[0].triggered_at, rows[0].id) if rows and has_newer else None,
     }
+    if not cursor:
+        response["page"] = page
+    if total_count is not None:
+        response["total"] = total_count
+        response["total_pages"] = (total_count + page_size - 1) // page_size
+    return response
+
+
+@router.get("/hits/facets")
+def list_rule_hit_facets(
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Opciones de los filtros del historial (cámaras y labels con alertas), cacheadas por usuario."""
+    return hit_facets.get(db, current_user.id)
 
 
 @router.patch("/{rule_id}")
@@ -286,6 +320,10 @@ def update_rule(
         rule.min_duration_seconds = float(data["min_duration_seconds"]) if data["min_duration_seconds"] else None
     if "custom_message" in data:
         rule.custom_message = data["custom_message"] if data["custom_message"] else None
+    if "dedup_window_seconds" in data:
+        rule.dedup_window_seconds = _optional_float(data["dedup_window_seconds"])
+    if "dedup_tolerance" in data:
+        rule.dedup_tolerance = _optional_float(data["dedup_tolerance"])
     
     # Convertir horas de la zona horaria del usuario a UTC
     user_timezone = current_user.timezone or "UTC"
@@ -302,6 +340,8 @@ def update_rule(
 
     db.commit()
     db.refresh(rule)
+    rule_index.invalidate_user(current_user.id)
+    hit_facets.invalidate_user(current_user.id)
     
     logging.info(f"✅ Regla actualizada: {rule.name} (horas convertidas de {user_timezone} a UTC)")
 
@@ -319,6 +359,8 @@ def update_rule(
             "custom_message": rule.custom_message,
             "time_start": rule.time_start,
             "time_end": rule.time_end,
+            "dedup_window_seconds": rule.dedup_window_seconds,
+            "dedup_tolerance": rule.dedup_tolerance,
         },
     }
 
@@ -339,6 +381,8 @@ def _delete_rule_internal(rule_id: int, current_user: UserDB, db: Session):
     rule.enabled = False
     
     db.commit()
+    rule_index.invalidate_user(current_user.id)
+    hit_facets.invalidate_user(current_user.id)
 
     logger.info(f"Regla {rule_id} marcada como eliminada (Soft Delete)")
     return {"status": "ok", "message": "Rule deleted successfully (Soft Delete)"}
@@ -0,0 +1,208 @@
+"""
+Métricas del proceso en formato de texto de Prometheus (GET /metrics).
+
+Sin dependencias: contadores, gauges e histogramas propios.
+
+- Registrar un valor no toma locks: cada thread escribe en su propio
+  "shard" (threading.local) y GET /metrics suma todos los shards al leer.
+  Solo la PRIMERA escritura de cada thread toma un lock para registrar su shard.
+- El event loop de la API es un solo thread, así que la ingesta asíncrona
+  escribe siempre en el mismo shard.
+- Con varios workers de gunicorn cada proceso tiene sus propias métricas (el
+  label `pid` de process_info permite distinguirlos al scrapear).
+
+Uso:
+    REQUESTS = Counter("app_requests_total", "Requests", ["route"])
+    REQUESTS.inc(route="/api/events/")
+    LATENCY = Histogram("app_latency_seconds", "Latencia", buckets=LATENCY_BUCKETS)
+    LATENCY.observe(0.012)
+"""
+
+import bisect
+import math
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Buckets por defecto (segundos) para latencias de la API y de la BD
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+_REGISTRY: List["_Metric"] = []
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        with _REGISTRY_LOCK:
+            _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: se esperaban los labels {self.labelnames}, llegaron {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Sharded(_Metric):
+    """Un dict por thread; la lectura suma todos los dicts."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:  # Solo una vez por thread
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _snapshot(self) -> List[dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # Copia de cada dict: otro thread puede estar agregando una clave nueva
+        return [dict(s) for s in shards]
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        return sum(s.get(key, 0) for s in self._snapshot())
+
+    def render(self) -> List[str]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        if not totals and not self.labelnames:
+            totals[()] = 0  # Sin labels: exponer 0 en vez de nada (rate() necesita la serie)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(totals.items())
+        ]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        data = shard.get(key)
+        if data is None:
+            # [cuenta por bucket (+Inf al final), suma, total]
+            data = shard[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def render(self) -> List[str]:
+        totals: Dict[LabelValues, list] = {}
+        for shard in self._snapshot():
+            for key, (counts, total, count) in shard.items():
+                acc = totals.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                for i, c in enumerate(counts):
+                    acc[0][i] += c
+                acc[1] += total
+                acc[2] += count
+
+        lines = []
+        for key, (counts, total, count) in sorted(totals.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valor actual. Con `fn` se calcula al leer (p.ej. conexiones en uso del pool)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._fn = fn
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value  # Asignación atómica, sin lock
+
+    def render(self) -> List[str]:
+        values = dict(self._values)
+        if self._fn is not None:
+            try:
+                values.update(self._fn())
+            except Exception:
+                pass  # Un gauge que falla no rompe el resto del scrape
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+def render_latest() -> str:
+    """Todas las métricas registradas en formato de texto de Prometheus 0.0.4."""
+    with _REGISTRY_LOCK:
+        metrics = list(_REGISTRY)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# pid al leer (no al importar): con gunicorn --preload el módulo se importa antes del fork
+PROCESS_INFO = Gauge("process_info", "Proceso (worker) que respondió el scrape", ["pid"],
+                     fn=lambda: {(str(os.getpid()),): 1})
@@ -0,0 +1,263 @@
+"""
+Trazas de latencia de punta a punta: Frigate -> listener -> backend -> WhatsApp.
+
+Cuando un cliente dice "la alerta llegó tarde" hay que saber en qué etapa se
+fue el tiempo. Cada evento 'end' lleva un contexto W3C (`traceparent`) que
+crea el listener al recibirlo por MQTT y que viaja:
+
+- en el body del evento (campo "traceparent", sirve también para /batch),
+- en el header HTTP `traceparent` de los POST de un solo evento,
+- al pool de evaluación (argumento de evaluate_rules),
+- a la cola de notificaciones (columna notification_outbox.traceparent).
+
+Spans del backend: snapshot_store, db_insert, rule_evaluation, whatsapp_send
+(los del listener: mqtt_receive, snapshot_download, snapshot_compress, cloud_post).
+Si el evento llega sin contexto (listener viejo) el backend abre la traza.
+
+Exportación (un thread aparte, nunca en el camino del request):
+- JSONL local (TRACE_EXPORT_PATH), una línea por span; `python trace_report.py`
+  calcula p50/p95/p99 por etapa juntando el archivo del listener y el del backend.
+- OTLP/HTTP JSON (TRACE_OTLP_ENDPOINT, p.ej. http://otel-collector:4318/v1/traces)
+  para Jaeger/Tempo/Honeycomb.
+Si la cola del exportador se llena, los spans se descartan (trace_spans_dropped_total).
+
+Configuración (variables de entorno):
+    TRACING_ENABLED          "false" (default) / "true"
+    TRACE_SAMPLE_RATE        Fracción de trazas nuevas que se registran (default 1.0)
+    TRACE_EXPORT_PATH        Archivo JSONL (default traces/backend-spans.jsonl, vacío = no escribir)
+    TRACE_OTLP_ENDPOINT      URL OTLP/HTTP (vacío = no enviar)
+    TRACE_SERVICE_NAME       service.name de los spans (default "backend")
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.core.metrics import Counter
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces/backend-spans.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "backend")
+
+_QUEUE_SIZE = 10000
+_EXPORT_BATCH = 512
+_EXPORT_INTERVAL = 1.0
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+SPANS_DROPPED = Counter("trace_spans_dropped_total", "Spans descartados por cola de exportación llena")
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """Contexto a partir de un header/campo traceparent; None si falta o es inválido."""
+    if not value or not isinstance(value, str):
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return SpanContext(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1))
+
+
+def _span_id() -> str:
+    return f"{random.getrandbits(64) or 1:016x}"
+
+
+def new_trace() -> SpanContext:
+    """Raíz de una traza nueva, muestreada según TRACE_SAMPLE_RATE."""
+    return SpanContext(f"{random.getrandbits(128) or 1:032x}", _span_id(), random.random() < TRACE_SAMPLE_RATE)
+
+
+def child_of(parent: Optional[SpanContext]) -> SpanContext:
+    """Contexto para un span hijo (o una traza nueva si no hay padre)."""
+    if parent is None:
+        return new_trace()
+    return SpanContext(parent.trace_id, _span_id(), parent.sampled)
+
+
+class Span:
+    """Span en curso: se exporta al llamar end(). Si no se muestrea, end() no hace nada."""
+
+    __slots__ = ("name", "context", "parent_id", "start", "attributes")
+
+    def __init__(self, name: str, context: SpanContext, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.attributes = attributes
+
+    @property
+    def traceparent(self) -> Optional[str]:
+        return self.context.traceparent if self.context is not None else None
+
+    def end(self, **attributes):
+        if self.context is None or not self.context.sampled:
+            return
+        self.attributes.update(attributes)
+        _export(self.name, self.context, self.parent_id, self.start, time.time(), self.attributes)
+
+
+_NOOP_SPAN = Span("noop", None, None, {})
+
+
+def start_span(name: str, parent: Optional[SpanContext] = None, **attributes) -> Span:
+    """Abre un span hijo de `parent` (o raíz de una traza nueva). Sin tracing es un no-op."""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    context = child_of(parent)
+    return Span(name, context, parent.span_id if parent else None, attributes)
+
+
+def record_span(name: str, context: SpanContext, parent: Optional[SpanContext],
+                start: float, end: float, **attributes):
+    """Registra un span ya medido (tiempos de pared en segundos)."""
+    if not TRACING_ENABLED or context is None or not context.sampled:
+        return
+    _export(name, context, parent.span_id if parent else None, start, end, attributes)
+
+
+# ---------- Exportación ----------
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    spans = []
+    for r in records:
+        span = {
+            "traceId": r["trace_id"],
+            "spanId": r["span_id"],
+            "name": r["name"],
+            "kind": 1,  # INTERNAL
+            "startTimeUnixNano": str(int(r["start"] * 1e9)),
+            "endTimeUnixNano": str(int(r["end"] * 1e9)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in r["attrs"].items() if v is not None],
+        }
+        if r["parent_id"]:
+            span["parentSpanId"] = r["parent_id"]
+        spans.append(span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "frigate-alerts"}, "spans": spans}],
+    }]}
+
+
+class _Exporter:
+    def __init__(self):
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+
+    def put(self, record: Dict[str, Any]):
+        # Después de un fork (gunicorn --preload) el thread del padre no existe en el hijo
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            SPANS_DROPPED.inc()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=_QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + _EXPORT_INTERVAL
+            while len(batch) < _EXPORT_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        if TRACE_EXPORT_PATH:
+            try:
+                directory = os.path.dirname(TRACE_EXPORT_PATH)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as fh:
+                    fh.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in batch))
+            except OSError as e:
+                logging.error(f"❌ No se pudieron escribir las trazas en {TRACE_EXPORT_PATH}: {e}")
+        if TRACE_OTLP_ENDPOINT:
+            try:
+                if self._client is None:
+                    import httpx
+                    self._client = httpx.Client(timeout=5.0)
+                resp = self._client.post(TRACE_OTLP_ENDPOINT, json=_otlp_payload(batch))
+                if resp.status_code >= 300:
+                    logging.warning(f"⚠️ Colector OTLP respondió {resp.status_code}: {resp.text[:200]}")
+            except Exception as e:
+                logging.warning(f"⚠️ No se pudieron enviar {len(batch)} spans a {TRACE_OTLP_ENDPOINT}: {e}")
+
+    def flush(self, timeout: float = 5.0):
+        """Exporta lo que quede en la cola (apagado)."""
+        batch = []
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+
+_exporter = _Exporter()
+
+
+def _export(name: str, context: SpanContext, parent_id: Optional[str], start: float, end: float,
+            attributes: Dict[str, Any]):
+    _exporter.put({
+        "trace_id": context.trace_id,
+        "span_id": context.span_id,
+        "parent_id": parent_id,
+        "name": name,
+        "service": TRACE_SERVICE_NAME,
+        "start": round(start, 6),
+        "end": round(end, 6),
+        "duration_ms": round((end - start) * 1000, 3),
+        "attrs": attributes,
+    })
+
+
+def flush():
+    if TRACING_ENABLED:
+        _exporter.flush()
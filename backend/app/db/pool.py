@@ -0,0 +1,106 @@
+"""
+Pool de conexiones instrumentado (motores sync y async).
+
+En Railway, durante ráfagas de eventos, el pool se agotaba y solo se notaba
+cuando los requests empezaban a fallar por timeout. Ahora se ve en /metrics:
+
+- db_pool_checkout_seconds       tiempo esperando una conexión del pool
+                                 (incluye el pre-ping y abrir una nueva).
+- db_pool_checkout_timeouts_total  veces que se agotó DB_POOL_TIMEOUT.
+- db_pool_connections            conexiones en uso / libres / overflow / tamaño.
+- db_statement_seconds           duración de cada statement.
+- db_slow_statements_total       statements más lentos que DB_SLOW_QUERY_MS,
+                                 que además se loguean (recortados).
+
+Cada statement también se suma al scope de app/db/query_counter.py (queries
+por request / tarea de fondo).
+"""
+
+import logging
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.core.metrics import Counter, Gauge, Histogram
+from app.db import query_counter
+
+CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds", "Espera para obtener una conexión del pool", ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+CHECKOUT_TIMEOUTS = Counter("db_pool_checkout_timeouts_total", "Timeouts esperando una conexión del pool", ["engine"])
+STATEMENT_SECONDS = Histogram("db_statement_seconds", "Duración de los statements SQL", ["engine"])
+SLOW_STATEMENTS = Counter("db_slow_statements_total", "Statements más lentos que DB_SLOW_QUERY_MS", ["engine"])
+
+_ENGINES = {}  # nombre -> motor (el pool se lee al scrapear: dispose() lo reemplaza)
+
+
+def _pool_status():
+    values = {}
+    for name, engine in list(_ENGINES.items()):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "checked_in")] = pool.checkedin()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+        values[(name, "size")] = pool.size()
+    return values
+
+
+POOL_CONNECTIONS = Gauge("db_pool_connections", "Estado del pool de conexiones", ["engine", "state"], fn=_pool_status)
+
+
+class _InstrumentedPoolMixin:
+    metrics_name = "sync"
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            CHECKOUT_TIMEOUTS.inc(engine=self.metrics_name)
+            logging.error(
+                f"🚰 Pool de BD '{self.metrics_name}' agotado: {self.checkedout()} conexiones en uso "
+                f"(size {self.size()}, overflow {self.overflow()})"
+            )
+            raise
+        finally:
+            CHECKOUT_SECONDS.observe(time.perf_counter() - started, engine=self.metrics_name)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def instrument_engine(engine: Engine, name: str, slow_query_ms: float):
+    """Tiempo por statement + log de los lentos. `engine` es el motor sync (async_engine.sync_engine)."""
+    _ENGINES[name] = engine
+    slow_seconds = slow_query_ms / 1000.0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started_at"].pop()
+        elapsed = time.perf_counter() - started
+        STATEMENT_SECONDS.observe(elapsed, engine=name)
+        query_counter.record(statement, elapsed)
+        if slow_seconds > 0 and elapsed >= slow_seconds:
+            SLOW_STATEMENTS.inc(engine=name)
+            logging.warning(f"🐢 Query lenta ({elapsed * 1000:.0f} ms, {name}): {' '.join(statement.split())[:300]}")
+
+    @event.listens_for(engine, "handle_error")
+    def _discard_timer(context):
+        # El statement falló: after_cursor_execute no corre, sacar su marca de tiempo
+        conn = context.connection
+        if conn is not None and conn.info.get("query_started_at"):
+            conn.info["query_started_at"].pop()
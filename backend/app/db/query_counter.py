@@ -0,0 +1,205 @@
+"""
+Conteo de queries por request y por tarea de fondo (detector de N+1).
+
+Varios endpoints tenían queries escondidas por fila (lazy loads, una consulta
+por cámara...) que solo se notaban con muchos datos. Cada statement que pasa
+por los hooks de app/db/pool.py se suma al "scope" activo:
+
+- Requests HTTP: QueryCountMiddleware abre un scope por request. Las
+  queries de endpoints async, de endpoints sync (threadpool) y de
+  asyncio.to_thread caen en el mismo scope (contextvars).
+- Tareas de fondo: el pool de evaluación de reglas, el sender de
+  notificaciones y la retención abren su propio scope con query_scope().
+
+Al cerrar el scope:
+- si supera el presupuesto se loguea un warning (🔢) con el total y el tiempo,
+- si un mismo statement se repitió QUERY_REPEAT_THRESHOLD veces o más se
+  loguea como posible N+1 (🔁), con el SQL,
+- y se cuentan ambos casos en /metrics.
+
+Con QUERY_DEBUG_HEADERS=true cada respuesta lleva `X-DB-Queries`,
+`X-DB-Time-Ms` y `Server-Timing: db;dur=...` (visible en las devtools del
+navegador). El stream SSE no se mide: una conexión dura horas.
+
+En tests:
+    with assert_max_queries(3):
+        client.get("/api/cameras/")
+
+Configuración (variables de entorno):
+    QUERY_BUDGET_REQUEST       Queries por request antes de avisar (default 20, 0 = sin límite)
+    QUERY_BUDGET_TASK          Queries por tarea de fondo antes de avisar (default 50, 0 = sin límite)
+    QUERY_REPEAT_THRESHOLD     Repeticiones del mismo statement que cuentan como N+1 (default 10, 0 = no detectar)
+    QUERY_DEBUG_HEADERS        "false" (default) / "true"
+"""
+
+import contextvars
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from app.core.metrics import Counter
+
+QUERY_BUDGET_REQUEST = int(os.getenv("QUERY_BUDGET_REQUEST", "20"))
+QUERY_BUDGET_TASK = int(os.getenv("QUERY_BUDGET_TASK", "50"))
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "10"))
+QUERY_DEBUG_HEADERS = os.getenv("QUERY_DEBUG_HEADERS", "false").lower() == "true"
+
+_MAX_DISTINCT_STATEMENTS = 200  # Por scope: statements distintos que se siguen para detectar repeticiones
+
+BUDGET_EXCEEDED = Counter("db_query_budget_exceeded_total", "Requests/tareas que superaron su presupuesto de queries", ["kind"])
+REPEATED_STATEMENTS = Counter("db_repeated_statements_total", "Requests/tareas con un statement repetido (posible N+1)", ["kind"])
+
+
+class QueryStats:
+    """Queries de un scope: total, tiempo y repeticiones por statement."""
+
+    __slots__ = ("name", "kind", "count", "seconds", "statements")
+
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Dict[str, int] = {}
+
+    def add(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        repeats = self.statements.get(statement)
+        if repeats is not None:
+            self.statements[statement] = repeats + 1
+        elif len(self.statements) < _MAX_DISTINCT_STATEMENTS:
+            self.statements[statement] = 1
+
+    def merge(self, other: "QueryStats"):
+        self.count += other.count
+        self.seconds += other.seconds
+        for statement, repeats in other.statements.items():
+            if statement in self.statements or len(self.statements) < _MAX_DISTINCT_STATEMENTS:
+                self.statements[statement] = self.statements.get(statement, 0) + repeats
+
+    def most_repeated(self) -> Optional[tuple]:
+        if not self.statements:
+            return None
+        statement = max(self.statements, key=self.statements.get)
+        return statement, self.statements[statement]
+
+    def summary(self, limit: int = 10) -> str:
+        top = sorted(self.statements.items(), key=lambda kv: -kv[1])[:limit]
+        return "\n".join(f"  {n}× {_short(s)}" for s, n in top)
+
+
+_current: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar("query_stats", default=None)
+
+# Capturas globales (assert_max_queries): ven los statements de todos los threads
+_captures: List[QueryStats] = []
+_captures_lock = threading.Lock()
+
+
+def _short(statement: str, length: int = 300) -> str:
+    return " ".join(statement.split())[:length]
+
+
+def record(statement: str, seconds: float):
+    """Lo llama el hook after_cursor_execute de cada motor (app/db/pool.py)."""
+    stats = _current.get()
+    if stats is not None:
+        stats.add(statement, seconds)
+    if _captures:
+        for capture in list(_captures):
+            capture.add(statement, seconds)
+
+
+def current() -> Optional[QueryStats]:
+    return _current.get()
+
+
+def _check(stats: QueryStats, budget: int):
+    if budget and stats.count > budget:
+        BUDGET_EXCEEDED.inc(kind=stats.kind)
+        logging.warning(
+            f"🔢 {stats.name}: {stats.count} queries ({stats.seconds * 1000:.0f} ms), presupuesto {budget}"
+        )
+    repeated = stats.most_repeated()
+    if QUERY_REPEAT_THRESHOLD and repeated and repeated[1] >= QUERY_REPEAT_THRESHOLD:
+        REPEATED_STATEMENTS.inc(kind=stats.kind)
+        logging.warning(f"🔁 Posible N+1 en {stats.name}: {repeated[1]}× {_short(repeated[0])}")
+
+
+@contextmanager
+def query_scope(name: str, kind: str = "task", budget: Optional[int] = None):
+    """
+    Cuenta las queries del bloque (o de la función, usado como decorador) y
+    avisa al salir si supera `budget` (default: QUERY_BUDGET_TASK / _REQUEST según kind).
+    Un scope anidado suma sus queries al de afuera.
+    """
+    if budget is None:
+        budget = QUERY_BUDGET_REQUEST if kind == "request" else QUERY_BUDGET_TASK
+    stats = QueryStats(name, kind)
+    parent = _current.get()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if parent is not None:
+            parent.merge(stats)
+        _check(stats, budget)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, label: str = "bloque"):
+    """
+    Helper de tests: falla si el bloque ejecuta más de `max_queries` statements.
+
+    Cuenta en TODOS los threads (TestClient atiende el request en otro thread),
+    así que no debe haber otra carga en paralelo mientras se mide.
+    """
+    stats = QueryStats(label, "test")
+    with _captures_lock:
+        _captures.append(stats)
+    try:
+        yield stats
+    finally:
+        with _captures_lock:
+            _captures.remove(stats)
+    if stats.count > max_queries:
+        raise AssertionError(
+            f"{label}: {stats.count} queries, se esperaban como máximo {max_queries}\n{stats.summary()}"
+        )
+
+
+class QueryCountMiddleware:
+    """Middleware ASGI: un scope de queries por request HTTP (y headers de debug si están activos)."""
+
+    skip_paths = ("/api/events/stream",)
+
+    def __init__(self, app, debug_headers: bool = QUERY_DEBUG_HEADERS, budget: int = QUERY_BUDGET_REQUEST):
+        self.app = app
+        self.debug_headers = debug_headers
+        self.budget = budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{scope['method']} {scope['path']}"
+        with query_scope(name, kind="request", budget=self.budget) as stats:
+            if not self.debug_headers:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_headers(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    elapsed_ms = stats.seconds * 1000
+                    headers.append((b"x-db-queries", str(stats.count).encode()))
+                    headers.append((b"x-db-time-ms", f"{elapsed_ms:.1f}".encode()))
+                    headers.append((b"server-timing", f'db;dur={elapsed_ms:.1f};desc="{stats.count} queries"'.encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_headers)
@@ -1,16 +1,98 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 import os
 
+from app.db.pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool, instrument_engine
+
 # ================== BASE DE DATOS (PostgreSQL / SQLite) ==================
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///events.db")
 
+# ================== POOL DE CONEXIONES ==================
+# Un solo pool por proceso para la API, la evaluación de reglas y los jobs.
+# DB_POOL_SIZE + DB_MAX_OVERFLOW debe cubrir los threads de la API más RULE_EVAL_WORKERS,
+# y (size + overflow) * workers de gunicorn no puede pasar el max_connections de Postgres.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # Segundos esperando una conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Railway/proxies cortan conexiones ociosas
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # 0 = sin límite (solo PostgreSQL)
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))  # 0 = no loguear queries lentas
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+def _pool_kwargs(poolclass) -> dict:
+    if IS_SQLITE:
+        return {}  # SQLite: pool por defecto, sin red de por medio
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
 connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     connect_args = {"check_same_thread": False}
+elif DB_STATEMENT_TIMEOUT_MS > 0:
+    # psycopg2 / libpq: se fija al abrir cada conexión
+    connect_args = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
 
 engine = create_engine(
     DATABASE_URL,
-    connect_args=connect_args
+    connect_args=connect_args,
+    **_pool_kwargs(InstrumentedQueuePool)
 )
+instrument_engine(engine, "sync", DB_SLOW_QUERY_MS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def get_db():
+    """
+    Dependency de FastAPI: una sesión por request.
+    Todos los routers usan esta misma función, así FastAPI la resuelve UNA vez por
+    request (get_current_user y el endpoint comparten sesión y conexión).
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# ================== MOTOR ASÍNCRONO (ruta de ingesta) ==================
+# Mismo DATABASE_URL, pero con drivers async: asyncpg (PostgreSQL) / aiosqlite (SQLite).
+# Se puede forzar otro con ASYNC_DATABASE_URL.
+def to_async_url(url: str) -> str:
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend == "postgresql":
+        query = dict(u.query)
+        # asyncpg no entiende 'sslmode' (libpq); su equivalente es 'ssl'
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        u = u.set(drivername="postgresql+asyncpg", query=query)
+    elif backend == "sqlite":
+        u = u.set(drivername="sqlite+aiosqlite")
+    return u.render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+async_connect_args = {}
+if not IS_SQLITE and DB_STATEMENT_TIMEOUT_MS > 0 and ASYNC_DATABASE_URL.startswith("postgresql+asyncpg"):
+    async_connect_args = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args=async_connect_args,
+    **_pool_kwargs(InstrumentedAsyncQueuePool)
+)
+instrument_engine(async_engine.sync_engine, "async", DB_SLOW_QUERY_MS)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.base import Base
@@ -29,21 +30,49 @@ class UserDB(Base):
     # Se usa para convertir horas de reglas de la zona horaria local a UTC
     timezone = Column(String(50), nullable=True, default="UTC")
 
+    # Días que se guardan sus eventos/alertas (NULL = EVENTS_RETENTION_DAYS, ver services/retention.py)
+    retention_days = Column(Integer, nullable=True)
+
     rules = relationship("RuleDB", back_populates="user")
 
 
 class EventDB(Base):
     __tablename__ = "events"
 
+    # En PostgreSQL la tabla está particionada por received_at y su PK en la BD es
+    # (id, received_at) (migración d0e1f2a3b4c5; los ids salen de la misma secuencia).
+    # Al ORM le alcanza con id como clave de identidad.
     id = Column(Integer, primary_key=True, index=True)
     received_at = Column(DateTime, index=True)
-    payload = Column(Text)
-    snapshot_base64 = Column(Text, nullable=True)  # Snapshot en base64
+    payload = Column(JSON().with_variant(JSONB(), "postgresql"))  # Evento normalizado completo (dict)
+
+    # Campos extraídos del payload para filtrar/ordenar con índices (ver services/event_fields.py)
+    camera = Column(String(255), nullable=True)
+    label = Column(String(100), nullable=True)
+    frigate_event_id = Column(String(100), nullable=True, index=True)  # "event_id" de Frigate
+    frigate_type = Column(String(20), nullable=True)
+    top_score = Column(Float, nullable=True)
+    start_time = Column(Float, nullable=True)  # Epoch (segundos), como lo manda Frigate
+    end_time = Column(Float, nullable=True)
+    duration_seconds = Column(Float, nullable=True)
+
+    snapshot_base64 = Column(Text, nullable=True)  # LEGACY: snapshots viejos en base64 (ver migrate_snapshots_to_store.py)
+    snapshot_hash = Column(String(64), nullable=True, index=True)  # SHA-256 en el snapshot store
+    snapshot_size = Column(Integer, nullable=True)  # Bytes del JPEG
     
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     user = relationship("UserDB")
 
-    rule_hits = relationship("RuleHitDB", back_populates="event")
+    rule_hits = relationship(
+        "RuleHitDB", back_populates="event", primaryjoin="EventDB.id == foreign(RuleHitDB.event_id)"
+    )
+
+    __table_args__ = (
+        # Listados por usuario (y cámara / etiqueta), del más nuevo al más viejo
+        Index("ix_events_user_id_id", "user_id", id.desc()),
+        Index("ix_events_user_camera_id", "user_id", "camera", id.desc()),
+        Index("ix_events_user_label_id", "user_id", "label", id.desc()),
+    )
 
 
 class CameraDB(Base):
@@ -61,6 +90,29 @@ class CameraDB(Base):
     user = relationship("UserDB")
 
 
+class CameraLatestStateDB(Base):
+    """Último evento (y último snapshot) de cada cámara de cada usuario.
+
+    La ingesta lo actualiza con un upsert en la misma transacción que los
+    eventos, así la grilla de cámaras sale de UNA consulta por clave primaria
+    sin recorrer el historial de eventos.
+    """
+    __tablename__ = "camera_latest_state"
+
+    user_id = Column(Integer, primary_key=True)
+    camera = Column(String(255), primary_key=True)
+
+    last_event_id = Column(Integer, nullable=True)
+    last_event_at = Column(DateTime, nullable=True)
+    last_label = Column(String(100), nullable=True)
+
+    # Último evento CON snapshot (puede ser más viejo que el último evento)
+    snapshot_event_id = Column(Integer, nullable=True)
+    snapshot_hash = Column(String(64), nullable=True)
+    snapshot_at = Column(DateTime, nullable=True)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 
 class RuleDB(Base):
     __tablename__ = "rules"
@@ -81,6 +133,11 @@ class RuleDB(Base):
     time_start = Column(String(5), nullable=True)  # Hora de inicio (ej: "08:00")
     time_end = Column(String(5), nullable=True)   # Hora de fin (ej: "22:00")
 
+    # Anti-spam: segundos en los que un hit "igual" se descarta (NULL = 60, 0 = desactivado)
+    dedup_window_seconds = Column(Float, nullable=True)
+    # Distancia mínima entre centroides como fracción del cuadro (NULL = 0.05; cajas en píxeles: x1000)
+    dedup_tolerance = Column(Float, nullable=True)
+
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # dueño de la regla (multiusuario)
@@ -93,11 +150,53 @@ class RuleDB(Base):
 class RuleHitDB(Base):
     __tablename__ = "rule_hits"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True)  # Como events: en PostgreSQL la PK es (id, triggered_at) (particionada)
     rule_id = Column(Integer, ForeignKey("rules.id"))
-    event_id = Column(Integer, ForeignKey("events.id"))
+    # Sin ForeignKey: en PostgreSQL events está particionada (migración d0e1f2a3b4c5)
+    # y no puede ser destino de una FK; la retención borra las alertas junto con sus eventos
+    event_id = Column(Integer)
     triggered_at = Column(DateTime, default=datetime.utcnow)
     action = Column(String(255), default="whatsapp")
 
     rule = relationship("RuleDB", back_populates="hits")
-    event = relationship("EventDB", back_populates="rule_hits")
+    event = relationship("EventDB", back_populates="rule_hits", primaryjoin="foreign(RuleHitDB.event_id) == EventDB.id")
+
+    __table_args__ = (
+        Index("ix_rule_hits_rule_id_id", "rule_id", id.desc()),
+        # Historial paginado por cursor (triggered_at, id), recorriendo solo las reglas del usuario
+        Index("ix_rule_hits_rule_triggered_at_id", "rule_id", triggered_at.desc(), id.desc()),
+        Index("ix_rule_hits_triggered_at_id", triggered_at.desc(), id.desc()),
+        Index("ix_rule_hits_event_id", "event_id"),
+    )
+
+
+class NotificationOutboxDB(Base):
+    """Cola persistente de notificaciones salientes (WhatsApp).
+
+    El motor de reglas solo inserta filas aquí; el NotificationSender las envía
+    de forma asíncrona, con reintentos, así un reinicio no pierde alertas.
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # pending -> sending -> sent | failed
+    status = Column(String(20), nullable=False, default="pending", index=True)
+    channel = Column(String(20), nullable=False, default="whatsapp")
+    to_number = Column(String(50), nullable=False)
+    message = Column(Text, nullable=False)
+
+    # Contexto (sin FK: la cola no debe bloquear limpiezas de eventos/reglas)
+    event_id = Column(Integer, nullable=True)  # Para adjuntar el snapshot del evento
+    snapshot_hash = Column(String(64), nullable=True)  # Snapshot en el store (sin volver a leer el evento)
+    rule_id = Column(Integer, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    traceparent = Column(String(55), nullable=True)  # Contexto W3C de la traza del evento (app/core/tracing.py)
+
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    provider_message_id = Column(String(255), nullable=True)
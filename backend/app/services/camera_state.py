@@ -0,0 +1,159 @@
+"""
+Estado "último evento / último snapshot" por cámara (tabla camera_latest_state).
+
+Antes list_cameras hacía, por CADA cámara, una consulta ordenada por id sobre
+events. Ahora la ingesta mantiene una fila por (usuario, cámara) con un upsert
+en la misma transacción que inserta los eventos, y la grilla de cámaras lee
+todas sus filas con una sola consulta por clave primaria.
+
+El upsert es monótono (solo avanza si el id del evento es mayor), así que dos
+ingestas concurrentes que confirman en otro orden no retroceden el estado.
+Las filas van ordenadas por (user_id, camera): dos lotes que tocan las mismas
+cámaras toman los locks de fila en el mismo orden y no pueden hacer deadlock.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.orm import Session
+
+from app.models.all_models import CameraLatestStateDB, EventDB
+
+_STATE = CameraLatestStateDB.__table__
+
+
+def latest_state_rows(events: Iterable[EventDB]) -> List[Dict[str, Any]]:
+    """Una fila por (user_id, cámara) con el evento más nuevo y el snapshot más nuevo del lote."""
+    rows: Dict[Tuple[int, str], Dict[str, Any]] = {}
+    now = datetime.utcnow()
+    for event in events:
+        if event.user_id is None or not event.camera:
+            continue
+        key = (event.user_id, event.camera)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {
+                "user_id": event.user_id,
+                "camera": event.camera,
+                "last_event_id": None,
+                "last_event_at": None,
+                "last_label": None,
+                "snapshot_event_id": None,
+                "snapshot_hash": None,
+                "snapshot_at": None,
+                "updated_at": now,
+            }
+        if row["last_event_id"] is None or event.id > row["last_event_id"]:
+            row.update(last_event_id=event.id, last_event_at=event.received_at, last_label=event.label)
+        has_snapshot = event.snapshot_hash is not None or event.snapshot_base64 is not None
+        if has_snapshot and (row["snapshot_event_id"] is None or event.id > row["snapshot_event_id"]):
+            row.update(snapshot_event_id=event.id, snapshot_hash=event.snapshot_hash, snapshot_at=event.received_at)
+    # Orden fijo de locks en Postgres (ver docstring del módulo)
+    return [rows[key] for key in sorted(rows)]
+
+
+def _dialect_insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"camera_latest_state: upsert no soportado para {dialect_name}")
+    return insert
+
+
+def upsert_statement(dialect_name: str, rows: List[Dict[str, Any]]):
+    """INSERT ... ON CONFLICT (user_id, camera) DO UPDATE, avanzando solo con ids mayores."""
+    stmt = _dialect_insert(dialect_name)(_STATE).values(rows)
+    new = stmt.excluded
+    newer_event = func.coalesce(_STATE.c.last_event_id, 0) < new.last_event_id
+    newer_snapshot = and_(
+        new.snapshot_event_id.isnot(None),
+        func.coalesce(_STATE.c.snapshot_event_id, 0) < new.snapshot_event_id,
+    )
+
+    def pick(column: str, condition):
+        return case((condition, new[column]), else_=_STATE.c[column])
+
+    return stmt.on_conflict_do_update(
+        index_elements=[_STATE.c.user_id, _STATE.c.camera],
+        set_={
+            "last_event_id": pick("last_event_id", newer_event),
+            "last_event_at": pick("last_event_at", newer_event),
+            "last_label": pick("last_label", newer_event),
+            "snapshot_event_id": pick("snapshot_event_id", newer_snapshot),
+            "snapshot_hash": pick("snapshot_hash", newer_snapshot),
+            "snapshot_at": pick("snapshot_at", newer_snapshot),
+            "updated_at": new.updated_at,
+        },
+    )
+
+
+async def record_events(db, events: List[EventDB]):
+    """Actualiza el estado con eventos recién insertados (ya con id). No hace commit."""
+    rows = latest_state_rows(events)
+    if rows:
+        await db.execute(upsert_statement(db.bind.dialect.name, rows))
+
+
+def _state_columns():
+    return (
+        EventDB.id, EventDB.user_id, EventDB.camera, EventDB.received_at, EventDB.label,
+        EventDB.snapshot_hash,
+        # Solo importa SI hay base64 legacy, no traerlo
+        case((EventDB.snapshot_base64.isnot(None), 1)).label("snapshot_base64"),
+    )
+
+
+def _has_snapshot():
+    return or_(EventDB.snapshot_hash.isnot(None), EventDB.snapshot_base64.isnot(None))
+
+
+def rebuild_camera(db: Session, user_id: int, camera: str):
+    """
+    Recalcula la fila de UNA cámara desde events (p.ej. al renombrar una cámara a
+    un nombre que ya tenía eventos). Dos consultas por el índice (user_id, camera, id). No hace commit.
+    """
+    same_camera = (EventDB.user_id == user_id, EventDB.camera == camera)
+    ids = {
+        db.query(func.max(EventDB.id)).filter(*same_camera).scalar(),
+        db.query(func.max(EventDB.id)).filter(*same_camera, _has_snapshot()).scalar(),
+    } - {None}
+    if not ids:
+        return
+    rows = latest_state_rows(db.query(*_state_columns()).filter(EventDB.id.in_(ids)).all())
+    if rows:
+        db.execute(upsert_statement(db.get_bind().dialect.name, rows))
+
+
+def rebuild(db: Session, batch_size: int = 500) -> int:
+    """
+    Recalcula el estado desde la tabla events (después de backfill_event_columns.py).
+    Idempotente: por el upsert monótono se puede ejecutar con la ingesta en marcha.
+    """
+    grouped = (EventDB.user_id.isnot(None), EventDB.camera.isnot(None))
+    last_ids = [
+        r[0] for r in db.query(func.max(EventDB.id)).filter(*grouped).group_by(EventDB.user_id, EventDB.camera)
+    ]
+    snapshot_ids = [
+        r[0] for r in db.query(func.max(EventDB.id))
+        .filter(*grouped, _has_snapshot())
+        .group_by(EventDB.user_id, EventDB.camera)
+    ]
+
+    ids = sorted(set(last_ids) | set(snapshot_ids))
+    dialect_name = db.get_bind().dialect.name
+    updated = 0
+    for i in range(0, len(ids), batch_size):
+        chunk = ids[i:i + batch_size]
+        events = db.query(*_state_columns()).filter(EventDB.id.in_(chunk)).all()
+        rows = latest_state_rows(events)
+        if rows:
+            db.execute(upsert_statement(dialect_name, rows))
+        db.commit()
+        updated += len(rows)
+
+    logging.info(f"📷 Estado por cámara recalculado: {updated} filas")
+    return updated
@@ -0,0 +1,50 @@
+"""
+Caché customer_id (username) -> user_id para la ruta de ingesta.
+
+Cada evento 'end' necesitaba un SELECT en users solo para guardar el dueño.
+Los usernames no cambian, así que basta un TTL largo; los "no existe" se
+cachean con un TTL corto para que un usuario recién registrado aparezca pronto.
+"""
+
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.all_models import UserDB
+
+CUSTOMER_CACHE_TTL_SECONDS = float(os.getenv("CUSTOMER_CACHE_TTL_SECONDS", "300"))
+_NEGATIVE_TTL_SECONDS = 30.0
+_MAX_ENTRIES = 10000
+
+
+class CustomerCache:
+    def __init__(self, ttl_seconds: float = CUSTOMER_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[Optional[int], float]] = {}  # username -> (user_id, expira)
+
+    async def resolve(self, db: AsyncSession, customer_id: Optional[str]) -> Optional[int]:
+        if not customer_id:
+            return None
+
+        now = time.monotonic()
+        cached = self._entries.get(customer_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        result = await db.execute(select(UserDB.id).where(UserDB.username == customer_id))
+        user_id = result.scalar_one_or_none()
+
+        if len(self._entries) >= _MAX_ENTRIES:
+            self._entries.clear()
+        ttl = self.ttl_seconds if user_id is not None else _NEGATIVE_TTL_SECONDS
+        self._entries[customer_id] = (user_id, now + ttl)
+        return user_id
+
+    def invalidate(self, customer_id: str):
+        self._entries.pop(customer_id, None)
+
+
+customer_cache = CustomerCache()
@@ -0,0 +1,383 @@
+"""
+Estado de desduplicación (anti-spam) por regla.
+
+Antes, por cada regla que hacía match, evaluate_rules consultaba el último
+RuleHitDB, luego el EventDB anterior, y hacía json.loads de todo su payload
+solo para leer "box". Ahora cada regla guarda en memoria cuándo disparó por
+última vez y el centroide de esa caja:
+
+- Decidir si un hit es duplicado no toca la BD ni parsea JSON.
+- Las entradas expiran solas cuando pasa la ventana de la regla (TTL).
+- Al arrancar se reconstruye desde los rule_hits recientes (warm_up).
+- check_and_record registra el hit ANTES de guardarlo (para que sea atómico);
+  si el commit falla, undo() vuelve la regla al disparo anterior.
+- La ventana y la tolerancia son configurables por regla
+  (rules.dedup_window_seconds / rules.dedup_tolerance).
+
+Backend (DEDUP_BACKEND):
+    auto    (default) redis si REDIS_URL está definida y el paquete instalado;
+            si no, memory.
+    memory  Diccionario en el proceso. Con varios workers de gunicorn cada
+            proceso desduplica por su cuenta.
+    redis   Compartido entre workers (requiere el paquete `redis` y REDIS_URL).
+            El chequeo y el registro son atómicos en Redis (WATCH/MULTI):
+            dos workers que evalúan la misma regla a la vez no pueden pasar
+            los dos.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.all_models import EventDB, RuleDB, RuleHitDB
+
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "auto").lower()
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Valores por defecto (los mismos que tenía el anti-spam fijo)
+DEFAULT_DEDUP_WINDOW_SECONDS = 60.0
+DEFAULT_DEDUP_TOLERANCE = 0.05  # 5% del cuadro; para cajas en píxeles equivale a 50px
+PIXEL_TOLERANCE_FACTOR = 1000.0
+
+
+@dataclass(frozen=True)
+class DedupEntry:
+    """Último disparo de una regla."""
+    triggered_at: float  # epoch (segundos)
+    centroid: Optional[Tuple[float, float]]  # (x, y) o None si el evento no traía caja
+    normalized: bool = True
+
+
+@dataclass(frozen=True)
+class Suppression:
+    """Por qué el anti-spam descartó un hit."""
+    code: str  # Estable, para métricas: "track" | "distance" | "time" ("existing" en warm_up)
+    detail: str  # Texto para el log (puede cambiar)
+
+    def __str__(self) -> str:
+        return self.detail
+
+
+# Recibe el último disparo (o None) y retorna la razón para NO registrar el nuevo, o None
+Decide = Callable[[Optional[DedupEntry]], Optional[Suppression]]
+
+# Deshace el registro de check_and_record (si el hit no se pudo guardar)
+Undo = Callable[[], None]
+
+
+def noop_undo():
+    pass
+
+
+def box_centroid(box: Any) -> Optional[Tuple[Tuple[float, float], bool]]:
+    """
+    Centroide de la caja y si está normalizada. None si no hay caja válida.
+    Funciona igual para [ymin, xmin, ymax, xmax] o [x, y, w, h].
+    """
+    if not box or not isinstance(box, (list, tuple)) or len(box) != 4:
+        return None
+    try:
+        b = [float(v) for v in box]
+    except (TypeError, ValueError):
+        return None
+    # Detección automática de formato: valores pequeños (<1.1) = normalizado
+    normalized = all(v <= 1.1 for v in b)
+    return ((b[1] + b[3]) / 2, (b[0] + b[2]) / 2), normalized
+
+
+class InMemoryDedupBackend:
+    """Diccionario rule_id -> (DedupEntry, expira_en) con barrido periódico de expirados. ttl en segundos desde ahora."""
+
+    SWEEP_EVERY = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[DedupEntry, float]] = {}
+        self._writes = 0
+
+    def get(self, rule_id: int) -> Optional[DedupEntry]:
+        item = self._entries.get(rule_id)
+        if item is None:
+            return None
+        entry, expires_at = item
+        if time.time() >= expires_at:
+            with self._lock:
+                if self._entries.get(rule_id) is item:
+                    del self._entries[rule_id]
+            return None
+        return entry
+
+    def set(self, rule_id: int, entry: DedupEntry, ttl: float):
+        with self._lock:
+            self._set(rule_id, entry, ttl)
+
+    def _set(self, rule_id: int, entry: DedupEntry, ttl: float):
+        self._entries[rule_id] = (entry, time.time() + ttl)
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            now = time.time()
+            for key in [k for k, (_, exp) in self._entries.items() if exp <= now]:
+                del self._entries[key]
+
+    def check_and_set(self, rule_id: int, decide: Decide, entry: DedupEntry, ttl: float) -> Optional[Suppression]:
+        """Lee el último disparo, decide y registra `entry` si decide() no da razón. Todo bajo el lock."""
+        with self._lock:
+            item = self._entries.get(rule_id)
+            last = item[0] if item is not None and time.time() < item[1] else None
+            reason = decide(last)
+            if reason is None:
+                self._set(rule_id, entry, ttl)
+            return reason
+
+    def restore(self, rule_id: int, entry: DedupEntry, previous: Optional[DedupEntry], ttl: float):
+        """Si la regla sigue con `entry` registrado, vuelve a `previous` (o la olvida si es None o ttl <= 0)."""
+        with self._lock:
+            item = self._entries.get(rule_id)
+            if item is None or item[0] != entry:
+                return  # Otro hit ya la pisó: ese es el último disparo válido
+            if previous is not None and ttl > 0:
+                self._entries[rule_id] = (previous, time.time() + ttl)
+            else:
+                del self._entries[rule_id]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisDedupBackend:
+    """Mismo contrato que InMemoryDedupBackend, guardado en Redis con EXPIRE."""
+
+    KEY_PREFIX = "dedup:rule:"
+
+    def __init__(self, url: str):
+        import redis  # Dependencia opcional
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self._watch_error = redis.WatchError
+
+    @staticmethod
+    def _decode(raw) -> Optional[DedupEntry]:
+        if not raw:
+            return None
+        t, cx, cy, normalized = raw.decode().split(",")
+        centroid = (float(cx), float(cy)) if cx else None
+        return DedupEntry(float(t), centroid, normalized == "1")
+
+    @staticmethod
+    def _encode(entry: DedupEntry) -> str:
+        cx, cy = entry.centroid if entry.centroid else ("", "")
+        return f"{entry.triggered_at},{cx},{cy},{1 if entry.normalized else 0}"
+
+    def get(self, rule_id: int) -> Optional[DedupEntry]:
+        try:
+            raw = self._client.get(f"{self.KEY_PREFIX}{rule_id}")
+        except Exception as e:
+            # Redis caído: mejor una alerta de más que perder una real
+            logging.error(f"❌ Error leyendo estado de dedup en Redis: {e}")
+            return None
+        return self._decode(raw)
+
+    def set(self, rule_id: int, entry: DedupEntry, ttl: float):
+        try:
+            self._client.set(f"{self.KEY_PREFIX}{rule_id}", self._encode(entry), px=max(1, int(ttl * 1000)))
+        except Exception as e:
+            logging.error(f"❌ Error guardando estado de dedup en Redis: {e}")
+
+    def check_and_set(self, rule_id: int, decide: Decide, entry: DedupEntry, ttl: float) -> Optional[Suppression]:
+        """
+        Compare-and-set optimista: WATCH de la clave, GET, decide() y SET en un
+        MULTI. Si otro worker escribió la clave en el medio, EXEC falla y se
+        vuelve a decidir con el valor nuevo.
+        """
+        key = f"{self.KEY_PREFIX}{rule_id}"
+        try:
+            with self._client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(key)
+                        reason = decide(self._decode(pipe.get(key)))
+                        if reason is not None:
+                            return reason
+                        pipe.multi()
+                        pipe.set(key, self._encode(entry), px=max(1, int(ttl * 1000)))
+                        pipe.execute()
+                        return None
+                    except self._watch_error:
+                        continue
+        except Exception as e:
+            # Redis caído: mejor una alerta de más que perder una real
+            logging.error(f"❌ Error en el chequeo de dedup en Redis: {e}")
+            return None
+
+    def restore(self, rule_id: int, entry: DedupEntry, previous: Optional[DedupEntry], ttl: float):
+        """Igual que en memoria: WATCH + MULTI, solo si la clave sigue teniendo `entry`."""
+        key = f"{self.KEY_PREFIX}{rule_id}"
+        try:
+            with self._client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(key)
+                        if self._decode(pipe.get(key)) != entry:
+                            return
+                        pipe.multi()
+                        if previous is not None and ttl > 0:
+                            pipe.set(key, self._encode(previous), px=max(1, int(ttl * 1000)))
+                        else:
+                            pipe.delete(key)
+                        pipe.execute()
+                        return
+                    except self._watch_error:
+                        continue
+        except Exception as e:
+            logging.error(f"❌ Error deshaciendo el estado de dedup en Redis: {e}")
+
+    def clear(self):
+        try:
+            for key in self._client.scan_iter(f"{self.KEY_PREFIX}*"):
+                self._client.delete(key)
+        except Exception as e:
+            logging.error(f"❌ Error limpiando estado de dedup en Redis: {e}")
+
+
+_ALREADY_RECORDED = Suppression("existing", "ya registrado por otro worker")
+
+
+def create_backend(kind: str = DEDUP_BACKEND, url: Optional[str] = REDIS_URL):
+    if kind in ("redis", "auto") and url:
+        try:
+            backend = RedisDedupBackend(url)
+            logging.info("🧠 Estado de dedup compartido en Redis")
+            return backend
+        except ImportError:
+            if kind == "redis":
+                logging.warning("⚠ DEDUP_BACKEND=redis pero el paquete 'redis' no está instalado, usando memoria")
+    elif kind == "redis":
+        logging.warning("⚠ DEDUP_BACKEND=redis pero REDIS_URL no está definida, usando memoria")
+    return InMemoryDedupBackend()
+
+
+class DedupState:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else create_backend()
+
+    @staticmethod
+    def window_for(rule) -> float:
+        window = getattr(rule, "dedup_window_seconds", None)
+        return DEFAULT_DEDUP_WINDOW_SECONDS if window is None else float(window)
+
+    @staticmethod
+    def tolerance_for(rule, normalized: bool) -> float:
+        tolerance = getattr(rule, "dedup_tolerance", None)
+        tolerance = DEFAULT_DEDUP_TOLERANCE if tolerance is None else float(tolerance)
+        return tolerance if normalized else tolerance * PIXEL_TOLERANCE_FACTOR
+
+    def check_and_record(self, rule, box: Any, now: Optional[float] = None) -> Tuple[Optional[Suppression], Undo]:
+        """
+        Decide si el hit de `rule` es duplicado del anterior.
+        Retorna (razón, undo). Si no es duplicado (razón None), el hit queda
+        registrado como el último: llamar undo() si después no se pudo guardar.
+        """
+        window = self.window_for(rule)
+        if window <= 0:
+            return None, noop_undo
+
+        now = time.time() if now is None else now
+        current = box_centroid(box)
+        centroid, normalized = current if current else (None, True)
+        entry = DedupEntry(now, centroid, normalized)
+        seen: List[Optional[DedupEntry]] = [None]
+
+        def decide(last: Optional[DedupEntry]) -> Optional[Suppression]:
+            seen[0] = last  # Con Redis se puede llamar más de una vez: vale la última
+            return self._duplicate_reason(rule, last, current, now, window) if last is not None else None
+
+        # Chequeo y registro atómicos en el backend: dos evaluaciones en paralelo
+        # de la misma regla (aunque sean de workers distintos) no pueden pasar las dos
+        reason = self.backend.check_and_set(rule.id, decide, entry, window)
+        if reason is not None:
+            return reason, noop_undo
+
+        def undo():
+            previous = seen[0]
+            ttl = window - (time.time() - previous.triggered_at) if previous is not None else 0
+            self.backend.restore(rule.id, entry, previous, ttl)
+
+        return None, undo
+
+    def _duplicate_reason(self, rule, last: DedupEntry, current, now: float, window: float) -> Optional[Suppression]:
+        time_diff = now - last.triggered_at
+        # 1. Filtro de Tiempo
+        if time_diff >= window:
+            return None
+
+        # 2. Filtro Espacial: si ambos tienen caja, comparamos la distancia entre centroides
+        if current and last.centroid:
+            (c1_x, c1_y), normalized = current
+            c2_x, c2_y = last.centroid
+            tolerance = self.tolerance_for(rule, normalized)
+            distance = math.sqrt((c1_x - c2_x) ** 2 + (c1_y - c2_y) ** 2)
+            if distance < tolerance:
+                return Suppression("distance", f"Distancia {distance:.2f} < Margen {tolerance}")
+            return None
+
+        # Sin cajas para comparar, nos basamos solo en el tiempo
+        return Suppression("time", f"por tiempo ({time_diff:.1f}s < {window:.0f}s)")
+
+    def warm_up(self, db: Session, rules: Optional[Sequence[RuleDB]] = None):
+        """Reconstruye el estado con el último hit de cada regla dentro de su ventana."""
+        if rules is None:
+            rules = db.query(RuleDB).filter(RuleDB.enabled == True, RuleDB.is_deleted == False).all()
+        windows = {r.id: self.window_for(r) for r in rules if self.window_for(r) > 0}
+        if not windows:
+            return 0
+
+        cutoff = datetime.utcnow() - timedelta(seconds=max(windows.values()))
+        rows = (
+            db.query(RuleHitDB.rule_id, RuleHitDB.triggered_at, EventDB.payload)
+            .outerjoin(EventDB, EventDB.id == RuleHitDB.event_id)
+            .filter(RuleHitDB.triggered_at >= cutoff, RuleHitDB.rule_id.in_(list(windows)))
+            .order_by(RuleHitDB.triggered_at.asc())
+            .all()
+        )
+
+        latest: Dict[int, Tuple[datetime, Optional[str]]] = {}
+        for rule_id, triggered_at, payload in rows:
+            latest[rule_id] = (triggered_at, payload)
+
+        now = time.time()
+        restored = 0
+        for rule_id, (triggered_at, payload) in latest.items():
+            triggered = triggered_at.replace(tzinfo=timezone.utc).timestamp()
+            ttl = windows[rule_id] - (now - triggered)
+            if ttl <= 0:
+                continue
+            box = payload.get("box") if isinstance(payload, dict) else None
+            current = box_centroid(box)
+            centroid, normalized = current if current else (None, True)
+            # Sin pisar lo que otro worker ya haya registrado
+            skipped = self.backend.check_and_set(
+                rule_id, lambda last: _ALREADY_RECORDED if last is not None else None,
+                DedupEntry(triggered, centroid, normalized), ttl,
+            )
+            if skipped is None:
+                restored += 1
+
+        logging.info(f"🧠 Estado de dedup reconstruido: {restored} reglas con hits recientes")
+        return restored
+
+    def clear(self):
+        self.backend.clear()
+
+
+dedup_state = DedupState()
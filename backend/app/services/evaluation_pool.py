@@ -0,0 +1,180 @@
+"""
+Pool dedicado para evaluar reglas, separado del threadpool de FastAPI.
+
+Antes evaluate_rules corría en BackgroundTasks, es decir en el mismo threadpool
+que atiende los endpoints de la UI. Con ráfagas de eventos (y WhatsApp lento)
+el panel dejaba de responder. Ahora:
+
+- Los trabajos van a un ThreadPoolExecutor propio. Solo threads: evaluate_rules
+  pasa casi todo el tiempo en la BD, y usa estado del proceso (caché de reglas
+  e invalidaciones, anti-spam en memoria, métricas, NotificationSender.wake)
+  que un proceso hijo no vería.
+- La cola es ACOTADA: si está llena, submit() retorna False y el endpoint
+  responde 503 para que el listener reintente (backpressure).
+- stats() expone profundidad de cola, trabajos en curso y latencias.
+
+Configuración (variables de entorno):
+    RULE_EVAL_WORKERS     Número de workers (default 4)
+    RULE_EVAL_QUEUE_SIZE  Trabajos en espera permitidos además de los que corren (default 1000)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.db.query_counter import query_scope
+
+RULE_EVAL_WORKERS = int(os.getenv("RULE_EVAL_WORKERS", "4"))
+RULE_EVAL_QUEUE_SIZE = int(os.getenv("RULE_EVAL_QUEUE_SIZE", "1000"))
+
+# Ventana de muestras para los percentiles de latencia
+_LATENCY_WINDOW = 1024
+
+
+def _run_timed(fn: Callable, args: Tuple[Any, ...]) -> Tuple[float, float]:
+    """Ejecuta el trabajo y retorna (inicio, fin) en tiempo de pared."""
+    start = time.time()
+    with query_scope(getattr(fn, "__name__", "evaluación")):
+        fn(*args)
+    return start, time.time()
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class EvaluationPool:
+    def __init__(self, workers: int = RULE_EVAL_WORKERS, queue_size: int = RULE_EVAL_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._pending = 0  # Enviados y aún no terminados (en cola + corriendo)
+        self._running = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._latency_count = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)  # Tiempo de evaluación
+        self._waits = deque(maxlen=_LATENCY_WINDOW)  # Tiempo en cola
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rule-eval")
+        if os.getenv("RULE_EVAL_EXECUTOR", "thread").lower() != "thread":
+            logging.warning("⚠️ RULE_EVAL_EXECUTOR ya no se usa: la evaluación de reglas siempre corre en threads")
+        logging.info(f"⚙️ Pool de evaluación iniciado (workers={self.workers}, cola={self.queue_size})")
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            logging.info("⚙️ Pool de evaluación detenido")
+
+    def has_capacity(self, needed: int = 1) -> bool:
+        return self._pending + needed <= self.workers + self.queue_size
+
+    def submit(self, fn: Callable, *args) -> bool:
+        """Encola fn(*args). Retorna False (sin bloquear) si la cola está llena."""
+        if self._executor is None:
+            self.start()
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            logging.warning(f"🚦 Cola de evaluación llena ({self._pending} pendientes), trabajo rechazado")
+            return False
+
+        submitted_at = time.time()
+        with self._lock:
+            self._pending += 1
+            self._submitted += 1
+
+        try:
+            future = self._executor.submit(self._run_in_thread, fn, args)
+        except Exception as e:
+            # Executor cerrado (shutdown en curso)
+            logging.error(f"❌ No se pudo encolar la evaluación: {e}")
+            self._finish(None, submitted_at)
+            return False
+
+        future.add_done_callback(lambda f: self._finish(f, submitted_at))
+        return True
+
+    def _run_in_thread(self, fn: Callable, args: Tuple[Any, ...]) -> Tuple[float, float]:
+        with self._lock:
+            self._running += 1
+        try:
+            return _run_timed(fn, args)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _finish(self, future: Optional[Future], submitted_at: float):
+        timing = None
+        failed = future is None
+        if future is not None:
+            try:
+                timing = future.result()
+            except Exception as e:
+                failed = True
+                logging.error(f"❌ Error en worker de evaluación: {e}")
+
+        with self._lock:
+            self._pending -= 1
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+            if timing:
+                start, end = timing
+                elapsed = end - start
+                self._latency_count += 1
+                self._latency_sum += elapsed
+                self._latency_max = max(self._latency_max, elapsed)
+                self._latencies.append(elapsed)
+                self._waits.append(max(0.0, start - submitted_at))
+        self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            waits = sorted(self._waits)
+            pending = self._pending
+            running = self._running
+            measured = self._latency_count
+            return {
+                "executor": "thread",
+                "workers": self.workers,
+                "queue_capacity": self.queue_size,
+                "queue_depth": max(0, pending - running),
+                "in_flight": running,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "latency_avg_ms": round(self._latency_sum / measured * 1000, 2) if measured else 0.0,
+                "latency_max_ms": round(self._latency_max * 1000, 2),
+                "latency_p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+                "latency_p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+                "queue_wait_p95_ms": round(_percentile(waits, 95) * 1000, 2),
+            }
+
+
+evaluation_pool = EvaluationPool()
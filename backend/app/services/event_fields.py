@@ -0,0 +1,56 @@
+"""
+Campos del evento que se guardan como columnas propias en `events`.
+
+El payload completo sigue guardándose (JSONB en PostgreSQL), pero los listados
+filtran y ordenan por estas columnas indexadas en vez de hacer LIKE sobre el
+texto o json.loads por fila. Lo usan la ingesta y backfill_event_columns.py,
+así que las dos rutas llenan las columnas exactamente igual.
+"""
+
+import json
+from typing import Any, Dict, Optional
+
+
+def _float_or_none(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _str_or_none(value: Any, max_length: int) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value)[:max_length]
+
+
+def extract_event_fields(payload: Any) -> Dict[str, Any]:
+    """Columnas de EventDB a partir del evento normalizado del listener (dict o JSON en texto)."""
+    if isinstance(payload, (str, bytes)):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = None
+    if not isinstance(payload, dict):
+        payload = {}
+
+    start_time = _float_or_none(payload.get("start_time"))
+    end_time = _float_or_none(payload.get("end_time"))
+    duration = _float_or_none(payload.get("duration_seconds"))
+    if duration is None and start_time is not None and end_time is not None:
+        duration = end_time - start_time
+
+    # Solo top_score, igual que evaluate_rules: es el valor contra el que se
+    # compara min_score de las reglas (sin top_score queda NULL, no se usa score)
+    top_score = _float_or_none(payload.get("top_score"))
+
+    return {
+        "camera": _str_or_none(payload.get("camera"), 255),
+        "label": _str_or_none(payload.get("label"), 100),
+        "frigate_event_id": _str_or_none(payload.get("event_id"), 100),
+        "frigate_type": _str_or_none(payload.get("frigate_type") or payload.get("type"), 20),
+        "top_score": top_score,
+        "start_time": start_time,
+        "end_time": end_time,
+        "duration_seconds": duration,
+    }
@@ -0,0 +1,68 @@
+"""
+Caché de las opciones de filtro del historial de alertas (cámaras y labels).
+
+list_rule_hits calculaba en cada carga de página dos DISTINCT con join sobre
+todos los rule_hits del usuario, solo para llenar los desplegables. Ahora se
+calcula con UNA consulta (reglas del usuario que tienen al menos un hit) y se
+guarda por usuario:
+
+- Los endpoints de reglas llaman a invalidate_user() al crear/editar/borrar.
+- Una regla que recibe su primer hit aparece al expirar el TTL
+  (HIT_FACETS_TTL_SECONDS, default 60), igual en cada worker de gunicorn.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+
+from app.models.all_models import RuleDB, RuleHitDB
+
+HIT_FACETS_TTL_SECONDS = float(os.getenv("HIT_FACETS_TTL_SECONDS", "60"))
+_MAX_ENTRIES = 10000
+
+
+def _split_labels(value: str) -> List[str]:
+    # "car, bus" -> ["car", "bus"]
+    return [p.strip() for p in value.split(",") if p.strip()]
+
+
+class HitFacetsCache:
+    def __init__(self, ttl_seconds: float = HIT_FACETS_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[Dict[str, List[str]], float]] = {}  # user_id -> (facetas, expira)
+
+    def get(self, db: Session, user_id: int) -> Dict[str, List[str]]:
+        now = time.monotonic()
+        cached = self._entries.get(user_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        rows = (
+            db.query(RuleDB.camera, RuleDB.label)
+            .filter(
+                RuleDB.user_id == user_id,
+                exists().where(RuleHitDB.rule_id == RuleDB.id),  # Índice (rule_id, id): se detiene en el primer hit
+            )
+            .all()
+        )
+        cameras = sorted({camera for camera, _ in rows if camera})
+        labels = sorted({part for _, label in rows if label for part in _split_labels(label)})
+        facets = {"cameras": cameras, "labels": labels}
+
+        with self._lock:
+            if len(self._entries) >= _MAX_ENTRIES:
+                self._entries.clear()
+            self._entries[user_id] = (facets, now + self.ttl_seconds)
+        return facets
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+hit_facets = HitFacetsCache()
@@ -0,0 +1,185 @@
+"""
+Buffer de la vista en vivo (eventos new/update/end recientes, sin BD).
+
+Antes era una lista global de 500 eventos con pop(0) (O(n) por evento) y
+GET /api/events/ recorría los 500 en cada poll para filtrar por cámara. Ahora:
+
+- Un deque con maxlen por (cliente, cámara): insertar es O(1) y una cámara
+  con mucho tráfico no desplaza a las demás.
+- Cada evento lleva un número de secuencia global creciente (seq), así el
+  panel puede pedir solo lo nuevo ("desde seq N").
+- Leer los últimos k eventos de unas cámaras recorre solo esos k eventos por
+  cámara, sin tocar el resto del buffer.
+
+La clave incluye el customer_id del evento: dos usuarios con una cámara
+llamada igual ("Cocina") no ven los eventos del otro.
+
+Backend (LIVE_BUFFER_BACKEND):
+    auto    (default) redis si REDIS_URL está definida y el paquete instalado;
+            si no, memory.
+    memory  En el proceso. Con varios workers cada uno ve solo lo que recibió.
+    redis   Compartido entre workers: una lista por cámara (LPUSH + LTRIM) y
+            la secuencia con INCR.
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+LIVE_BUFFER_BACKEND = os.getenv("LIVE_BUFFER_BACKEND", "auto").lower()
+LIVE_BUFFER_PER_CAMERA = int(os.getenv("LIVE_BUFFER_PER_CAMERA", "100"))
+LIVE_BUFFER_TTL_SECONDS = int(os.getenv("LIVE_BUFFER_TTL_SECONDS", "86400"))  # Solo Redis: cámaras inactivas
+REDIS_URL = os.getenv("REDIS_URL")
+
+_MAX_CAMERAS = 10000
+
+CameraKey = Tuple[str, str]  # (customer_id, cámara)
+
+
+def camera_key(event: Dict[str, Any]) -> CameraKey:
+    return (str(event.get("customer_id") or ""), str(event.get("camera") or ""))
+
+
+def _latest(per_camera: Iterable[List[Dict[str, Any]]], limit: int) -> List[Dict[str, Any]]:
+    """Une listas (cada una ordenada por seq descendente) y deja los `limit` más nuevos, en orden ascendente."""
+    merged = heapq.merge(*per_camera, key=lambda item: item["seq"], reverse=True)
+    result = [item for _, item in zip(range(limit), merged)]
+    result.reverse()
+    return result
+
+
+class InMemoryLiveBuffer:
+    def __init__(self, per_camera: int = LIVE_BUFFER_PER_CAMERA):
+        self.per_camera = per_camera
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._cameras: Dict[CameraKey, Deque[Dict[str, Any]]] = {}
+
+    def append(self, key: CameraKey, item: Dict[str, Any]) -> int:
+        with self._lock:
+            self._seq += 1
+            buffer = self._cameras.get(key)
+            if buffer is None:
+                if len(self._cameras) >= _MAX_CAMERAS:
+                    # Se olvida la cámara que lleva más tiempo sin eventos
+                    idle = min(self._cameras, key=lambda k: self._cameras[k][-1]["seq"])
+                    del self._cameras[idle]
+                buffer = self._cameras[key] = deque(maxlen=self.per_camera)
+            buffer.append({"seq": self._seq, **item})
+            return self._seq
+
+    def _tail(self, key: CameraKey, limit: int, since_seq: int) -> List[Dict[str, Any]]:
+        buffer = self._cameras.get(key)
+        if not buffer:
+            return []
+        items = []
+        with self._lock:
+            # Desde el más nuevo hacia atrás: se detiene en `limit` o al llegar a since_seq
+            for item in reversed(buffer):
+                if item["seq"] <= since_seq or len(items) >= limit:
+                    break
+                items.append(item)
+        return items
+
+    def read(self, keys: Iterable[CameraKey], limit: int, since_seq: int = 0) -> List[Dict[str, Any]]:
+        return _latest([self._tail(key, limit, since_seq) for key in keys], limit)
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def clear(self):
+        with self._lock:
+            self._cameras.clear()
+
+
+class RedisLiveBuffer:
+    """Mismo contrato que InMemoryLiveBuffer, compartido entre workers."""
+
+    KEY_PREFIX = "live:cam:"
+    SEQ_KEY = "live:seq"
+
+    def __init__(self, url: str, per_camera: int = LIVE_BUFFER_PER_CAMERA, ttl: int = LIVE_BUFFER_TTL_SECONDS):
+        import redis  # Dependencia opcional
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self.per_camera = per_camera
+        self.ttl = ttl
+
+    def _key(self, key: CameraKey) -> str:
+        return f"{self.KEY_PREFIX}{key[0]}:{key[1]}"
+
+    def append(self, key: CameraKey, item: Dict[str, Any]) -> int:
+        try:
+            seq = int(self._client.incr(self.SEQ_KEY))
+            redis_key = self._key(key)
+            pipe = self._client.pipeline(transaction=False)
+            pipe.lpush(redis_key, json.dumps({"seq": seq, **item}, default=str))
+            pipe.ltrim(redis_key, 0, self.per_camera - 1)
+            pipe.expire(redis_key, self.ttl)
+            pipe.execute()
+            return seq
+        except Exception as e:
+            # La vista en vivo es best-effort: nunca debe romper la ingesta
+            logging.error(f"❌ Error guardando evento en vivo en Redis: {e}")
+            return 0
+
+    def read(self, keys: Iterable[CameraKey], limit: int, since_seq: int = 0) -> List[Dict[str, Any]]:
+        keys = list(keys)
+        if not keys:
+            return []
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            for key in keys:
+                pipe.lrange(self._key(key), 0, limit - 1)  # Más nuevo primero
+            raw_lists = pipe.execute()
+        except Exception as e:
+            logging.error(f"❌ Error leyendo eventos en vivo de Redis: {e}")
+            return []
+
+        per_camera = []
+        for raw_items in raw_lists:
+            items = []
+            for raw in raw_items:
+                item = json.loads(raw)
+                if item["seq"] <= since_seq:
+                    break
+                items.append(item)
+            per_camera.append(items)
+        return _latest(per_camera, limit)
+
+    @property
+    def last_seq(self) -> int:
+        try:
+            return int(self._client.get(self.SEQ_KEY) or 0)
+        except Exception as e:
+            logging.error(f"❌ Error leyendo la secuencia en vivo de Redis: {e}")
+            return 0
+
+    def clear(self):
+        try:
+            for key in self._client.scan_iter(f"{self.KEY_PREFIX}*"):
+                self._client.delete(key)
+        except Exception as e:
+            logging.error(f"❌ Error limpiando eventos en vivo en Redis: {e}")
+
+
+def create_backend(kind: str = LIVE_BUFFER_BACKEND, url: Optional[str] = REDIS_URL):
+    if kind in ("redis", "auto") and url:
+        try:
+            backend = RedisLiveBuffer(url)
+            logging.info("📡 Vista en vivo compartida en Redis")
+            return backend
+        except ImportError:
+            if kind == "redis":
+                logging.warning("⚠ LIVE_BUFFER_BACKEND=redis pero el paquete 'redis' no está instalado, usando memoria")
+    elif kind == "redis":
+        logging.warning("⚠ LIVE_BUFFER_BACKEND=redis pero REDIS_URL no está definida, usando memoria")
+    return InMemoryLiveBuffer()
+
+
+live_buffer = create_backend()
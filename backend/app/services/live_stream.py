@@ -0,0 +1,195 @@
+"""
+Envío en vivo de eventos al panel (Server-Sent Events), en lugar del polling.
+
+Con cientos de paneles abiertos, cada poll a GET /api/events/ validaba el JWT,
+cargaba las cámaras del usuario desde la BD y filtraba el buffer: más tráfico
+que la ingesta real. Ahora cada panel abre UNA conexión a
+GET /api/events/stream y la ingesta le empuja solo los eventos de sus cámaras:
+
+- Fan-out por dueño: los suscriptores se indexan por customer_id, así que un
+  evento solo recorre las conexiones de ese cliente.
+- Backpressure por conexión: cada una tiene una cola acotada
+  (LIVE_STREAM_QUEUE_SIZE). Si un cliente lento la llena, se descarta su cola
+  y se pone al día leyendo el buffer en vivo (live_buffer) desde el último
+  seq que recibió; la ingesta nunca espera a un cliente.
+- Reanudar: cada mensaje lleva `id: <seq>`. Al reconectar, EventSource manda
+  Last-Event-ID y el stream reenvía lo que quede en el buffer desde ese seq.
+
+Con LIVE_BUFFER_BACKEND=redis la publicación pasa por un canal pub/sub de
+Redis, así una conexión abierta en cualquier worker recibe los eventos que
+ingesta otro. En memoria, cada worker solo empuja lo que recibió él. El PUBLISH
+a Redis lo hace un thread aparte (cola acotada, LIVE_STREAM_PUBLISH_QUEUE_SIZE):
+la ingesta, que corre en el event loop, no espera a Redis.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Any, Dict, Optional, Set
+
+from app.services.live_buffer import CameraKey, RedisLiveBuffer, live_buffer, REDIS_URL
+
+LIVE_STREAM_QUEUE_SIZE = int(os.getenv("LIVE_STREAM_QUEUE_SIZE", "100"))
+LIVE_STREAM_BACKLOG = int(os.getenv("LIVE_STREAM_BACKLOG", "200"))  # Máximo a reenviar al reanudar / ponerse al día
+LIVE_STREAM_MAX_CONNECTIONS = int(os.getenv("LIVE_STREAM_MAX_CONNECTIONS", "1000"))
+LIVE_STREAM_HEARTBEAT_SECONDS = float(os.getenv("LIVE_STREAM_HEARTBEAT_SECONDS", "15"))
+LIVE_STREAM_CAMERAS_REFRESH_SECONDS = float(os.getenv("LIVE_STREAM_CAMERAS_REFRESH_SECONDS", "60"))
+LIVE_STREAM_PUBLISH_QUEUE_SIZE = int(os.getenv("LIVE_STREAM_PUBLISH_QUEUE_SIZE", "1000"))
+
+_CHANNEL = "live:events"
+
+
+class Subscriber:
+    """Una conexión SSE: cola acotada + cámaras del usuario."""
+
+    def __init__(self, customer_id: str, cameras: Set[str], queue_size: int = LIVE_STREAM_QUEUE_SIZE):
+        self.customer_id = customer_id
+        self.cameras = cameras
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False  # La cola se llenó: hay que ponerse al día desde el buffer
+        self.closed = False
+        self.dropped = 0
+
+    def offer(self, camera: str, item: Dict[str, Any]):
+        if camera not in self.cameras:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Cliente lento: no se le encola más; al leer se pone al día desde live_buffer
+            self.overflowed = True
+            self.dropped += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)  # Despierta al lector
+
+
+class LiveStreamHub:
+    def __init__(self, redis_url: Optional[str] = None):
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._redis = None
+        self._redis_url = redis_url
+        self._pubsub_thread: Optional[threading.Thread] = None
+        self._publisher_thread: Optional[threading.Thread] = None
+        self._publish_queue: queue.Queue = queue.Queue(maxsize=LIVE_STREAM_PUBLISH_QUEUE_SIZE)
+        self._stopping = threading.Event()
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    # ---------------- Ciclo de vida ----------------
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if not self._redis_url or self._pubsub_thread is not None:
+            return
+        try:
+            import redis  # Dependencia opcional
+
+            self._redis = redis.Redis.from_url(self._redis_url, socket_connect_timeout=1.0)
+        except ImportError:
+            return
+        self._start_threads()
+        logging.info("📡 Stream en vivo suscripto al canal de Redis")
+
+    def _start_threads(self):
+        self._stopping.clear()
+        self._pubsub_thread = threading.Thread(target=self._listen, name="live-stream-pubsub", daemon=True)
+        self._pubsub_thread.start()
+        self._publisher_thread = threading.Thread(target=self._publish_loop, name="live-stream-publish", daemon=True)
+        self._publisher_thread.start()
+
+    async def stop(self):
+        self._stopping.set()
+        self._pubsub_thread = None
+        self._publisher_thread = None
+        # Cierra las conexiones abiertas (deploys): EventSource reconecta con Last-Event-ID
+        for subs in list(self._subscribers.values()):
+            for sub in list(subs):
+                sub.closed = True
+                if not sub.queue.full():
+                    sub.queue.put_nowait(None)
+
+    def _listen(self):
+        """Thread: mensajes del canal de Redis -> fan-out en el event loop."""
+        while not self._stopping.is_set():
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(_CHANNEL)
+                while not self._stopping.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        customer_id, camera, item = json.loads(message["data"])
+                        self._loop.call_soon_threadsafe(self._fanout, customer_id, camera, item)
+                pubsub.close()
+            except Exception as e:
+                logging.error(f"❌ Error en el canal de eventos en vivo de Redis: {e}")
+                self._stopping.wait(2.0)
+
+    # ---------------- Publicación ----------------
+
+    def publish(self, key: CameraKey, item: Dict[str, Any]):
+        """
+        Llamado desde la ingesta (event loop) con el evento ya guardado en
+        live_buffer. Con Redis solo encola: el PUBLISH lo hace _publish_loop.
+        """
+        if self._publisher_thread is not None:
+            try:
+                self._publish_queue.put_nowait((key[0], key[1], item))
+                return
+            except queue.Full:
+                # Redis no da abasto: al menos los paneles de este worker lo reciben
+                # (los demás se ponen al día desde live_buffer al reconectar)
+                logging.warning("⚠ Cola de publicación en vivo llena, evento solo para este worker")
+        self._fanout(key[0], key[1], item)
+
+    def _publish_loop(self):
+        """Thread: cola de publicación -> canal de Redis (fuera del event loop)."""
+        while not self._stopping.is_set():
+            try:
+                customer_id, camera, item = self._publish_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self._redis.publish(_CHANNEL, json.dumps([customer_id, camera, item], default=str))
+            except Exception as e:
+                logging.error(f"❌ Error publicando evento en vivo en Redis: {e}")
+                self._loop.call_soon_threadsafe(self._fanout, customer_id, camera, item)
+
+    def _fanout(self, customer_id: str, camera: str, item: Dict[str, Any]):
+        for sub in list(self._subscribers.get(customer_id, ())):
+            sub.offer(camera, item)
+
+    # ---------------- Suscripciones ----------------
+
+    def subscribe(self, customer_id: str, cameras: Set[str]) -> Optional[Subscriber]:
+        """None si se alcanzó LIVE_STREAM_MAX_CONNECTIONS en este worker."""
+        if self.connections >= LIVE_STREAM_MAX_CONNECTIONS:
+            return None
+        sub = Subscriber(customer_id, cameras)
+        self._subscribers.setdefault(customer_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        subs = self._subscribers.get(sub.customer_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.customer_id]
+
+    def catch_up(self, sub: Subscriber, since_seq: int, limit: int = LIVE_STREAM_BACKLOG):
+        """Eventos del buffer posteriores a since_seq (al conectar o tras desbordar la cola)."""
+        keys = [(sub.customer_id, camera) for camera in sub.cameras]
+        return live_buffer.read(keys, limit, since_seq=since_seq)
+
+
+def format_sse(item: Dict[str, Any]) -> str:
+    return f"id: {item['seq']}\nevent: live\ndata: {json.dumps(item, default=str)}\n\n"
+
+
+live_stream = LiveStreamHub(REDIS_URL if isinstance(live_buffer, RedisLiveBuffer) else None)
@@ -0,0 +1,482 @@
+"""
+Envío asíncrono de notificaciones desde la cola persistente (notification_outbox).
+
+El motor de reglas ya no llama al Graph API: inserta una fila en la cola dentro
+de la misma transacción que el RuleHit. Este servicio (una tarea asyncio dentro
+del proceso web) reclama filas a medida que se liberan lugares y las envía:
+
+- Cliente HTTP compartido (httpx.AsyncClient) con keep-alive y límite de conexiones.
+- Pool continuo de NOTIFY_CONCURRENCY envíos: cada entrega guarda su resultado
+  al terminar y libera su lugar; no se espera al resto del lote.
+- Como máximo UNA fila en vuelo por número destino (más el rate limit por
+  número): un destinatario lento o con muchas alertas no frena a los demás, y
+  ninguna fila reclamada espera en una cola interna hasta vencer su lease.
+- Reintentos con backoff exponencial + jitter para 429/5xx/errores de red.
+- La función de envío es inyectable (send_func) para probar contra un Graph falso.
+- El snapshot se sube UNA vez por evento: el media_id se reutiliza para todas
+  las reglas y destinatarios (MediaCache).
+
+Si el proceso se reinicia, las filas 'pending' siguen en la BD y las filas
+'sending' se vuelven a reclamar al vencer su lease (entrega al-menos-una-vez).
+
+Configuración (variables de entorno):
+    NOTIFY_SENDER_ENABLED      "true" (default) / "false"
+    NOTIFY_CONCURRENCY         Envíos simultáneos (default 8)
+    NOTIFY_BATCH_SIZE          Filas revisadas por consulta al reclamar (default 50)
+    NOTIFY_POLL_INTERVAL       Segundos entre consultas con la cola vacía (default 1)
+    NOTIFY_MAX_ATTEMPTS        Intentos antes de marcar 'failed' (default 6)
+    NOTIFY_RECIPIENT_INTERVAL  Segundos mínimos entre mensajes al mismo número (default 1)
+    NOTIFY_CLAIM_LEASE         Segundos antes de re-reclamar una fila 'sending' (default 120)
+    NOTIFY_MEDIA_CACHE_TTL     Segundos que se reutiliza un media_id subido (default 86400)
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.core import tracing
+from app.db.query_counter import query_scope
+from app.db.session import SessionLocal
+from app.models.all_models import EventDB, NotificationOutboxDB
+from app.services.snapshot_store import snapshot_store
+from app.services.pipeline_metrics import WHATSAPP_SEND_SECONDS, WHATSAPP_SENDS, NOTIFICATIONS
+from app.services.whatsapp import (
+    WHATSAPP_TIMEOUT,
+    SendResult,
+    async_send_image,
+    async_send_text,
+    async_upload_media,
+)
+
+NOTIFY_SENDER_ENABLED = os.getenv("NOTIFY_SENDER_ENABLED", "true").lower() == "true"
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "50"))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "1"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "6"))
+NOTIFY_RECIPIENT_INTERVAL = float(os.getenv("NOTIFY_RECIPIENT_INTERVAL", "1"))
+NOTIFY_CLAIM_LEASE = float(os.getenv("NOTIFY_CLAIM_LEASE", "120"))
+# Meta conserva los media subidos 30 días; con 1 día de reutilización vamos sobrados
+NOTIFY_MEDIA_CACHE_TTL = float(os.getenv("NOTIFY_MEDIA_CACHE_TTL", "86400"))
+
+# Backoff de reintentos: 2s, 4s, 8s... hasta 5 minutos
+_RETRY_BASE_SECONDS = 2.0
+_RETRY_MAX_SECONDS = 300.0
+
+
+@dataclass
+class OutboundNotification:
+    """Notificación reclamada de la cola, lista para enviarse."""
+    id: int
+    to_number: str
+    message: str
+    attempts: int
+    event_id: Optional[int] = None
+    snapshot: Optional[bytes] = None  # JPEG listo para subir
+    media_key: Optional[str] = None  # Identifica el snapshot para reutilizar su media_id (hash o evento)
+    traceparent: Optional[str] = None  # Traza del evento (span whatsapp_send)
+
+
+SendFunc = Callable[[httpx.AsyncClient, OutboundNotification], Awaitable[SendResult]]
+
+
+class MediaCache:
+    """
+    media_id ya subidos, por snapshot. Un hit en tres reglas (o a varios
+    destinatarios) es UNA subida: las demás entregas esperan a la primera y
+    reutilizan su media_id.
+    """
+
+    def __init__(self, ttl_seconds: float = NOTIFY_MEDIA_CACHE_TTL, max_entries: int = 5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.uploads = 0
+        self.reused = 0
+
+    async def get_or_upload(self, client: httpx.AsyncClient, key: Optional[str], image_bytes: bytes) -> Tuple[Optional[str], SendResult]:
+        if not key:
+            return await async_upload_media(client, image_bytes)
+
+        if len(self._locks) > self.max_entries:
+            self._prune()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            cached = self._entries.get(key)
+            if cached and cached[1] > time.monotonic():
+                self.reused += 1
+                return cached[0], SendResult(ok=True)
+
+            media_id, upload = await async_upload_media(client, image_bytes)
+            self.uploads += 1
+            if media_id:
+                if len(self._entries) >= self.max_entries:
+                    self._prune()
+                self._entries[key] = (media_id, time.monotonic() + self.ttl_seconds)
+        return media_id, upload
+
+    def forget(self, key: Optional[str]):
+        if key:
+            self._entries.pop(key, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (_, exp) in self._entries.items() if exp <= now]:
+            del self._entries[key]
+        # Sigue lleno: descartamos los más viejos (orden de inserción)
+        for key in list(self._entries)[: max(0, len(self._entries) - self.max_entries + 1)]:
+            del self._entries[key]
+        for key in [k for k, lock in self._locks.items() if k not in self._entries and not lock.locked()]:
+            del self._locks[key]
+
+
+media_cache = MediaCache()
+
+
+async def deliver_via_whatsapp(client: httpx.AsyncClient, notification: OutboundNotification) -> SendResult:
+    """Envío por defecto: imagen con caption si hay snapshot, si no texto."""
+    if notification.snapshot:
+        media_id, upload = await media_cache.get_or_upload(client, notification.media_key, notification.snapshot)
+        if media_id:
+            result = await async_send_image(client, media_id, notification.message, notification.to_number)
+            if not result.ok and not result.retryable:
+                # Puede ser un media_id vencido: el próximo intento lo vuelve a subir
+                media_cache.forget(notification.media_key)
+            return result
+        if upload.retryable:
+            return upload
+        # Igual que antes: si la imagen no se puede subir, enviamos solo el texto
+        logging.error(f"❌ Error subiendo imagen ({upload.status_code}): {upload.error}. Enviando solo texto")
+
+    return await async_send_text(client, notification.message, notification.to_number)
+
+
+def enqueue_notification(
+    db: Session,
+    to_number: str,
+    message: str,
+    event_id: Optional[int] = None,
+    rule_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    snapshot_hash: Optional[str] = None,
+    traceparent: Optional[str] = None,
+) -> NotificationOutboxDB:
+    """Agrega una notificación a la cola. El llamador hace el commit (misma transacción que el hit)."""
+    row = NotificationOutboxDB(
+        to_number=to_number,
+        message=message,
+        event_id=event_id,
+        snapshot_hash=snapshot_hash,
+        rule_id=rule_id,
+        user_id=user_id,
+        traceparent=traceparent,
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(row)
+    return row
+
+
+def _load_snapshot(snapshot_hash: Optional[str], snapshot_b64: Optional[str]) -> Optional[bytes]:
+    if snapshot_hash:
+        return snapshot_store.get(snapshot_hash)
+    if snapshot_b64:  # LEGACY: eventos aún no migrados al store
+        try:
+            return base64.b64decode(snapshot_b64)
+        except Exception as e:
+            logging.error(f"❌ Snapshot base64 inválido: {e}")
+    return None
+
+
+def _retry_delay(attempts: int) -> float:
+    delay = min(_RETRY_MAX_SECONDS, _RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    # Jitter: evita que todos los reintentos golpeen el Graph API al mismo tiempo
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class NotificationSender:
+    def __init__(
+        self,
+        send_func: Optional[SendFunc] = None,
+        concurrency: int = NOTIFY_CONCURRENCY,
+        batch_size: int = NOTIFY_BATCH_SIZE,
+        poll_interval: float = NOTIFY_POLL_INTERVAL,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+        recipient_interval: float = NOTIFY_RECIPIENT_INTERVAL,
+        claim_lease: float = NOTIFY_CLAIM_LEASE,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.send_func: SendFunc = send_func or deliver_via_whatsapp
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self.recipient_interval = recipient_interval
+        self.claim_lease = claim_lease
+        self.transport = transport  # Tests: httpx.MockTransport como Graph API falso
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+        # Entregas en curso y sus destinatarios (uno en vuelo por número)
+        self._in_flight: Set[asyncio.Task] = set()
+        self._busy_numbers: Set[str] = set()
+        # Rate limit por destinatario
+        self._recipient_next_slot: Dict[str, float] = {}
+
+        self.stats = {"sent": 0, "retried": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._client = httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(WHATSAPP_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+        )
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"📬 Sender de notificaciones iniciado (concurrencia={self.concurrency})")
+
+    async def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        await self._client.aclose()
+        self._task = None
+        logging.info("📬 Sender de notificaciones detenido")
+
+    def wake(self):
+        """Despierta el loop de envío (seguro desde cualquier thread)."""
+        if self._loop is not None and self._wakeup is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # Loop cerrándose
+
+    async def _run(self):
+        while not self._stopping:
+            # Antes de reclamar: una entrega que termina mientras tanto vuelve a despertar el loop
+            self._wakeup.clear()
+            free = self.concurrency - len(self._in_flight)
+            batch = []
+            if free > 0:
+                try:
+                    batch = await asyncio.to_thread(self._claim_batch, free, set(self._busy_numbers))
+                except Exception as e:
+                    logging.error(f"❌ Error reclamando notificaciones: {e}")
+
+            for notification in batch:
+                self._busy_numbers.add(notification.to_number)
+                task = asyncio.create_task(self._deliver_and_record(notification))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            if batch and len(batch) == free:
+                continue  # Puede haber más filas listas: reclamar apenas se libere un lugar
+
+            self._prune_recipients()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def _deliver_and_record(self, notification: OutboundNotification):
+        try:
+            result = await self._deliver(notification)
+            try:
+                await asyncio.to_thread(self._record_results, [(notification, result)])
+            except Exception as e:
+                logging.error(f"❌ Error guardando resultado de la notificación {notification.id}: {e}")
+        finally:
+            self._busy_numbers.discard(notification.to_number)
+            self._wakeup.set()  # Lugar libre (y el destinatario ya puede recibir otra)
+
+    async def _deliver(self, notification: OutboundNotification) -> SendResult:
+        # Rate limit por número; no hace falta lock: hay una sola entrega en vuelo por número
+        wait = self._recipient_next_slot.get(notification.to_number, 0.0) - self._loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        span = tracing.start_span(
+            "whatsapp_send", tracing.parse_traceparent(notification.traceparent),
+            notification_id=notification.id, attempt=notification.attempts + 1,
+        )
+        started = time.perf_counter()
+        try:
+            result = await self.send_func(self._client, notification)
+        except Exception as e:
+            result = SendResult(ok=False, error=f"{type(e).__name__}: {e}", retryable=True)
+        WHATSAPP_SEND_SECONDS.observe(time.perf_counter() - started)
+        WHATSAPP_SENDS.inc(status_code=result.status_code or "network", ok="true" if result.ok else "false")
+        span.end(status_code=result.status_code or "network", ok=result.ok)
+
+        self._recipient_next_slot[notification.to_number] = self._loop.time() + self.recipient_interval
+        return result
+
+    def _prune_recipients(self):
+        if len(self._recipient_next_slot) < 1000:
+            return
+        now = self._loop.time()
+        for number, slot in list(self._recipient_next_slot.items()):
+            if slot < now and number not in self._busy_numbers:
+                del self._recipient_next_slot[number]
+
+    @query_scope("notification_sender._claim_batch")
+    def _claim_batch(self, limit: Optional[int] = None, busy_numbers: Set[str] = frozenset()) -> List[OutboundNotification]:
+        """
+        Reclama hasta `limit` filas listas, como máximo una por número destino y
+        ninguna de `busy_numbers` (destinatarios con una entrega en vuelo).
+        """
+        limit = self.batch_size if limit is None else min(limit, self.batch_size)
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            lease_expired = now - timedelta(seconds=self.claim_lease)
+            query = db.query(NotificationOutboxDB).filter(or_(
+                and_(NotificationOutboxDB.status == "pending", NotificationOutboxDB.next_attempt_at <= now),
+                and_(NotificationOutboxDB.status == "sending", NotificationOutboxDB.claimed_at < lease_expired),
+            ))
+            if busy_numbers:
+                # Las filas de un destinatario ocupado no tapan las de los demás
+                query = query.filter(NotificationOutboxDB.to_number.notin_(busy_numbers))
+            rows = (
+                query
+                .order_by(NotificationOutboxDB.id.asc())
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)  # Varios workers de gunicorn no toman la misma fila
+                .all()
+            )
+            # Las filas descartadas aquí siguen 'pending' (y sin reclamar) para la próxima vuelta
+            picked, numbers = [], set(busy_numbers)
+            for row in rows:
+                if row.to_number not in numbers:
+                    numbers.add(row.to_number)
+                    picked.append(row)
+                    if len(picked) >= limit:
+                        break
+            rows = picked
+            if not rows:
+                db.rollback()
+                return []
+
+            for row in rows:
+                row.status = "sending"
+                row.claimed_at = now
+
+            # Snapshots del lote: las filas nuevas traen el hash (lectura directa del store,
+            # una vez por hash); las anteriores a ese campo se resuelven en una sola consulta
+            by_hash: Dict[str, Optional[bytes]] = {}
+            for row in rows:
+                if row.snapshot_hash and row.snapshot_hash not in by_hash:
+                    by_hash[row.snapshot_hash] = snapshot_store.get(row.snapshot_hash)
+
+            legacy_event_ids = {row.event_id for row in rows if row.event_id and not row.snapshot_hash}
+            by_event: Dict[int, Tuple[Optional[str], Optional[bytes]]] = {}
+            if legacy_event_ids:
+                for event_id, snapshot_hash, snapshot_b64 in (
+                    db.query(EventDB.id, EventDB.snapshot_hash, EventDB.snapshot_base64)
+                    .filter(EventDB.id.in_(legacy_event_ids))
+                    .all()
+                ):
+                    by_event[event_id] = (snapshot_hash, _load_snapshot(snapshot_hash, snapshot_b64))
+
+            batch = []
+            for row in rows:
+                if row.snapshot_hash:
+                    media_key, snapshot = row.snapshot_hash, by_hash.get(row.snapshot_hash)
+                else:
+                    event_hash, snapshot = by_event.get(row.event_id, (None, None))
+                    media_key = event_hash or (f"event:{row.event_id}" if row.event_id else None)
+                batch.append(OutboundNotification(
+                    id=row.id,
+                    to_number=row.to_number,
+                    message=row.message,
+                    attempts=row.attempts or 0,
+                    event_id=row.event_id,
+                    snapshot=snapshot,
+                    media_key=media_key if snapshot else None,
+                    traceparent=row.traceparent,
+                ))
+            db.commit()
+            return batch
+        finally:
+            db.close()
+
+    @query_scope("notification_sender._record_results")
+    def _record_results(self, results: List[Tuple[OutboundNotification, SendResult]]):
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            rows = {
+                row.id: row
+                for row in db.query(NotificationOutboxDB)
+                .filter(NotificationOutboxDB.id.in_([n.id for n, _ in results]))
+                .all()
+            }
+            for notification, result in results:
+                row = rows.get(notification.id)
+                if row is None:
+                    continue
+                row.attempts = (row.attempts or 0) + 1
+
+                if result.ok:
+                    row.status = "sent"
+                    row.sent_at = now
+                    row.last_error = None
+                    row.provider_message_id = result.message_id
+                    self.stats["sent"] += 1
+                    NOTIFICATIONS.inc(outcome="sent")
+                    logging.info(f"📤 Notificación {row.id} enviada a {row.to_number}")
+                elif result.retryable and row.attempts < self.max_attempts:
+                    delay = _retry_delay(row.attempts)
+                    row.status = "pending"
+                    row.next_attempt_at = now + timedelta(seconds=delay)
+                    row.last_error = f"{result.status_code}: {result.error}"
+                    self.stats["retried"] += 1
+                    NOTIFICATIONS.inc(outcome="retried")
+                    logging.warning(
+                        f"🔁 Notificación {row.id} falló ({result.status_code}), reintento {row.attempts} en {delay:.1f}s"
+                    )
+                else:
+                    row.status = "failed"
+                    row.last_error = f"{result.status_code}: {result.error}"
+                    self.stats["failed"] += 1
+                    NOTIFICATIONS.inc(outcome="failed")
+                    logging.error(f"❌ Notificación {row.id} descartada tras {row.attempts} intentos: {row.last_error}")
+            db.commit()
+        finally:
+            db.close()
+
+
+notification_sender = NotificationSender()
@@ -0,0 +1,45 @@
+"""
+Métricas del pipeline ingesta -> reglas -> WhatsApp (expuestas en GET /metrics).
+
+Responden "¿el pipeline da abasto?" sin leer logs:
+
+    ingest_request_seconds{endpoint}         latencia de POST /api/events/ y /batch
+    ingest_payload_bytes{endpoint}           tamaño del body recibido
+    ingest_events_total{storage}             db | ram_only | rejected (503 por pool saturado)
+    rule_evaluation_seconds                  duración de evaluate_rules
+    rule_evaluations_total{outcome}          evaluated | no_owner | no_rules | no_customer | error
+    rules_evaluated_per_event                reglas candidatas por evento
+    rule_matches_total                       reglas que hicieron match (antes del anti-spam)
+    rule_suppressions_total{reason}          track | distance | time (anti-spam)
+    rule_eval_queue_depth / _in_flight       estado del pool de evaluación
+    whatsapp_send_seconds                    latencia de cada envío al Graph API
+    whatsapp_sends_total{status_code,ok}     respuestas del Graph API ("network" = sin respuesta)
+    notifications_total{outcome}             sent | retried | failed (estado final del outbox)
+"""
+
+from app.core.metrics import Counter, Gauge, Histogram
+from app.services.evaluation_pool import evaluation_pool
+
+_SIZE_BUCKETS = (512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+INGEST_SECONDS = Histogram("ingest_request_seconds", "Latencia de la ingesta de eventos", ["endpoint"])
+INGEST_PAYLOAD_BYTES = Histogram(
+    "ingest_payload_bytes", "Tamaño del body de ingesta (comprimido si aplica)", ["endpoint"], buckets=_SIZE_BUCKETS
+)
+INGEST_EVENTS = Counter("ingest_events_total", "Eventos recibidos por destino", ["storage"])
+
+RULE_EVAL_SECONDS = Histogram("rule_evaluation_seconds", "Duración de evaluate_rules por evento")
+RULE_EVALUATIONS = Counter("rule_evaluations_total", "Eventos evaluados por resultado", ["outcome"])
+RULES_PER_EVENT = Histogram("rules_evaluated_per_event", "Reglas candidatas por evento", buckets=_COUNT_BUCKETS)
+RULE_MATCHES = Counter("rule_matches_total", "Reglas que hicieron match (antes del anti-spam)")
+RULE_SUPPRESSIONS = Counter("rule_suppressions_total", "Alertas descartadas por el anti-spam", ["reason"])
+
+WHATSAPP_SEND_SECONDS = Histogram("whatsapp_send_seconds", "Latencia de cada envío a WhatsApp")
+WHATSAPP_SENDS = Counter("whatsapp_sends_total", "Respuestas del Graph API", ["status_code", "ok"])
+NOTIFICATIONS = Counter("notifications_total", "Resultado de cada intento del outbox", ["outcome"])
+
+Gauge("rule_eval_queue_depth", "Eventos esperando evaluación",
+      fn=lambda: {(): evaluation_pool.stats()["queue_depth"]})
+Gauge("rule_eval_in_flight", "Evaluaciones en curso",
+      fn=lambda: {(): evaluation_pool.stats()["in_flight"]})
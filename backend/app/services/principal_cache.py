@@ -0,0 +1,106 @@
+"""
+Caché del usuario autenticado (get_current_user) y de sus cámaras.
+
+Cada request autenticado hacía un SELECT en users después de validar el JWT,
+y los endpoints de eventos/cámaras volvían a consultar CameraDB del mismo
+usuario. Con el panel abierto haciendo polling, casi toda la carga de la BD
+era identidad. Ahora:
+
+- La fila del usuario se guarda por (user_id, huella del token) con un TTL
+  corto (PRINCIPAL_CACHE_TTL_SECONDS, default 30) y nunca más allá del `exp`
+  del JWT. Es una copia desacoplada de la sesión: cada request la adjunta a
+  su propia sesión con db.merge(load=False), sin SELECT.
+- Los nombres de las cámaras del usuario se guardan por user_id con el mismo TTL.
+- update_user_profile, reset_password, OAuth y el CRUD de cámaras llaman a
+  invalidate_user() / invalidate_cameras(); en otros workers los cambios se
+  ven al expirar el TTL.
+
+El JWT se sigue verificando en cada request (firma + expiración): la caché
+solo evita la BD, no la validación.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app.models.all_models import CameraDB, UserDB
+
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+_MAX_ENTRIES = 10000
+
+_USER_COLUMNS = [attr.key for attr in UserDB.__mapper__.column_attrs]
+
+
+def token_fingerprint(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def _detached_copy(user: UserDB) -> UserDB:
+    """Copia solo con columnas, sin sesión, que merge(load=False) acepta como fila persistente."""
+    copy = UserDB(**{key: getattr(user, key) for key in _USER_COLUMNS})
+    make_transient_to_detached(copy)
+    return copy
+
+
+class PrincipalCache:
+    def __init__(self, ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._users: Dict[int, Dict[str, Tuple[UserDB, float]]] = {}  # user_id -> {huella: (usuario, expira)}
+        self._cameras: Dict[int, Tuple[FrozenSet[str], float]] = {}  # user_id -> (nombres, expira)
+        self._size = 0
+
+    def get_user(self, db: Session, user_id: int, fingerprint: str) -> Optional[UserDB]:
+        """Usuario cacheado adjunto a `db` (sin consultar la BD), o None."""
+        cached = self._users.get(user_id, {}).get(fingerprint)
+        if cached is None or cached[1] <= time.time():
+            return None
+        return db.merge(cached[0], load=False)
+
+    def put_user(self, user: UserDB, fingerprint: str, token_exp: Optional[float] = None):
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp:
+            expires_at = min(expires_at, float(token_exp))
+        entry = (_detached_copy(user), expires_at)
+        with self._lock:
+            if self._size >= _MAX_ENTRIES:
+                self._users.clear()
+                self._size = 0
+            tokens = self._users.setdefault(user.id, {})
+            if fingerprint not in tokens:
+                self._size += 1
+            tokens[fingerprint] = entry
+
+    def camera_names(self, db: Session, user_id: int) -> FrozenSet[str]:
+        cached = self._cameras.get(user_id)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        names = frozenset(name for (name,) in db.query(CameraDB.name).filter(CameraDB.user_id == user_id))
+        with self._lock:
+            if len(self._cameras) >= _MAX_ENTRIES:
+                self._cameras.clear()
+            self._cameras[user_id] = (names, time.time() + self.ttl_seconds)
+        return names
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            tokens = self._users.pop(user_id, None)
+            if tokens:
+                self._size -= len(tokens)
+
+    def invalidate_cameras(self, user_id: int):
+        with self._lock:
+            self._cameras.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._cameras.clear()
+            self._size = 0
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,498 @@
+"""
+Retención de eventos y alertas (events / rule_hits) y manejo de particiones.
+
+En PostgreSQL ambas tablas están particionadas por mes (received_at /
+triggered_at, ver migración d0e1f2a3b4c5). Este job:
+
+1. Crea por adelantado las particiones de los próximos meses
+   (PARTITION_MONTHS_AHEAD). No hay partición DEFAULT: una fila de un mes sin
+   partición hace fallar la ingesta (el listener la reintenta desde su spool)
+   en vez de quedar escondida donde bloquea la creación de esa partición.
+   Si existe una <tabla>_default (bases migradas antes de este cambio), sus
+   filas se mueven a particiones mensuales y se elimina.
+2. Elimina las particiones enteras que ya vencieron para TODOS los usuarios:
+   DETACH PARTITION ... CONCURRENTLY (sin ACCESS EXCLUSIVE sobre la tabla
+   padre, requiere PostgreSQL 14+ y que no haya partición default) y luego
+   DROP de la tabla ya suelta. Sin DELETE fila por fila, sin bloat ni VACUUM.
+3. Para los usuarios con una retención más corta, y en SQLite (sin
+   particiones), borra por lotes con commit por lote.
+4. Elimina del snapshot store los JPEG que ya ningún evento (ni notificación
+   pendiente) referencia.
+
+Retención efectiva de un usuario: users.retention_days, o EVENTS_RETENTION_DAYS
+si es NULL. 0 = guardar para siempre (default: nunca se borra nada).
+Con RETENTION_ENABLED=false el job solo mantiene las particiones (paso 1): sin
+ellas la ingesta fallaría, así que ese paso corre siempre.
+
+Con varios workers de gunicorn solo uno ejecuta el job a la vez (advisory lock
+en PostgreSQL).
+
+Configuración (variables de entorno):
+    RETENTION_ENABLED             "true" (default) / "false"
+    EVENTS_RETENTION_DAYS         Días por defecto (default 0 = sin límite)
+    RETENTION_INTERVAL_SECONDS    Cada cuánto corre el job (default 21600 = 6h)
+    RETENTION_BATCH_SIZE          Filas por DELETE en el modo por lotes (default 1000)
+    PARTITION_MONTHS_AHEAD        Meses futuros con partición creada (default 2)
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from app.core.metrics import Counter
+from app.db.query_counter import query_scope
+from app.db.session import SessionLocal
+from app.models.all_models import (
+    CameraLatestStateDB,
+    EventDB,
+    NotificationOutboxDB,
+    RuleDB,
+    RuleHitDB,
+    UserDB,
+)
+from app.services.snapshot_store import snapshot_store
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "0"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "21600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+
+# Tabla particionada -> columna de partición
+PARTITIONED_TABLES = {"events": "received_at", "rule_hits": "triggered_at"}
+
+_ADVISORY_LOCK_KEY = 7_240_017  # Arbitrario, único en esta app
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+# Alertar si es > 0: sin la partición del mes, la ingesta de ese mes falla
+PARTITION_ERRORS = Counter("partition_maintenance_errors_total", "Fallos creando, moviendo o eliminando particiones", ["action"])
+
+
+# ---------------- Fechas / particiones ----------------
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    index = value.year * 12 + (value.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def _parse_bound(raw: str) -> Optional[datetime]:
+    raw = raw.strip()
+    if raw.upper() in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(raw.strip("'"))
+
+
+def is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def is_partitioned(db: Session, table: str) -> bool:
+    if not is_postgres(db):
+        return False
+    kind = db.execute(text("SELECT relkind FROM pg_class WHERE relname = :t"), {"t": table}).scalar()
+    return kind == "p"
+
+
+def list_partitions(db: Session, table: str) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """(nombre, desde, hasta) de cada partición por rango; None = MINVALUE/MAXVALUE. Omite la default."""
+    rows = db.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :t
+    """), {"t": table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound or "")
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda p: p[1] or datetime.min)
+
+
+def default_partition(db: Session, table: str) -> Optional[str]:
+    return db.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :t AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+    """), {"t": table}).scalar()
+
+
+def drain_default_partition(db: Session, table: str) -> List[str]:
+    """
+    Mueve las filas de <tabla>_default a particiones mensuales (una transacción
+    por mes) y elimina la default ya vacía. Retorna las particiones creadas.
+    """
+    default = default_partition(db, table)
+    if default is None:
+        return []
+    key = PARTITIONED_TABLES[table]
+    months = [m for (m,) in db.execute(text(
+        f'SELECT DISTINCT date_trunc(\'month\', "{key}") FROM "{default}" WHERE "{key}" IS NOT NULL ORDER BY 1'
+    ))]
+    created = []
+    for start in months:
+        end = add_months(start, 1)
+        name = partition_name(table, start)
+        bounds = {"start": start, "end": end}
+        try:
+            # Solo bloquea la default (ahí caen las filas sueltas), no la tabla padre
+            db.execute(text("SET LOCAL lock_timeout = '10s'"))
+            db.execute(text(f'LOCK TABLE "{default}" IN EXCLUSIVE MODE'))
+            db.execute(text(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS)'))
+            db.execute(text(
+                f'INSERT INTO "{name}" SELECT * FROM "{default}" WHERE "{key}" >= :start AND "{key}" < :end'
+            ), bounds)
+            moved = db.execute(text(
+                f'DELETE FROM "{default}" WHERE "{key}" >= :start AND "{key}" < :end'
+            ), bounds).rowcount
+            db.execute(text(
+                f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            db.commit()
+            created.append(name)
+            logging.warning(f"🗂️ {moved} filas de {default} movidas a la partición {name}")
+        except Exception as e:
+            db.rollback()
+            PARTITION_ERRORS.inc(action="drain_default")
+            logging.error(f"❌ No se pudieron mover las filas de {default} a {name}: {e}")
+            return created
+
+    if db.execute(text(f'SELECT EXISTS (SELECT 1 FROM "{default}")')).scalar():
+        # Filas sin clave de partición: no se pueden mover solas, hay que revisarlas a mano
+        PARTITION_ERRORS.inc(action="drain_default")
+        logging.error(f"❌ {default} todavía tiene filas (clave NULL): no se elimina, revisarla a mano")
+        db.rollback()
+        return created
+    try:
+        db.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"'))
+        db.execute(text(f'DROP TABLE "{default}"'))
+        db.commit()
+        logging.info(f"🗂️ Partición {default} eliminada")
+    except Exception as e:
+        db.rollback()
+        PARTITION_ERRORS.inc(action="drain_default")
+        logging.error(f"❌ No se pudo eliminar la partición {default}: {e}")
+    return created
+
+
+def ensure_partitions(db: Session, now: datetime, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Crea las particiones mensuales que falten desde el mes actual hasta months_ahead."""
+    created = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(db, table):
+            continue
+        created.extend(drain_default_partition(db, table))
+        existing = list_partitions(db, table)
+        for offset in range(months_ahead + 1):
+            start = add_months(month_start(now), offset)
+            end = add_months(start, 1)
+            # Ya cubierto (p.ej. por la partición legacy, que va de MINVALUE al mes de la migración)
+            if any((lo is None or lo < end) and (hi is None or hi > start) for _, lo, hi in existing):
+                continue
+            name = partition_name(table, start)
+            try:
+                db.execute(text(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+                db.commit()
+                created.append(name)
+            except Exception as e:
+                db.rollback()
+                PARTITION_ERRORS.inc(action="create")
+                logging.error(f"❌ No se pudo crear la partición {name}: {e}")
+    if created:
+        logging.info(f"🗂️ Particiones creadas: {', '.join(created)}")
+    return created
+
+
+# ---------------- Retención ----------------
+
+def user_retention_days(db: Session) -> Dict[Optional[int], int]:
+    """user_id -> días de retención efectivos (0 = sin límite). La clave None son eventos sin dueño."""
+    days = {user_id: (value if value is not None else EVENTS_RETENTION_DAYS)
+            for user_id, value in db.query(UserDB.id, UserDB.retention_days)}
+    days[None] = EVENTS_RETENTION_DAYS
+    return days
+
+
+def global_cutoff(retention: Dict[Optional[int], int], now: datetime) -> Optional[datetime]:
+    """Fecha antes de la cual NADIE conserva datos (None si alguien guarda para siempre)."""
+    if not retention or any(d <= 0 for d in retention.values()):
+        return None
+    return now - timedelta(days=max(retention.values()))
+
+
+def _detach_and_drop(db: Session, table: str, name: str):
+    """
+    DETACH CONCURRENTLY no puede ir en una transacción: conexión en autocommit.
+    Si una ejecución anterior quedó a medias (detach pendiente) se termina con FINALIZE.
+    """
+    with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        pending = conn.execute(text("""
+            SELECT i.inhdetachpending FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE c.relname = :n
+        """), {"n": name}).scalar()
+        mode = "FINALIZE" if pending else "CONCURRENTLY"
+        conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}" {mode}'))
+        conn.execute(text(f'DROP TABLE "{name}"'))
+
+
+def drop_expired_partitions(db: Session, cutoff: datetime, dry_run: bool = False) -> Tuple[List[str], Set[str]]:
+    """Elimina las particiones cuyo rango termina antes de cutoff. Retorna (particiones, hashes de snapshots)."""
+    dropped, hashes = [], set()
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(db, table):
+            continue
+        for name, _, upper in list_partitions(db, table):
+            if upper is None or upper > cutoff:
+                continue
+            partition_hashes = set()
+            if table == "events":
+                partition_hashes = {
+                    h for (h,) in db.execute(text(
+                        f'SELECT DISTINCT snapshot_hash FROM "{name}" WHERE snapshot_hash IS NOT NULL'
+                    ))
+                }
+            # Sin transacción abierta: el DETACH CONCURRENTLY espera a las que usan la tabla (incluida esta)
+            db.commit()
+            if not dry_run:
+                try:
+                    _detach_and_drop(db, table, name)
+                except Exception as e:
+                    PARTITION_ERRORS.inc(action="drop")
+                    logging.error(f"❌ No se pudo eliminar la partición {name}: {e}")
+                    continue
+            hashes |= partition_hashes
+            dropped.append(name)
+    if dropped:
+        logging.info(f"🗑️ Particiones {'a eliminar' if dry_run else 'eliminadas'}: {', '.join(dropped)}")
+    return dropped, hashes
+
+
+def purge_user(db: Session, user_id: Optional[int], cutoff: datetime,
+               batch_size: int = RETENTION_BATCH_SIZE, dry_run: bool = False) -> Tuple[int, int, Set[str]]:
+    """Borra por lotes los eventos y alertas del usuario anteriores a cutoff. Retorna (eventos, alertas, hashes)."""
+    owner = EventDB.user_id.is_(None) if user_id is None else EventDB.user_id == user_id
+    user_rules = select(RuleDB.id).where(RuleDB.user_id == user_id)
+    expired_events = db.query(EventDB).filter(owner, EventDB.received_at < cutoff)
+    expired_hits = db.query(RuleHitDB).filter(RuleHitDB.rule_id.in_(user_rules), RuleHitDB.triggered_at < cutoff)
+
+    if dry_run:
+        hashes = {
+            h for (h,) in expired_events.with_entities(EventDB.snapshot_hash)
+            .filter(EventDB.snapshot_hash.isnot(None)).distinct()
+        }
+        hits = expired_hits.count() if user_id is not None else 0
+        return expired_events.count(), hits, hashes
+
+    events_deleted = hits_deleted = 0
+    hashes: Set[str] = set()
+    while True:
+        rows = (
+            expired_events.with_entities(EventDB.id, EventDB.snapshot_hash)
+            .order_by(EventDB.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        ids = [r.id for r in rows]
+        hashes.update(r.snapshot_hash for r in rows if r.snapshot_hash)
+        # Las alertas de estos eventos se van con ellos (no hay FK en las tablas particionadas)
+        hits_deleted += db.query(RuleHitDB).filter(RuleHitDB.event_id.in_(ids)).delete(synchronize_session=False)
+        events_deleted += db.query(EventDB).filter(EventDB.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+
+    while user_id is not None:
+        ids = [r.id for r in expired_hits.with_entities(RuleHitDB.id).limit(batch_size)]
+        if not ids:
+            break
+        hits_deleted += db.query(RuleHitDB).filter(RuleHitDB.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+
+    return events_deleted, hits_deleted, hashes
+
+
+def _chunks(values: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def release_snapshots(db: Session, hashes: Set[str], dry_run: bool = False) -> int:
+    """Elimina del store los snapshots que ya nadie referencia (eventos o notificaciones pendientes)."""
+    orphaned = []
+    for chunk in _chunks(sorted(hashes), 500):
+        referenced = {
+            h for (h,) in db.query(EventDB.snapshot_hash).filter(EventDB.snapshot_hash.in_(chunk)).distinct()
+        }
+        referenced.update(
+            h for (h,) in db.query(NotificationOutboxDB.snapshot_hash)
+            .filter(
+                NotificationOutboxDB.snapshot_hash.in_(chunk),
+                NotificationOutboxDB.status.in_(("pending", "sending")),
+            )
+            .distinct()
+        )
+        orphaned.extend(h for h in chunk if h not in referenced)
+
+    if dry_run or not orphaned:
+        return len(orphaned)
+
+    for chunk in _chunks(orphaned, 500):
+        # La grilla de cámaras no debe apuntar a un JPEG borrado
+        db.query(CameraLatestStateDB).filter(CameraLatestStateDB.snapshot_hash.in_(chunk)).update(
+            {"snapshot_hash": None, "snapshot_event_id": None, "snapshot_at": None},
+            synchronize_session=False,
+        )
+    db.commit()
+
+    deleted = sum(1 for h in orphaned if snapshot_store.delete(h))
+    return deleted
+
+
+def _acquire_lock(db: Session):
+    """
+    Conexión dedicada con el advisory lock del job (None si otro worker lo tiene).
+    En SQLite no hay lock: retorna True.
+    """
+    if not is_postgres(db):
+        return True
+    conn = db.get_bind().connect()
+    if conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _ADVISORY_LOCK_KEY}).scalar():
+        conn.commit()  # El lock es de sesión: no dejar la conexión "idle in transaction"
+        return conn
+    conn.close()
+    return None
+
+
+def _release_lock(lock):
+    if lock is True or lock is None:
+        return
+    try:
+        lock.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _ADVISORY_LOCK_KEY})
+    finally:
+        lock.close()
+
+
+def run_once(db: Session, now: Optional[datetime] = None, dry_run: bool = False,
+             partitions_only: bool = False) -> Dict[str, object]:
+    """
+    Una pasada completa: particiones futuras, DROP de vencidas, borrado por lotes y snapshots huérfanos.
+    Con partitions_only (RETENTION_ENABLED=false) solo crea particiones.
+    """
+    now = now or datetime.utcnow()
+    stats: Dict[str, object] = {
+        "partitions_created": [], "partitions_dropped": [],
+        "events_deleted": 0, "hits_deleted": 0, "snapshots_deleted": 0, "skipped": False,
+    }
+    lock = _acquire_lock(db)
+    if lock is None:
+        logging.info("🗂️ Retención: otro worker ya está ejecutando el job")
+        stats["skipped"] = True
+        return stats
+
+    started = time.time()
+    try:
+        if not dry_run:
+            stats["partitions_created"] = ensure_partitions(db, now)
+        if partitions_only:
+            return stats
+
+        retention = user_retention_days(db)
+        hashes: Set[str] = set()
+
+        cutoff = global_cutoff(retention, now)
+        if cutoff is not None:
+            dropped, dropped_hashes = drop_expired_partitions(db, cutoff, dry_run)
+            stats["partitions_dropped"] = dropped
+            hashes |= dropped_hashes
+
+        for user_id, days in retention.items():
+            if days <= 0:
+                continue
+            events, hits, user_hashes = purge_user(db, user_id, now - timedelta(days=days), dry_run=dry_run)
+            stats["events_deleted"] += events
+            stats["hits_deleted"] += hits
+            hashes |= user_hashes
+
+        stats["snapshots_deleted"] = release_snapshots(db, hashes, dry_run)
+    finally:
+        db.rollback()
+        _release_lock(lock)
+
+    if stats["events_deleted"] or stats["hits_deleted"] or stats["partitions_dropped"]:
+        logging.info(
+            f"🧹 Retención: {stats['events_deleted']} eventos, {stats['hits_deleted']} alertas, "
+            f"{len(stats['partitions_dropped'])} particiones y {stats['snapshots_deleted']} snapshots "
+            f"en {time.time() - started:.1f}s"
+        )
+    return stats
+
+
+class RetentionJob:
+    """Tarea asyncio que ejecuta run_once() cada RETENTION_INTERVAL_SECONDS en un thread."""
+
+    def __init__(self, interval: float = RETENTION_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"🧹 Job de retención iniciado (cada {self.interval:.0f}s, default {EVENTS_RETENTION_DAYS} días)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=10)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
+
+    @staticmethod
+    @query_scope("retention.run_once", budget=0)  # Borrados por lotes: muchas queries a propósito
+    def _run_in_thread():
+        db = SessionLocal()
+        try:
+            return run_once(db, partitions_only=not RETENTION_ENABLED)
+        finally:
+            db.close()
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.to_thread(self._run_in_thread)
+            except Exception as e:
+                logging.error(f"❌ Error en el job de retención: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+retention_job = RetentionJob()
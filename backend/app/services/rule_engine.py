@@ -1,20 +1,65 @@
 import logging
 import os
-from typing import Dict, Any
-from datetime import datetime, time
-from sqlalchemy import or_
+import time
+from typing import Dict, Any, Optional
+from datetime import datetime
 
+from app.core import tracing
 from app.db.session import SessionLocal
-from app.models.all_models import RuleDB, RuleHitDB, EventDB, UserDB
-from app.services.whatsapp import send_whatsapp_message, send_whatsapp_image
+from app.models.all_models import RuleHitDB
+from app.services.dedup_state import dedup_state
+from app.services.track_suppressor import track_suppressor
+from app.services.rule_index import rule_index
+from app.services.notification_sender import enqueue_notification, notification_sender
+from app.services.pipeline_metrics import (
+    RULE_EVAL_SECONDS,
+    RULE_EVALUATIONS,
+    RULES_PER_EVENT,
+    RULE_MATCHES,
+    RULE_SUPPRESSIONS,
+)
+
+# "centroid" (default): anti-spam por último hit, compartido entre workers (Redis) y recargado al arrancar
+# "track": una alerta por objeto físico (event_id / IoU / path_data), con estado por proceso
+DEDUP_MODE = os.getenv("DEDUP_MODE", "centroid").lower()
+
+
+def _build_message(rule, camera_name, label, final_score: float, duration, event_db_id: int) -> str:
+    """Texto de la alerta (soporta templates en rule.custom_message)."""
+    default = (
+        f"🔔 *Alerta Vidria*\n"
+        f"📹 Cámara: {camera_name}\n"
+        f"🔍 Objeto: {label}\n"
+        f"📊 Confianza: {int(final_score * 100)}%"
+    )
+    if not (rule.custom_message and rule.custom_message.strip()):
+        return default
+    try:
+        return rule.custom_message.format(
+            camera=camera_name,
+            label=label,
+            score=int(final_score * 100),
+            duration=duration or 0,
+            event_id=event_db_id,
+            rule_name=rule.name
+        )
+    except Exception as e:
+        logging.error(f"Error formateando mensaje custom: {e}")
+        return default  # Fallback on error
 
-def evaluate_rules(event_body: Dict[str, Any], event_db_id: int):
+
+def evaluate_rules(event_body: Dict[str, Any], event_db_id: int, snapshot_hash: Optional[str] = None,
+                   traceparent: Optional[str] = None):
     """
     VERSIÓN OPTIMIZADA:
-    1. Seguridad: Filtra reglas por customer_id (Usuario) y Cámara.
+    1. Seguridad: Filtra reglas por customer_id (Usuario) y Cámara (índice compilado en memoria).
     2. Precisión: Usa el score máximo histórico (max(score, top_score)).
-    3. Rendimiento: Carga la foto solo si es necesario.
+    3. Rendimiento: No envía nada inline; las alertas van a la cola persistente (notification_outbox).
     """
+    started = time.perf_counter()
+    outcome = "evaluated"
+    span = tracing.start_span("rule_evaluation", tracing.parse_traceparent(traceparent), event_id=event_db_id)
+    matched = 0
     db = SessionLocal()
     try:
         # --- PASO 1: IDENTIFICACIÓN DEL DUEÑO (SEGURIDAD) ---
@@ -23,19 +68,9 @@ def evaluate_rules(event_body: Dict[str, Any], event_db_id: int):
         # Validación: Si el evento no tiene dueño, es peligroso procesarlo.
         if not customer_id:
             logging.warning(f"⚠️ Evento {event_db_id} rechazado: Falta 'customer_id'.")
+            outcome = "no_customer"
             return
 
-        # Buscamos al usuario dueño en la base de datos
-        owner_user = db.query(UserDB).filter(UserDB.username == customer_id).first()
-        
-        if not owner_user:
-            logging.warning(f"⚠️ Evento rechazado: El usuario '{customer_id}' no existe en la BD.")
-            return
-
-        # Validar si el usuario pagó (El "Interruptor")
-        # if not owner_user.is_active: 
-        #     return 
-
         # --- PASO 2: OBTENCIÓN DE DATOS DEL EVENTO ---
         camera_name = event_body.get("camera")
         label = event_body.get("label")
@@ -46,209 +81,93 @@ def evaluate_rules(event_body: Dict[str, Any], event_db_id: int):
         # Si el usuario ve top_score en la UI, la regla debe validarse contra eso.
         final_score = float(event_body.get("top_score") or 0.0)
 
-        # --- PASO 3: CONSULTA OPTIMIZADA (EFICIENCIA) ---
-        # Solo traemos las reglas de ESTE usuario y para ESTA cámara
-        rules = db.query(RuleDB).filter(
-            RuleDB.user_id == owner_user.id,
-            RuleDB.enabled == True,
-            or_(
-                RuleDB.camera == None,       # Reglas globales
-                RuleDB.camera == "",         # Reglas globales (string vacío)
-                RuleDB.camera.ilike(camera_name) # Reglas específicas (insensible a mayúsculas)
-            )
-        ).all()
+        # --- PASO 3: ÍNDICE COMPILADO (EFICIENCIA) ---
+        # Dueño + reglas de ESTE usuario para ESTA cámara, sin tocar la BD si ya están en caché
+        owner_user, rules = rule_index.lookup(db, customer_id, camera_name)
+
+        if not owner_user:
+            logging.warning(f"⚠️ Evento rechazado: El usuario '{customer_id}' no existe en la BD.")
+            outcome = "no_owner"
+            return
+
+        # Validar si el usuario pagó (El "Interruptor")
+        # if not owner_user.is_active: 
+        #     return 
 
         if not rules:
             logging.info(f"ℹ️ Usuario {owner_user.username} no tiene reglas activas para cámara '{camera_name}'.")
+            outcome = "no_rules"
             return
 
+        RULES_PER_EVENT.observe(len(rules))
         logging.info(f"🔍 Evaluando {len(rules)} reglas para {owner_user.username} (Cam: {camera_name}, Score: {final_score})")
 
+        # Asociar el evento a un objeto (track) una sola vez, no por regla.
+        # Sin caja ni event_id no hay nada que seguir: se usa el anti-spam por tiempo.
+        track = None
+        if DEDUP_MODE == "track":
+            track = track_suppressor.observe(owner_user.id, camera_name, event_body)
+
         # --- PASO 4: EVALUACIÓN DE CADA REGLA ---
+        now_time = datetime.utcnow().time()  # Usar UTC explícitamente para comparar con reglas guardadas en UTC
         for rule in rules:
-            match = True
-            reasons = []
-
-            # A. Validación de Etiqueta (Label)
-            if rule.label:
-                rule_labels = [l.strip().lower() for l in rule.label.split(",") if l.strip()]
-                if label and label.lower() not in rule_labels:
-                    match = False
-                    reasons.append(f"label mismatch")
-            
-            # B. Validación de Tipo (New/End) - Anti Spam
-            if rule.frigate_type:
-                if rule.frigate_type != frigate_type:
-                    match = False
-                    reasons.append(f"type mismatch")
-            else:
-                # Por defecto, ignoramos los 'update' si la regla no dice nada
-                if frigate_type not in ['new', 'end']:
-                    match = False
-                    reasons.append(f"ignoring update")
-
-            # C. Validación de Score (Usando el final_score corregido)
-            if rule.min_score is not None:
-                if final_score < float(rule.min_score):
-                    match = False
-                    reasons.append(f"score too low ({final_score} < {rule.min_score})")
-
-            # D. Validación de Duración
-            if rule.min_duration_seconds is not None:
-                curr_dur = float(duration) if duration else 0.0
-                if curr_dur < float(rule.min_duration_seconds):
-                    match = False
-                    reasons.append(f"duration too short")
-
-            # E. Validación de Horario
-            if rule.time_start or rule.time_end:
-                try:
-                    now_time = datetime.utcnow().time()  # Usar UTC explícitamente para comparar con reglas guardadas en UTC
-                    t_start = datetime.strptime(rule.time_start, "%H:%M").time() if rule.time_start else None
-                    t_end = datetime.strptime(rule.time_end, "%H:%M").time() if rule.time_end else None
-                    
-                    in_range = True
-                    if t_start and t_end:
-                        if t_start <= t_end: # Rango diurno (08:00 - 18:00)
-                            in_range = t_start <= now_time <= t_end
-                        else: # Rango nocturno (22:00 - 06:00)
-                            in_range = now_time >= t_start or now_time <= t_end
-                    elif t_start:
-                        in_range = now_time >= t_start
-                    elif t_end:
-                        in_range = now_time <= t_end
-                    
-                    if not in_range:
-                        match = False
-                        reasons.append("time out of range")
-                except Exception as e:
-                    logging.error(f"Error validando hora: {e}")
-
-            if not match:
+            reasons = rule.mismatch_reasons(label, frigate_type, final_score, duration, now_time)
+            if reasons:
                 # logging.debug(f"Regla {rule.name} descartada: {reasons}")
                 continue
+            RULE_MATCHES.inc()
 
             # --- DESDUPLICACIÓN INTELIGENTE (Anti-Spam) ---
-            # Verifica si ya enviamos una alerta similar recientemente
-            is_spam = False
-            last_hit = (
-                db.query(RuleHitDB)
-                .filter(RuleHitDB.rule_id == rule.id)
-                .order_by(RuleHitDB.triggered_at.desc())
-                .first()
-            )
-
-            if last_hit:
-                time_diff = (datetime.utcnow() - last_hit.triggered_at).total_seconds()
-                
-                # 1. Filtro de Tiempo (60 segundos por defecto)
-                if time_diff < 60:
-                    # Recuperamos el evento anterior para comparar posiciones
-                    prev_event = db.query(EventDB).filter(EventDB.id == last_hit.event_id).first()
-                    
-                    if prev_event:
-                        import json
-                        import math
-                        
-                        try:
-                            # Datos actuales
-                            curr_box = event_body.get("box", [])
-                            
-                            # Datos anteriores
-                            prev_payload = json.loads(prev_event.payload)
-                            prev_box = prev_payload.get("box", [])
-
-                            # Si ambos tienen caja, comparamos distancia (Filtro Espacial)
-                            if curr_box and prev_box and len(curr_box) == 4 and len(prev_box) == 4:
-                                # Detección automática de formato (Normalizado vs Pixeles)
-                                # Si los valores son pequeños (<1.1), asumimos normalizado.
-                                is_normalized = all(x <= 1.1 for x in curr_box)
-                                tolerance = 0.05 if is_normalized else 50.0  # 5% o 50px de margen
-
-                                # Cálculo de Centroides ( promedio de coord )
-                                # Funciona igual para [ymin, xmin, ymax, xmax] o [x, y, w, h]
-                                # c_x = (x1 + x2) / 2
-                                # c_y = (y1 + y2) / 2
-                                c1_y = (curr_box[0] + curr_box[2]) / 2
-                                c1_x = (curr_box[1] + curr_box[3]) / 2
-                                
-                                c2_y = (prev_box[0] + prev_box[2]) / 2
-                                c2_x = (prev_box[1] + prev_box[3]) / 2
-
-                                # Distancia Euclidiana
-                                distance = math.sqrt((c1_x - c2_x)**2 + (c1_y - c2_y)**2)
-
-                                if distance < tolerance:
-                                    logging.info(f"🚫 Alerta duplicada descartada (Distancia {distance:.2f} < Margen {tolerance})")
-                                    is_spam = True
-                            else:
-                                # Sin cajas para comparar, nos basamos solo en el tiempo
-                                logging.info(f"🚫 Alerta duplicada descartada por tiempo ({time_diff:.1f}s < 60s)")
-                                is_spam = True
-
-                        except Exception as e_dup:
-                            logging.error(f"Error calculando duplicados: {e_dup}")
-                            # En caso de error, NO marcamos como spam por seguridad
-                            is_spam = False
-
-            if is_spam:
+            # Estado en memoria: por track (mismo objeto) o por regla (último disparo + centroide)
+            if track is not None:
+                suppression, undo = track_suppressor.check_and_record(track, rule)
+            else:
+                suppression, undo = dedup_state.check_and_record(rule, event_body.get("box"))
+            if suppression:
+                RULE_SUPPRESSIONS.inc(reason=suppression.code)
+                logging.info(f"🚫 Alerta duplicada descartada ({suppression.detail})")
                 continue
 
             # --- PASO 5: EJECUCIÓN (MATCH EXITOSO) ---
-            
-            # Registrar el disparo de la regla
-            hit = RuleHitDB(rule_id=rule.id, event_id=event_db_id, action="whatsapp")
-            db.add(hit)
-            db.commit()
-
-            # Validaciones finales de usuario para WhatsApp
-            if not owner_user.whatsapp_number or not owner_user.whatsapp_notifications_enabled:
+            notify = bool(owner_user.whatsapp_number and owner_user.whatsapp_notifications_enabled)
+            try:
+                # Registrar el disparo de la regla
+                db.add(RuleHitDB(rule_id=rule.id, event_id=event_db_id, action="whatsapp"))
+
+                if notify:
+                    # Encolar (misma transacción que el hit). El NotificationSender adjunta
+                    # el snapshot (por hash, sin releer el evento) y hace el envío fuera de este thread.
+                    enqueue_notification(
+                        db,
+                        to_number=owner_user.whatsapp_number,
+                        message=_build_message(rule, camera_name, label, final_score, duration, event_db_id),
+                        event_id=event_db_id,
+                        rule_id=rule.id,
+                        user_id=owner_user.id,
+                        snapshot_hash=snapshot_hash,
+                        traceparent=span.traceparent,
+                    )
+                db.commit()
+            except Exception:
+                # El hit no quedó guardado: que el anti-spam tampoco lo cuente
+                db.rollback()
+                undo()
+                raise
+
+            if not notify:
                 logging.info(f"🔕 Usuario {owner_user.username} tiene notificaciones apagadas o sin número.")
                 continue
 
-            # Construir mensaje (Soporte para templates)
-            if rule.custom_message and rule.custom_message.strip():
-                try:
-                    msg = rule.custom_message.format(
-                        camera=camera_name,
-                        label=label,
-                        score=int(final_score * 100),
-                        duration=duration or 0,
-                        event_id=event_db_id,
-                        rule_name=rule.name
-                    )
-                except Exception as e:
-                    logging.error(f"Error formateando mensaje custom: {e}")
-                    # Fallback on error
-                    msg = (
-                        f"🔔 *Alerta Vidria*\n"
-                        f"📹 Cámara: {camera_name}\n"
-                        f"🔍 Objeto: {label}\n"
-                        f"📊 Confianza: {int(final_score * 100)}%"
-                    )
-            else:
-                msg = (
-                    f"🔔 *Alerta Vidria*\n"
-                    f"📹 Cámara: {camera_name}\n"
-                    f"🔍 Objeto: {label}\n"
-                    f"📊 Confianza: {int(final_score * 100)}%"
-                )
-
-            # Carga LAZY de la imagen (Solo si vamos a enviar)
-            snapshot_b64 = None
-            event_record = db.query(EventDB).filter(EventDB.id == event_db_id).first()
-            if event_record and event_record.snapshot_base64:
-                snapshot_b64 = event_record.snapshot_base64
-
-            # Enviar
-            if snapshot_b64:
-                send_whatsapp_image(snapshot_b64, msg, to_number=owner_user.whatsapp_number, is_base64=True)
-            else:
-                send_whatsapp_message(msg, to_number=owner_user.whatsapp_number)
+            matched += 1
+            notification_sender.wake()
 
-            logging.info(f"✅ Notificación enviada a {owner_user.username} por regla '{rule.name}'")
+            logging.info(f"✅ Notificación encolada para {owner_user.username} por regla '{rule.name}'")
 
     except Exception as e:
+        outcome = "error"
         logging.error(f"❌ Error CRÍTICO en evaluate_rules: {e}")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+        RULE_EVALUATIONS.inc(outcome=outcome)
+        RULE_EVAL_SECONDS.observe(time.perf_counter() - started)
+        span.end(outcome=outcome, notifications=matched)
\ No newline at end of file
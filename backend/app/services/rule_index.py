@@ -0,0 +1,223 @@
+"""
+Índice compilado de reglas (en memoria, por proceso).
+
+Evita las dos consultas a la BD que hacía evaluate_rules en cada evento
+(UserDB por username + RuleDB con filtro ilike de cámara) y el trabajo
+repetido por regla (split de labels, strptime de horarios).
+
+- Las reglas de un usuario se cargan UNA vez y se agrupan por cámara.
+- Cada regla queda "compilada": labels en un frozenset, horarios ya parseados.
+- Los endpoints de reglas/perfil llaman a invalidate_user() al modificar datos.
+- Como cada worker de gunicorn tiene su propio índice, las entradas expiran
+  tras RULE_INDEX_TTL_SECONDS para que los demás procesos se enteren del cambio.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, time as dt_time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.all_models import RuleDB, UserDB
+
+RULE_INDEX_TTL_SECONDS = float(os.getenv("RULE_INDEX_TTL_SECONDS", "30"))
+
+
+@dataclass(frozen=True)
+class RuleOwner:
+    """Datos del dueño de las reglas que necesita el motor para notificar."""
+    id: int
+    username: str
+    whatsapp_number: Optional[str]
+    whatsapp_notifications_enabled: bool
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    """Regla con sus condiciones pre-procesadas para evaluarse sin tocar la BD."""
+    id: int
+    name: str
+    camera: Optional[str]  # En minúsculas, None = regla global
+    labels: Optional[FrozenSet[str]]  # None = cualquier label
+    frigate_type: Optional[str]
+    min_score: Optional[float]
+    min_duration_seconds: Optional[float]
+    custom_message: Optional[str]
+    time_start: Optional[dt_time]
+    time_end: Optional[dt_time]
+    dedup_window_seconds: Optional[float] = None
+    dedup_tolerance: Optional[float] = None
+
+    def mismatch_reasons(
+        self,
+        label: Optional[str],
+        frigate_type: Optional[str],
+        score: float,
+        duration: Optional[float],
+        now_time: dt_time,
+    ) -> List[str]:
+        """Retorna las razones por las que el evento NO cumple la regla (vacío = match)."""
+        reasons = []
+
+        # A. Etiqueta
+        if self.labels is not None and label and label.lower() not in self.labels:
+            reasons.append("label mismatch")
+
+        # B. Tipo (New/End) - por defecto ignoramos los 'update'
+        if self.frigate_type:
+            if self.frigate_type != frigate_type:
+                reasons.append("type mismatch")
+        elif frigate_type not in ("new", "end"):
+            reasons.append("ignoring update")
+
+        # C. Score
+        if self.min_score is not None and score < self.min_score:
+            reasons.append(f"score too low ({score} < {self.min_score})")
+
+        # D. Duración
+        if self.min_duration_seconds is not None:
+            curr_dur = float(duration) if duration else 0.0
+            if curr_dur < self.min_duration_seconds:
+                reasons.append("duration too short")
+
+        # E. Horario (guardado en UTC)
+        if self.time_start or self.time_end:
+            t_start, t_end = self.time_start, self.time_end
+            if t_start and t_end:
+                if t_start <= t_end:  # Rango diurno (08:00 - 18:00)
+                    in_range = t_start <= now_time <= t_end
+                else:  # Rango nocturno (22:00 - 06:00)
+                    in_range = now_time >= t_start or now_time <= t_end
+            elif t_start:
+                in_range = now_time >= t_start
+            else:
+                in_range = now_time <= t_end
+
+            if not in_range:
+                reasons.append("time out of range")
+
+        return reasons
+
+
+def _parse_hhmm(value: Optional[str], rule_id: int) -> Optional[dt_time]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%H:%M").time()
+    except ValueError as e:
+        # Igual que antes: un horario inválido no bloquea la regla
+        logging.error(f"Error validando hora de regla {rule_id}: {e}")
+        return None
+
+
+def compile_rule(rule: RuleDB) -> CompiledRule:
+    labels = None
+    if rule.label:
+        labels = frozenset(l.strip().lower() for l in rule.label.split(",") if l.strip())
+
+    return CompiledRule(
+        id=rule.id,
+        name=rule.name,
+        camera=rule.camera.lower() if rule.camera else None,
+        labels=labels,
+        frigate_type=rule.frigate_type or None,
+        min_score=float(rule.min_score) if rule.min_score is not None else None,
+        min_duration_seconds=float(rule.min_duration_seconds) if rule.min_duration_seconds is not None else None,
+        custom_message=rule.custom_message,
+        time_start=_parse_hhmm(rule.time_start, rule.id),
+        time_end=_parse_hhmm(rule.time_end, rule.id),
+        dedup_window_seconds=float(rule.dedup_window_seconds) if rule.dedup_window_seconds is not None else None,
+        dedup_tolerance=float(rule.dedup_tolerance) if rule.dedup_tolerance is not None else None,
+    )
+
+
+class _UserEntry:
+    __slots__ = ("owner", "global_rules", "by_camera", "loaded_at")
+
+    def __init__(self, owner: Optional[RuleOwner], rules: List[CompiledRule]):
+        self.owner = owner
+        self.loaded_at = time.monotonic()
+        self.global_rules: Tuple[CompiledRule, ...] = tuple(r for r in rules if r.camera is None)
+
+        specific: Dict[str, List[CompiledRule]] = {}
+        for r in rules:
+            if r.camera is not None:
+                specific.setdefault(r.camera, []).append(r)
+
+        # Cada cámara ya incluye las reglas globales: un lookup = una tupla lista
+        self.by_camera: Dict[str, Tuple[CompiledRule, ...]] = {
+            cam: tuple(sorted(self.global_rules + tuple(cam_rules), key=lambda r: r.id))
+            for cam, cam_rules in specific.items()
+        }
+
+    def rules_for(self, camera: Optional[str]) -> Tuple[CompiledRule, ...]:
+        if not camera:
+            return self.global_rules
+        return self.by_camera.get(camera.lower(), self.global_rules)
+
+
+class RuleIndex:
+    """Caché (usuario, cámara) -> reglas compiladas, con invalidación explícita y TTL."""
+
+    def __init__(self, ttl_seconds: float = RULE_INDEX_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _UserEntry] = {}  # username -> entrada
+        self._usernames: Dict[int, str] = {}  # user_id -> username
+        self._generation = 0
+
+    def lookup(self, db: Session, customer_id: str, camera: Optional[str]) -> Tuple[Optional[RuleOwner], Tuple[CompiledRule, ...]]:
+        """Retorna (dueño, reglas activas para la cámara). Solo consulta la BD en un miss."""
+        entry = self._entries.get(customer_id)
+        if entry is None or time.monotonic() - entry.loaded_at > self.ttl_seconds:
+            entry = self._load(db, customer_id)
+        return entry.owner, entry.rules_for(camera)
+
+    def _load(self, db: Session, customer_id: str) -> _UserEntry:
+        with self._lock:
+            generation = self._generation
+
+        user = db.query(UserDB).filter(UserDB.username == customer_id).first()
+        if not user:
+            # Cacheamos también el "no existe" para no martillar la BD con listeners mal configurados
+            entry = _UserEntry(None, [])
+        else:
+            rules = db.query(RuleDB).filter(
+                RuleDB.user_id == user.id,
+                RuleDB.enabled == True
+            ).all()
+            owner = RuleOwner(
+                id=user.id,
+                username=user.username,
+                whatsapp_number=user.whatsapp_number,
+                whatsapp_notifications_enabled=bool(user.whatsapp_notifications_enabled),
+            )
+            entry = _UserEntry(owner, [compile_rule(r) for r in rules])
+
+        with self._lock:
+            # Si hubo una invalidación mientras consultábamos, no guardamos datos viejos
+            if generation == self._generation:
+                self._entries[customer_id] = entry
+                if entry.owner:
+                    self._usernames[entry.owner.id] = customer_id
+        return entry
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self._generation += 1
+            username = self._usernames.pop(user_id, None)
+            if username is not None:
+                self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._usernames.clear()
+
+
+rule_index = RuleIndex()
@@ -0,0 +1,132 @@
+"""
+Almacén de snapshots direccionado por contenido.
+
+Antes cada snapshot se guardaba como base64 en events.snapshot_base64 (33% más
+grande que el JPEG y todo dentro de Postgres/TOAST). Ahora el JPEG se guarda
+una sola vez en disco, nombrado por su SHA-256, y el evento solo guarda
+snapshot_hash + snapshot_size.
+
+- Mismo contenido => mismo archivo (deduplicación gratis).
+- Escritura atómica (archivo temporal + rename): nunca se sirve un JPEG a medias.
+- Los archivos son inmutables; aun así son imágenes privadas de cámaras, así
+  que la URL va firmada (HMAC) con el usuario dueño y vence en minutos, y el
+  navegador solo la cachea hasta que vence (ver signed_snapshot_url).
+
+Configuración:
+    SNAPSHOT_STORE_DIR        Directorio base (default "snapshots"). En Railway debe
+                              estar sobre un volumen persistente.
+    SNAPSHOT_URL_TTL_SECONDS  Validez mínima de una URL firmada (default 900)
+    SNAPSHOT_URL_SECRET       Clave del HMAC (default: JWT_SECRET_KEY)
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Optional, Tuple
+
+from app.core.security import SECRET_KEY
+
+SNAPSHOT_STORE_DIR = os.getenv("SNAPSHOT_STORE_DIR", "snapshots")
+SNAPSHOT_URL_TTL_SECONDS = int(os.getenv("SNAPSHOT_URL_TTL_SECONDS", "900"))
+SNAPSHOT_URL_SECRET = (os.getenv("SNAPSHOT_URL_SECRET") or SECRET_KEY).encode()
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_valid_digest(digest: str) -> bool:
+    return bool(digest) and bool(_DIGEST_RE.match(digest))
+
+
+def _signature(digest: str, user_id: int, expires: int) -> str:
+    message = f"{digest}:{user_id}:{expires}".encode()
+    return hmac.new(SNAPSHOT_URL_SECRET, message, hashlib.sha256).hexdigest()[:32]
+
+
+def snapshot_url(digest: Optional[str], user_id: Optional[int], now: Optional[float] = None) -> Optional[str]:
+    """
+    URL relativa y firmada del endpoint que sirve el JPEG (None si el evento no
+    tiene snapshot o no tiene dueño).
+
+    El vencimiento se redondea al siguiente múltiplo de SNAPSHOT_URL_TTL_SECONDS
+    (vale entre 1 y 2 TTL): dentro de esa franja la URL no cambia entre listados
+    y el navegador reutiliza su caché.
+    """
+    if not digest or user_id is None:
+        return None
+    now = time.time() if now is None else now
+    expires = (int(now) // SNAPSHOT_URL_TTL_SECONDS + 2) * SNAPSHOT_URL_TTL_SECONDS
+    return f"/api/events/snapshots/{digest}?u={user_id}&exp={expires}&sig={_signature(digest, user_id, expires)}"
+
+
+def verify_snapshot_signature(digest: str, user_id: int, expires: int, sig: str, now: Optional[float] = None) -> bool:
+    """True si la firma corresponde y la URL no venció (no verifica que el usuario sea dueño)."""
+    now = time.time() if now is None else now
+    if expires < now:
+        return False
+    return hmac.compare_digest(_signature(digest, user_id, expires), sig or "")
+
+
+class FilesystemSnapshotStore:
+    """Backend local: <base>/<ab>/<cd>/<sha256>.jpg"""
+
+    def __init__(self, base_dir: str = SNAPSHOT_STORE_DIR):
+        self.base_dir = base_dir
+
+    def path_for(self, digest: str) -> str:
+        if not is_valid_digest(digest):
+            raise ValueError(f"Digest inválido: {digest!r}")
+        return os.path.join(self.base_dir, digest[:2], digest[2:4], f"{digest}.jpg")
+
+    def put(self, data: bytes) -> Tuple[str, int]:
+        """Guarda los bytes y retorna (sha256, tamaño). Idempotente."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            return digest, len(data)
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, len(data)
+
+    def put_base64(self, snapshot_b64: str) -> Tuple[str, int]:
+        return self.put(base64.b64decode(snapshot_b64, validate=True))
+
+    def get(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self.path_for(digest), "rb") as f:
+                return f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def exists(self, digest: str) -> bool:
+        try:
+            return os.path.exists(self.path_for(digest))
+        except ValueError:
+            return False
+
+    def delete(self, digest: str) -> bool:
+        try:
+            os.remove(self.path_for(digest))
+            return True
+        except (FileNotFoundError, ValueError):
+            return False
+        except OSError as e:
+            logging.error(f"❌ Error eliminando snapshot {digest}: {e}")
+            return False
+
+
+snapshot_store = FilesystemSnapshotStore()
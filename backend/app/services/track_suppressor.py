@@ -0,0 +1,313 @@
+"""
+Supresión de alertas por seguimiento (tracks) en lugar de solo por centroide.
+
+El anti-spam por centroide (dedup_state) compara únicamente contra el último
+hit de la regla: en un parqueadero con movimiento deja pasar duplicados (el
+mismo carro alterna con otros) y descarta alertas reales (otro objeto en el
+mismo lugar dentro de la ventana). Aquí cada evento se asocia a un "track"
+(un objeto físico) y cada regla alerta UNA vez por track:
+
+1. Mismo event_id de Frigate -> mismo track.
+2. Caja con IoU >= TRACK_IOU_THRESHOLD contra un track reciente de la misma
+   etiqueta (o cualquier IoU si el track estaba estacionario).
+3. Continuidad de path_data: el recorrido nuevo empieza cerca (en espacio y
+   tiempo) de donde terminó el de un track (Frigate perdió y re-adquirió el objeto).
+
+Un objeto que sigue a la vista vuelve a alertar cuando pasa la ventana de la
+regla (dedup_window_seconds, default 60s; 0 desactiva la supresión). La
+tolerancia de distancia (dedup_tolerance) no aplica aquí: la asociación al
+track ya decide si es el mismo objeto.
+
+Para que sea O(1) por evento, los tracks de cada cámara se indexan en una
+grilla gruesa por el centroide de su caja y solo se comparan los de las 3x3
+celdas vecinas (con un máximo de tracks por celda).
+
+OJO: los tracks viven en memoria POR PROCESO. No se comparten entre workers de
+gunicorn y no se reconstruyen al reiniciar: con N procesos, el mismo objeto puede alertar hasta N veces por
+ventana (una vez por proceso que reciba alguno de sus eventos), y después de
+cada reinicio vuelve a alertar. Por eso es opcional (DEDUP_MODE=track): el
+default es DEDUP_MODE=centroid, compartido entre workers con Redis y
+recargado desde rule_hits al arrancar (ver dedup_state.py).
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.services.dedup_state import DedupState, Suppression, Undo, noop_undo
+
+TRACK_TTL_SECONDS = float(os.getenv("TRACK_TTL_SECONDS", "300"))  # Un track sin eventos por este tiempo se olvida
+TRACK_MAX_GAP_SECONDS = float(os.getenv("TRACK_MAX_GAP_SECONDS", "60"))  # Hueco máximo para asociar por IoU (objetos en movimiento)
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+TRACK_PATH_MAX_GAP = float(os.getenv("TRACK_PATH_MAX_GAP", "0.05"))  # Distancia normalizada entre fin y comienzo de recorrido
+TRACK_PATH_MAX_SECONDS = float(os.getenv("TRACK_PATH_MAX_SECONDS", "30"))
+TRACK_GRID_SIZE = int(os.getenv("TRACK_GRID_SIZE", "8"))  # Celdas por lado para cajas normalizadas
+TRACK_GRID_CELL_PX = float(os.getenv("TRACK_GRID_CELL_PX", "160"))  # Tamaño de celda para cajas en píxeles
+TRACK_MAX_PER_CELL = int(os.getenv("TRACK_MAX_PER_CELL", "16"))
+
+Box = Tuple[float, float, float, float]
+
+
+@dataclass
+class Track:
+    id: int
+    label: Optional[str]
+    box: Optional[Box]
+    cell: Optional[Tuple[int, int]]
+    path_end: Optional[Tuple[float, float, float]]  # (x, y, timestamp) del último punto de path_data
+    stationary: bool
+    last_seen: float  # Epoch del último evento (end_time de Frigate si viene)
+    touched_at: float  # time.time() del último evento, para el TTL
+    event_ids: Set[str] = field(default_factory=set)
+    alerted: Dict[int, float] = field(default_factory=dict)  # rule_id -> cuándo alertó
+
+
+def _parse_box(box: Any) -> Optional[Box]:
+    if not box or not isinstance(box, (list, tuple)) or len(box) != 4:
+        return None
+    try:
+        b = tuple(float(v) for v in box)
+    except (TypeError, ValueError):
+        return None
+    if b[2] < b[0] or b[3] < b[1]:
+        return None
+    return b
+
+
+def iou(a: Box, b: Box) -> float:
+    """Intersección sobre unión de dos cajas en formato de esquinas."""
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _path_points(path_data: Any) -> List[Tuple[float, float, float]]:
+    """path_data de Frigate: [[[x, y], timestamp], ...] normalizado. Ignora puntos mal formados."""
+    points = []
+    if not isinstance(path_data, list):
+        return points
+    for item in path_data:
+        try:
+            (x, y), ts = item
+            points.append((float(x), float(y), float(ts)))
+        except (TypeError, ValueError):
+            continue
+    return points
+
+
+def _cell_for(box: Box) -> Tuple[int, int]:
+    cx = (box[0] + box[2]) / 2
+    cy = (box[1] + box[3]) / 2
+    if all(v <= 1.1 for v in box):
+        return int(cx * TRACK_GRID_SIZE), int(cy * TRACK_GRID_SIZE)
+    return int(cx // TRACK_GRID_CELL_PX), int(cy // TRACK_GRID_CELL_PX)
+
+
+class _CameraTracks:
+    """Tracks de una cámara de un usuario, con índice por event_id y por celda de grilla."""
+
+    __slots__ = ("tracks", "by_event_id", "grid")
+
+    def __init__(self):
+        self.tracks: Dict[int, Track] = {}
+        self.by_event_id: Dict[str, int] = {}
+        self.grid: Dict[Tuple[int, int], List[int]] = {}
+
+    def remove(self, track: Track):
+        self.tracks.pop(track.id, None)
+        for event_id in track.event_ids:
+            if self.by_event_id.get(event_id) == track.id:
+                del self.by_event_id[event_id]
+        if track.cell is not None:
+            ids = self.grid.get(track.cell)
+            if ids and track.id in ids:
+                ids.remove(track.id)
+                if not ids:
+                    del self.grid[track.cell]
+
+    def place(self, track: Track, cell: Optional[Tuple[int, int]]):
+        if track.cell == cell and (cell is None or track.id in self.grid.get(cell, ())):
+            return
+        if track.cell is not None:
+            ids = self.grid.get(track.cell)
+            if ids and track.id in ids:
+                ids.remove(track.id)
+                if not ids:
+                    del self.grid[track.cell]
+        track.cell = cell
+        if cell is None:
+            return
+        ids = self.grid.setdefault(cell, [])
+        ids.append(track.id)
+        if len(ids) > TRACK_MAX_PER_CELL:
+            # Celda saturada: olvidamos el track menos reciente
+            oldest = min((self.tracks[i] for i in ids if i in self.tracks), key=lambda t: t.touched_at)
+            self.remove(oldest)
+
+    def neighbours(self, cell: Tuple[int, int]):
+        cx, cy = cell
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for track_id in self.grid.get((cx + dx, cy + dy), ()):
+                    track = self.tracks.get(track_id)
+                    if track is not None:
+                        yield track
+
+
+class TrackSuppressor:
+    SWEEP_EVERY = 512
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cameras: Dict[Tuple[Any, str], _CameraTracks] = {}
+        self._next_id = 1
+        self._observed = 0
+
+    def observe(self, scope: Any, camera: Optional[str], event_body: Dict[str, Any]) -> Optional[Track]:
+        """
+        Asocia el evento a un track (o crea uno). `scope` separa a los usuarios
+        (p.ej. user_id). Retorna None si el evento no trae ni caja ni event_id.
+        """
+        event_id = event_body.get("event_id")
+        box = _parse_box(event_body.get("box"))
+        if box is None and not event_id:
+            return None
+
+        label = (event_body.get("label") or "").lower() or None
+        path = _path_points(event_body.get("path_data"))
+        stationary = bool(event_body.get("stationary"))
+        now = time.time()
+        start_time = _as_float(event_body.get("start_time"), now)
+        end_time = _as_float(event_body.get("end_time"), now)
+
+        with self._lock:
+            self._observed += 1
+            if self._observed % self.SWEEP_EVERY == 0:
+                self._sweep(now)
+
+            key = (scope, (camera or "").lower())
+            cam = self._cameras.get(key)
+            if cam is None:
+                cam = self._cameras[key] = _CameraTracks()
+
+            track = self._match(cam, event_id, box, label, path, start_time, now)
+            if track is None:
+                track = Track(
+                    id=self._next_id, label=label, box=None, cell=None, path_end=None,
+                    stationary=stationary, last_seen=end_time, touched_at=now,
+                )
+                self._next_id += 1
+                cam.tracks[track.id] = track
+
+            track.touched_at = now
+            if event_id:
+                track.event_ids.add(event_id)
+                cam.by_event_id[event_id] = track.id
+            if box is not None:
+                track.box = box
+                cam.place(track, _cell_for(box))
+            if path:
+                track.path_end = path[-1]
+            track.stationary = stationary
+            track.last_seen = max(track.last_seen, end_time)
+            return track
+
+    def _match(self, cam: _CameraTracks, event_id, box, label, path, start_time: float, now: float) -> Optional[Track]:
+        # 1. Mismo objeto de Frigate
+        if event_id:
+            track_id = cam.by_event_id.get(event_id)
+            if track_id is not None and track_id in cam.tracks:
+                track = cam.tracks[track_id]
+                if now - track.touched_at <= TRACK_TTL_SECONDS:
+                    return track
+
+        if box is None:
+            return None
+
+        path_start = path[0] if path else None
+        best, best_score = None, 0.0
+        for track in cam.neighbours(_cell_for(box)):
+            if now - track.touched_at > TRACK_TTL_SECONDS:
+                continue
+            if label and track.label and label != track.label:
+                continue
+
+            # 2. Solapamiento con la última caja del track
+            gap = start_time - track.last_seen
+            if track.box is not None and (track.stationary or gap <= TRACK_MAX_GAP_SECONDS):
+                overlap = iou(box, track.box)
+                if overlap >= TRACK_IOU_THRESHOLD and overlap > best_score:
+                    best, best_score = track, overlap
+
+            # 3. Continuidad del recorrido (Frigate re-adquirió el objeto con otro id)
+            if path_start and track.path_end:
+                px, py, pt = track.path_end
+                distance = ((path_start[0] - px) ** 2 + (path_start[1] - py) ** 2) ** 0.5
+                if distance <= TRACK_PATH_MAX_GAP and 0 <= path_start[2] - pt <= TRACK_PATH_MAX_SECONDS:
+                    score = 1.0 + (1.0 - distance / TRACK_PATH_MAX_GAP if TRACK_PATH_MAX_GAP else 1.0)
+                    if score > best_score:
+                        best, best_score = track, score
+
+        return best
+
+    def check_and_record(self, track: Track, rule, now: Optional[float] = None) -> Tuple[Optional[Suppression], Undo]:
+        """
+        Retorna (razón, undo). Con razón si `rule` ya alertó por este track
+        dentro de su ventana; si no, marca la alerta (undo() la desmarca si
+        después no se pudo guardar).
+        """
+        window = DedupState.window_for(rule)
+        if window <= 0:
+            return None, noop_undo
+        now = time.time() if now is None else now
+        with self._lock:
+            alerted_at = track.alerted.get(rule.id)
+            if alerted_at is not None and now - alerted_at < window:
+                reason = Suppression("track", f"mismo objeto, track {track.id} ({now - alerted_at:.1f}s < {window:.0f}s)")
+                return reason, noop_undo
+            track.alerted[rule.id] = now
+
+        def undo():
+            with self._lock:
+                if track.alerted.get(rule.id) != now:
+                    return  # Otra alerta ya la pisó
+                if alerted_at is None:
+                    del track.alerted[rule.id]
+                else:
+                    track.alerted[rule.id] = alerted_at
+
+        return None, undo
+
+    def _sweep(self, now: float):
+        for key, cam in list(self._cameras.items()):
+            for track in [t for t in cam.tracks.values() if now - t.touched_at > TRACK_TTL_SECONDS]:
+                cam.remove(track)
+            if not cam.tracks:
+                del self._cameras[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "cameras": len(self._cameras),
+                "tracks": sum(len(c.tracks) for c in self._cameras.values()),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._cameras.clear()
+
+
+def _as_float(value: Any, default: float) -> float:
+    try:
+        return float(value) if value is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+track_suppressor = TrackSuppressor()
@@ -12,12 +12,46 @@ ARQUITECTURA:
   * Activar notificaciones (whatsapp_notifications_enabled = True)
 
 - El sistema envía notificaciones DESDE el WhatsApp del admin HACIA los usuarios
+
+ENVÍO:
+- Las funciones síncronas (send_whatsapp_*) se mantienen para scripts y pruebas manuales.
+- Las alertas del motor de reglas pasan por la cola persistente (notification_outbox)
+  y las envía NotificationSender con las funciones async_* de este módulo.
+- WHATSAPP_API_BASE permite apuntar a un Graph API falso/local para pruebas.
 """
 
 import os
 import logging
 import requests
 import base64
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import httpx
+
+GRAPH_API_BASE = os.getenv("WHATSAPP_API_BASE", "https://graph.facebook.com/v17.0").rstrip("/")
+WHATSAPP_TIMEOUT = float(os.getenv("WHATSAPP_TIMEOUT", "10"))
+
+# Sesión compartida: reutiliza conexiones keep-alive con graph.facebook.com
+_session = requests.Session()
+
+
+@dataclass
+class SendResult:
+    """Resultado de una llamada al Graph API."""
+    ok: bool
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    retryable: bool = False  # 429 / 5xx / errores de red se pueden reintentar
+    message_id: Optional[str] = None
+
+
+def _credentials() -> Tuple[Optional[str], Optional[str]]:
+    return os.getenv("WHATSAPP_TOKEN"), os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+
+
+def _is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
 
 def send_whatsapp_message(text: str, to_number: str) -> bool:
     """
@@ -41,7 +75,7 @@ def send_whatsapp_message(text: str, to_number: str) -> bool:
         logging.error("❌ Número de WhatsApp destino vacío")
         return False
 
-    url = f"https://graph.facebook.com/v17.0/{phone_number_id}/messages"
+    url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
 
     payload = {
         "messaging_product": "whatsapp",
@@ -58,7 +92,7 @@ def send_whatsapp_message(text: str, to_number: str) -> bool:
     }
 
     try:
-        r = requests.post(url, json=payload, headers=headers)
+        r = _session.post(url, json=payload, headers=headers, timeout=WHATSAPP_TIMEOUT)
         logging.info(f"Respuesta WhatsApp status={r.status_code}, body={r.text}")
         if r.status_code in [200, 201]:
             # intenta extraer id de mensaje
@@ -108,7 +142,7 @@ def send_whatsapp_image(image_url: str, caption: str, to_number: str, is_base64:
             img_content = base64.b64decode(image_url)
         else:
             logging.info(f"📥 Descargando snapshot desde: {image_url}")
-            img_response = requests.get(image_url, timeout=10)
+            img_response = _session.get(image_url, timeout=WHATSAPP_TIMEOUT)
 
             if img_response.status_code != 200:
                 logging.error(f"❌ Error descargando snapshot: {img_response.status_code}")
@@ -117,7 +151,7 @@ def send_whatsapp_image(image_url: str, caption: str, to_number: str, is_base64:
             img_content = img_response.content
 
         # Paso 2: Subir la imagen a WhatsApp
-        upload_url = f"https://graph.facebook.com/v17.0/{phone_number_id}/media"
+        upload_url = f"{GRAPH_API_BASE}/{phone_number_id}/media"
 
         files = {
             'file': ('snapshot.jpg', img_content, 'image/jpeg'),
@@ -132,7 +166,7 @@ def send_whatsapp_image(image_url: str, caption: str, to_number: str, is_base64:
             "type": "image/jpeg"
         }
         
-        upload_resp = requests.post(upload_url, headers=upload_headers, data=upload_data, files=files)
+        upload_resp = _session.post(upload_url, headers=upload_headers, data=upload_data, files=files, timeout=WHATSAPP_TIMEOUT)
         logging.info(f"Upload response: {upload_resp.status_code}, {upload_resp.text}")
         
         if upload_resp.status_code not in [200, 201]:
@@ -146,7 +180,7 @@ def send_whatsapp_image(image_url: str, caption: str, to_number: str, is_base64:
             return send_whatsapp_message(caption, to_number)  # Fallback
         
         # Paso 3: Enviar mensaje con la imagen
-        send_url = f"https://graph.facebook.com/v17.0/{phone_number_id}/messages"
+        send_url = f"{GRAPH_API_BASE}/{phone_number_id}/messages"
         
         payload = {
             "messaging_product": "whatsapp",
@@ -163,7 +197,7 @@ def send_whatsapp_image(image_url: str, caption: str, to_number: str, is_base64:
             "Content-Type": "application/json"
         }
         
-        r = requests.post(send_url, json=payload, headers=send_headers)
+        r = _session.post(send_url, json=payload, headers=send_headers, timeout=WHATSAPP_TIMEOUT)
         logging.info(f"Respuesta WhatsApp (imagen) status={r.status_code}, body={r.text}")
         
         if r.status_code in [200, 201]:
@@ -176,3 +210,84 @@ def send_whatsapp_image(image_url: str, caption: str, to_number: str, is_base64:
     except Exception as e:
         logging.error(f"❌ Excepción enviando WhatsApp con imagen: {e}")
         return send_whatsapp_message(caption, to_number)  # Fallback a texto
+
+
+# ================== API ASÍNCRONA (usada por NotificationSender) ==================
+
+async def _post_message(client: httpx.AsyncClient, payload: dict) -> SendResult:
+    token, phone_number_id = _credentials()
+    if not token or not phone_number_id:
+        return SendResult(ok=False, error="Falta WHATSAPP_TOKEN o WHATSAPP_PHONE_NUMBER_ID")
+
+    try:
+        r = await client.post(
+            f"{GRAPH_API_BASE}/{phone_number_id}/messages",
+            json=payload,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    except httpx.HTTPError as e:
+        return SendResult(ok=False, error=f"{type(e).__name__}: {e}", retryable=True)
+
+    if r.status_code in (200, 201):
+        try:
+            msg_id = r.json().get("messages", [{}])[0].get("id")
+        except Exception:
+            msg_id = None
+        return SendResult(ok=True, status_code=r.status_code, message_id=msg_id)
+
+    return SendResult(
+        ok=False,
+        status_code=r.status_code,
+        error=r.text[:500],
+        retryable=_is_retryable_status(r.status_code),
+    )
+
+
+async def async_send_text(client: httpx.AsyncClient, text: str, to_number: str) -> SendResult:
+    """Envía un mensaje de texto usando un cliente HTTP compartido (keep-alive)."""
+    return await _post_message(client, {
+        "messaging_product": "whatsapp",
+        "to": to_number,
+        "type": "text",
+        "text": {"body": text},
+    })
+
+
+async def async_upload_media(client: httpx.AsyncClient, image_bytes: bytes) -> Tuple[Optional[str], SendResult]:
+    """Sube un JPEG al Graph API. Retorna (media_id, resultado)."""
+    token, phone_number_id = _credentials()
+    if not token or not phone_number_id:
+        return None, SendResult(ok=False, error="Falta WHATSAPP_TOKEN o WHATSAPP_PHONE_NUMBER_ID")
+
+    try:
+        r = await client.post(
+            f"{GRAPH_API_BASE}/{phone_number_id}/media",
+            headers={"Authorization": f"Bearer {token}"},
+            data={"messaging_product": "whatsapp", "type": "image/jpeg"},
+            files={"file": ("snapshot.jpg", image_bytes, "image/jpeg")},
+        )
+    except httpx.HTTPError as e:
+        return None, SendResult(ok=False, error=f"{type(e).__name__}: {e}", retryable=True)
+
+    if r.status_code not in (200, 201):
+        return None, SendResult(
+            ok=False,
+            status_code=r.status_code,
+            error=r.text[:500],
+            retryable=_is_retryable_status(r.status_code),
+        )
+
+    media_id = r.json().get("id")
+    if not media_id:
+        return None, SendResult(ok=False, status_code=r.status_code, error="No se obtuvo media_id")
+    return media_id, SendResult(ok=True, status_code=r.status_code)
+
+
+async def async_send_image(client: httpx.AsyncClient, media_id: str, caption: str, to_number: str) -> SendResult:
+    """Envía una imagen ya subida (media_id) con su texto."""
+    return await _post_message(client, {
+        "messaging_product": "whatsapp",
+        "to": to_number,
+        "type": "image",
+        "image": {"id": media_id, "caption": caption},
+    })
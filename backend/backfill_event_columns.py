@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Llena las columnas extraídas de events (camera, label, frigate_event_id,
+top_score, start/end_time, duration_seconds) para los eventos guardados antes
+de la migración a7b8c9d0e1f2. La migración ya las llena; este script completa
+lo que falte si se cortó a mitad del backfill, y recalcula la grilla de cámaras.
+
+Procesa por lotes (keyset por id) y hace commit por lote, así que se puede
+ejecutar con el backend en marcha y reanudar si se interrumpe. Mientras tanto
+los eventos viejos sin columnas no aparecen en los listados filtrados por cámara.
+
+Ejecutar:
+    python backfill_event_columns.py [--batch-size 1000] [--limit N] [--pause 0.05]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Agregar el directorio actual al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import update
+
+from app.db.session import SessionLocal
+from app.models.all_models import EventDB
+from app.services.event_fields import extract_event_fields
+from app.services import camera_state
+
+
+def backfill(batch_size: int, limit: int = None, pause: float = 0.0):
+    db = SessionLocal()
+    last_id = 0
+    updated = 0
+    started = time.time()
+
+    try:
+        while True:
+            rows = (
+                db.query(EventDB.id, EventDB.payload)
+                .filter(EventDB.id > last_id, EventDB.camera.is_(None))  # Al reanudar, salta los ya hechos
+                .order_by(EventDB.id.asc())
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+
+            last_id = rows[-1].id
+            changes = []
+            for row in rows:
+                fields = extract_event_fields(row.payload)
+                if fields["camera"] is None and fields["label"] is None and fields["frigate_event_id"] is None:
+                    continue  # Payload vacío o corrupto: nada que extraer
+                changes.append({"id": row.id, **fields})
+
+            if changes:
+                # UPDATE por clave primaria en bloque (executemany)
+                db.execute(update(EventDB), changes)
+            db.commit()
+            updated += len(changes)
+            print(f"📦 {updated} eventos actualizados (último id: {last_id})")
+
+            if limit and updated >= limit:
+                break
+            if pause:
+                time.sleep(pause)  # Dejar respirar a la BD en producción
+
+        # La grilla de cámaras (camera_latest_state) depende de estas columnas
+        if updated:
+            states = camera_state.rebuild(db)
+            print(f"📷 Estado por cámara recalculado ({states} cámaras)")
+    finally:
+        db.close()
+
+    elapsed = time.time() - started
+    print(f"✅ Listo: {updated} eventos con columnas extraídas en {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Llena las columnas extraídas de la tabla events")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de eventos a actualizar en esta ejecución")
+    parser.add_argument("--pause", type=float, default=0.0, help="Segundos de pausa entre lotes")
+    args = parser.parse_args()
+
+    print("🚚 Extrayendo columnas de events.payload ...")
+    backfill(args.batch_size, args.limit, args.pause)
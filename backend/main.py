@@ -1,10 +1,23 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 import logging
+import os
+import re
+from typing import Optional
 
 from app.api.api import api_router
 from app.core.config import settings
+from app.core.metrics import render_latest, CONTENT_TYPE_LATEST
+from app.core import tracing
+from app.db.query_counter import QueryCountMiddleware
+from app.db.session import SessionLocal, async_engine
+from app.services.dedup_state import dedup_state
+from app.services.evaluation_pool import evaluation_pool
+from app.services.notification_sender import notification_sender, NOTIFY_SENDER_ENABLED
+from app.services.retention import retention_job
+from app.services.live_stream import live_stream
 
 # Configurar Logging
 logging.basicConfig(
@@ -15,6 +28,11 @@ logging.basicConfig(
 # --- LOG FILTERING ---
 class EndpointFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
+        # El stream SSE recibe el JWT por query (?token=): no dejarlo en los logs
+        if isinstance(record.args, tuple) and len(record.args) >= 3 and "token=" in str(record.args[2]):
+            args = list(record.args)
+            args[2] = re.sub(r"token=[^&\s]+", "token=***", str(args[2]))
+            record.args = tuple(args)
         return record.getMessage().find("/api/cameras/ingest-mapping") == -1
 
 # Filter out noise from uvicorn access logs
@@ -26,6 +44,9 @@ app = FastAPI(title=settings.PROJECT_NAME)
 # Configurar ProxyHeadersMiddleware para Railway (HTTPS)
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=["*"])
 
+# Queries por request: warning si se pasa del presupuesto o hay N+1 (ver app/db/query_counter.py)
+app.add_middleware(QueryCountMiddleware)
+
 # Health check endpoints
 @app.get("/")
 async def root():
@@ -35,6 +56,77 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@app.get("/health/evaluation")
+async def evaluation_health():
+    """Métricas del pool de evaluación de reglas (cola, latencias, rechazos)"""
+    return evaluation_pool.stats()
+
+# Si está definido, /metrics exige "Authorization: Bearer <METRICS_TOKEN>" (bearer_token en Prometheus)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@app.get("/metrics", include_in_schema=False)
+def metrics(authorization: Optional[str] = Header(None)):
+    """Métricas de este worker en formato Prometheus (pool de BD, queries lentas, ...)"""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.on_event("startup")
+def start_evaluation_pool():
+    evaluation_pool.start()
+
+@app.on_event("shutdown")
+def stop_evaluation_pool():
+    # Espera a que terminen las evaluaciones en curso (deploys en Railway)
+    evaluation_pool.shutdown(wait=True)
+
+@app.on_event("startup")
+def warm_up_dedup_state():
+    # El anti-spam vive en memoria: lo reconstruimos con los hits recientes
+    db = SessionLocal()
+    try:
+        dedup_state.warm_up(db)
+    except Exception as e:
+        logging.error(f"❌ No se pudo reconstruir el estado de dedup: {e}")
+    finally:
+        db.close()
+
+@app.on_event("startup")
+async def start_notification_sender():
+    if NOTIFY_SENDER_ENABLED:
+        await notification_sender.start()
+
+@app.on_event("shutdown")
+async def stop_notification_sender():
+    await notification_sender.stop()
+
+@app.on_event("startup")
+async def start_retention_job():
+    # Particiones futuras (siempre: sin ellas la ingesta falla) + borrado de eventos/snapshots vencidos
+    await retention_job.start()
+
+@app.on_event("shutdown")
+async def stop_retention_job():
+    await retention_job.stop()
+
+@app.on_event("startup")
+async def start_live_stream():
+    # Con Redis: escucha los eventos en vivo que ingestan los otros workers
+    await live_stream.start()
+
+@app.on_event("shutdown")
+async def stop_live_stream():
+    await live_stream.stop()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+
+@app.on_event("shutdown")
+def flush_traces():
+    # Los spans que quedaron en la cola del exportador (último envío de WhatsApp, etc.)
+    tracing.flush()
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
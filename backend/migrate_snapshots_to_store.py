@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Mueve los snapshots legacy (events.snapshot_base64) al snapshot store.
+
+Procesa por lotes (keyset por id) y hace commit por lote, así que se puede
+ejecutar con el backend en marcha y reanudar si se interrumpe.
+
+Ejecutar:
+    python migrate_snapshots_to_store.py [--batch-size 200] [--limit N]
+
+Después, en PostgreSQL, conviene un VACUUM (o VACUUM FULL en una ventana de
+mantenimiento) de la tabla events para devolver el espacio de TOAST.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Agregar el directorio actual al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.session import SessionLocal
+from app.models.all_models import EventDB
+from app.services.snapshot_store import snapshot_store
+
+
+def migrate(batch_size: int, limit: int = None):
+    db = SessionLocal()
+    last_id = 0
+    moved = 0
+    failed = 0
+    bytes_before = 0
+    bytes_after = 0
+    started = time.time()
+
+    try:
+        while True:
+            rows = (
+                db.query(EventDB)
+                .filter(
+                    EventDB.id > last_id,
+                    EventDB.snapshot_base64.isnot(None),
+                )
+                .order_by(EventDB.id.asc())
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+
+            for row in rows:
+                last_id = row.id
+                try:
+                    digest, size = snapshot_store.put_base64(row.snapshot_base64)
+                except Exception as e:
+                    # Base64 corrupto: lo dejamos como está para revisarlo a mano
+                    print(f"⚠️ Evento {row.id}: snapshot inválido ({e})")
+                    failed += 1
+                    continue
+
+                bytes_before += len(row.snapshot_base64)
+                bytes_after += size
+                row.snapshot_hash = digest
+                row.snapshot_size = size
+                row.snapshot_base64 = None
+                moved += 1
+
+            db.commit()
+            db.expunge_all()  # No acumular filas en memoria entre lotes
+            print(f"📦 Migrados {moved} snapshots (último id: {last_id})")
+
+            if limit and moved >= limit:
+                break
+    finally:
+        db.close()
+
+    elapsed = time.time() - started
+    print(f"✅ Listo: {moved} snapshots movidos, {failed} con error, en {elapsed:.1f}s")
+    if moved:
+        print(f"   base64 en BD: {bytes_before / 1_048_576:.1f} MB → JPEG en disco: {bytes_after / 1_048_576:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mueve snapshots base64 de la tabla events al snapshot store")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de snapshots a migrar en esta ejecución")
+    args = parser.parse_args()
+
+    print(f"🚚 Migrando snapshots a {os.path.abspath(snapshot_store.base_dir)} ...")
+    migrate(args.batch_size, args.limit)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Ejecuta una pasada del job de retención (app/services/retention.py) a mano.
+
+Útil para ver qué se borraría antes de configurar EVENTS_RETENTION_DAYS, o para
+crear las particiones de los próximos meses sin esperar al job del backend.
+
+Ejecutar:
+    python run_retention.py [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+
+# Agregar el directorio actual al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.session import SessionLocal
+from app.services import retention
+
+
+def main(dry_run: bool):
+    db = SessionLocal()
+    try:
+        stats = retention.run_once(db, dry_run=dry_run)
+    finally:
+        db.close()
+
+    if stats["skipped"]:
+        print("⏳ Otro proceso está ejecutando la retención, reintentar más tarde")
+        return
+
+    prefix = "🔎 Se borrarían" if dry_run else "🧹 Borrados"
+    print(f"{prefix}: {stats['events_deleted']} eventos, {stats['hits_deleted']} alertas, "
+          f"{stats['snapshots_deleted']} snapshots")
+    if stats["partitions_dropped"]:
+        print(f"🗑️ Particiones: {', '.join(stats['partitions_dropped'])}")
+    if stats["partitions_created"]:
+        print(f"🗂️ Particiones creadas: {', '.join(stats['partitions_created'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica la retención de eventos y alertas")
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar, sin borrar nada")
+    args = parser.parse_args()
+
+    print(f"📅 Retención por defecto: {retention.EVENTS_RETENTION_DAYS or 'sin límite'} días")
+    main(args.dry_run)
@@ -1,7 +1,6 @@
 import os
 import sys
 import random
-import json
 from datetime import datetime, timedelta
 
 # Add current directory to path
@@ -10,6 +9,7 @@ sys.path.append(os.getcwd())
 from sqlalchemy.orm import Session
 from app.db.session import SessionLocal
 from app.models.all_models import UserDB, RuleDB, EventDB, RuleHitDB, CameraDB
+from app.services.event_fields import extract_event_fields
 from app.core.security import hash_password
 
 def seed_data():
@@ -111,7 +111,8 @@ def seed_data():
 
         event = EventDB(
             received_at=triggered_at,
-            payload=json.dumps(simple_payload),
+            payload=simple_payload,
+            **extract_event_fields(simple_payload),
             snapshot_base64=None # No real image for dummy
         )
         db.add(event)
@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+# Antes de importar la app: app.db.session lee DATABASE_URL al importarse
+_DB_DIR = tempfile.mkdtemp(prefix="frigate-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("SNAPSHOT_STORE_DIR", os.path.join(_DB_DIR, "snapshots"))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.endpoints.auth import get_current_user
+from app.db.base import Base
+from app.db.session import engine, SessionLocal
+from app.models.all_models import UserDB
+import app.models.all_models  # noqa: F401  (registra las tablas en Base.metadata)
+
+
+@pytest.fixture()
+def db():
+    """Esquema nuevo (create_all) por test, sobre SQLite."""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = SessionLocal(expire_on_commit=False)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture()
+def user(db):
+    user = UserDB(username="tester", email="tester@example.com", timezone="UTC")
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture()
+def client(user):
+    """
+    Cliente autenticado como `user` (sin JWT: se reemplaza get_current_user).
+    Sin `with`: no corren los startup events (pool de evaluación, retención...),
+    así que no hay otros threads ejecutando queries mientras se cuentan.
+    """
+    from main import app
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
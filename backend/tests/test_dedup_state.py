@@ -0,0 +1,136 @@
+"""
+Anti-spam por regla (DedupState): chequeo y registro, undo() cuando el hit no
+se pudo guardar, warm_up y el rollback en evaluate_rules.
+"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.all_models import EventDB, RuleDB, RuleHitDB
+from app.services import rule_engine
+from app.services.dedup_state import DedupEntry, DedupState, InMemoryDedupBackend, Suppression
+from app.services.rule_index import rule_index
+
+BOX = [0.10, 0.10, 0.30, 0.30]
+NEAR_BOX = [0.11, 0.11, 0.31, 0.31]
+FAR_BOX = [0.60, 0.60, 0.80, 0.80]
+
+
+def _rule(rule_id=1, window=60.0, tolerance=None):
+    return SimpleNamespace(id=rule_id, dedup_window_seconds=window, dedup_tolerance=tolerance)
+
+
+@pytest.fixture()
+def state():
+    return DedupState(InMemoryDedupBackend())
+
+
+def test_check_and_record_suppresses_by_distance_and_time(state):
+    rule = _rule()
+
+    assert state.check_and_record(rule, BOX, now=1000.0)[0] is None
+
+    reason, _ = state.check_and_record(rule, NEAR_BOX, now=1010.0)
+    assert isinstance(reason, Suppression) and reason.code == "distance"
+
+    # Lejos del último disparo: otro objeto, alerta (y pasa a ser el último)
+    assert state.check_and_record(rule, FAR_BOX, now=1020.0)[0] is None
+
+    # Sin caja solo cuenta el tiempo
+    reason, _ = state.check_and_record(rule, None, now=1030.0)
+    assert reason.code == "time"
+
+
+def test_check_and_record_window(state):
+    rule = _rule(window=30.0)
+    assert state.check_and_record(rule, BOX, now=1000.0)[0] is None
+    assert state.check_and_record(rule, BOX, now=1031.0)[0] is None  # Pasó la ventana
+
+    disabled = _rule(rule_id=2, window=0)
+    assert state.check_and_record(disabled, BOX, now=1000.0)[0] is None
+    assert state.check_and_record(disabled, BOX, now=1001.0)[0] is None
+
+
+def test_check_and_record_pixel_boxes_scale_tolerance(state):
+    rule = _rule()
+    assert state.check_and_record(rule, [100, 100, 300, 300], now=1000.0)[0] is None
+    # 30px de distancia < 50px (5% * 1000)
+    assert state.check_and_record(rule, [130, 100, 330, 300], now=1001.0)[0].code == "distance"
+    assert state.check_and_record(rule, [300, 300, 500, 500], now=1002.0)[0] is None
+
+
+def test_undo_restores_previous_hit(state):
+    rule = _rule()
+    assert state.check_and_record(rule, BOX)[0] is None
+    previous = state.backend.get(rule.id)
+
+    reason, undo = state.check_and_record(rule, FAR_BOX)
+    assert reason is None
+    undo()  # El commit falló: el último disparo válido sigue siendo el anterior
+
+    assert state.backend.get(rule.id) == previous
+    assert state.check_and_record(rule, NEAR_BOX)[0].code == "distance"
+
+
+def test_undo_without_previous_forgets_rule(state):
+    rule = _rule()
+    reason, undo = state.check_and_record(rule, BOX)
+    assert reason is None
+    undo()
+    assert state.backend.get(rule.id) is None
+    assert state.check_and_record(rule, BOX)[0] is None
+
+
+def test_undo_does_not_overwrite_newer_hit(state):
+    rule = _rule()
+    _, undo = state.check_and_record(rule, BOX, now=1000.0)
+    state.backend.set(rule.id, DedupEntry(1005.0, (0.7, 0.7)), 60)  # Otro worker alertó después
+    undo()
+    assert state.backend.get(rule.id).triggered_at == 1005.0
+
+
+def test_warm_up_restores_recent_hits_once(db, user, state):
+    rule = RuleDB(name="Puerta", camera="cam1", label="person", user_id=user.id, dedup_window_seconds=600)
+    db.add(rule)
+    db.flush()
+    event = EventDB(received_at=datetime.utcnow(), payload={"camera": "cam1", "box": BOX}, user_id=user.id)
+    db.add(event)
+    db.flush()
+    db.add(RuleHitDB(rule_id=rule.id, event_id=event.id, triggered_at=datetime.utcnow() - timedelta(seconds=10)))
+    db.commit()
+
+    assert state.warm_up(db) == 1
+    assert state.backend.get(rule.id).centroid == pytest.approx((0.2, 0.2))
+    assert state.warm_up(db) == 0  # Ya registrado: no se pisa
+
+
+def test_evaluate_rules_undoes_dedup_when_commit_fails(db, user, monkeypatch):
+    user.whatsapp_number = "5491100000000"
+    user.whatsapp_notifications_enabled = True
+    rule = RuleDB(name="Puerta", camera="cam1", label="person", user_id=user.id)
+    db.add(rule)
+    db.commit()
+
+    state = DedupState(InMemoryDedupBackend())
+    monkeypatch.setattr(rule_engine, "dedup_state", state)
+    monkeypatch.setattr(rule_engine, "DEDUP_MODE", "centroid")
+    rule_index.clear()
+
+    calls = []
+
+    def broken_enqueue(*args, **kwargs):
+        calls.append(kwargs["rule_id"])
+        raise RuntimeError("BD caída")
+
+    monkeypatch.setattr(rule_engine, "enqueue_notification", broken_enqueue)
+    body = {
+        "customer_id": user.username, "camera": "cam1", "label": "person",
+        "frigate_type": "end", "top_score": 0.9, "box": BOX,
+    }
+    rule_engine.evaluate_rules(body, event_db_id=1)
+
+    assert calls == [rule.id]  # Pasó el anti-spam y falló al guardar
+    assert state.backend.get(rule.id) is None
+    assert db.query(RuleHitDB).count() == 0
@@ -0,0 +1,116 @@
+"""
+Stream en vivo: cola acotada por conexión (offer), puesta al día desde el
+buffer en vivo (catch_up) después de desbordar, y PUBLISH a Redis fuera del
+event loop.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.live_buffer import InMemoryLiveBuffer
+from app.services import live_stream as live_stream_module
+from app.services.live_stream import LiveStreamHub, Subscriber
+
+
+@pytest.fixture()
+def buffer(monkeypatch):
+    buffer = InMemoryLiveBuffer(per_camera=10)
+    monkeypatch.setattr(live_stream_module, "live_buffer", buffer)
+    return buffer
+
+
+def test_offer_filters_cameras():
+    async def scenario():
+        sub = Subscriber("cliente", {"cam1"}, queue_size=5)
+        sub.offer("cam2", {"seq": 1})
+        sub.offer("cam1", {"seq": 2})
+        return sub.queue.qsize(), sub.queue.get_nowait()
+
+    assert asyncio.run(scenario()) == (1, {"seq": 2})
+
+
+def test_offer_overflow_drops_queue_and_wakes_reader():
+    async def scenario():
+        sub = Subscriber("cliente", {"cam1"}, queue_size=2)
+        for seq in range(1, 4):
+            sub.offer("cam1", {"seq": seq})
+        items = []
+        while not sub.queue.empty():
+            items.append(sub.queue.get_nowait())
+        return sub, items
+
+    sub, items = asyncio.run(scenario())
+    assert sub.overflowed
+    assert sub.dropped == 1
+    assert items == [None]  # Solo la señal: lo demás sale del buffer
+
+
+def test_catch_up_reads_only_own_cameras_after_seq(buffer):
+    hub = LiveStreamHub()
+    for camera in ("cam1", "cam2", "cam1", "cam3"):
+        buffer.append(("cliente", camera), {"camera": camera})
+    buffer.append(("otro", "cam1"), {"camera": "cam1"})
+
+    async def scenario():
+        return hub.subscribe("cliente", {"cam1", "cam2"})
+
+    sub = asyncio.run(scenario())
+    assert [item["seq"] for item in hub.catch_up(sub, since_seq=0)] == [1, 2, 3]
+    assert [item["seq"] for item in hub.catch_up(sub, since_seq=2)] == [3]
+    assert [item["seq"] for item in hub.catch_up(sub, since_seq=0, limit=2)] == [2, 3]
+
+
+def test_fanout_only_reaches_owner(buffer):
+    hub = LiveStreamHub()
+
+    async def scenario():
+        mine = hub.subscribe("cliente", {"cam1"})
+        other = hub.subscribe("otro", {"cam1"})
+        hub.publish(("cliente", "cam1"), {"seq": 1})
+        hub.unsubscribe(other)
+        return mine.queue.qsize(), other.queue.qsize(), hub.connections
+
+    assert asyncio.run(scenario()) == (1, 0, 1)
+
+
+class _SlowRedis:
+    """Redis falso: PUBLISH bloquea hasta que el test lo libera."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.published = []
+
+    def publish(self, channel, data):
+        self.release.wait(5)
+        self.published.append(json.loads(data))
+
+    def pubsub(self, **kwargs):
+        return SimpleNamespace(subscribe=lambda channel: None, close=lambda: None,
+                               get_message=lambda timeout: time.sleep(timeout))
+
+
+def test_publish_with_redis_does_not_block_event_loop():
+    hub = LiveStreamHub()
+    redis = hub._redis = _SlowRedis()
+
+    async def scenario():
+        hub._loop = asyncio.get_running_loop()
+        hub._start_threads()
+        started = time.perf_counter()
+        hub.publish(("cliente", "cam1"), {"seq": 1})
+        elapsed = time.perf_counter() - started
+        redis.release.set()
+        for _ in range(100):
+            if redis.published:
+                break
+            await asyncio.sleep(0.01)
+        await hub.stop()
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.5
+    assert redis.published == [["cliente", "cam1", {"seq": 1}]]
@@ -0,0 +1,128 @@
+"""
+NotificationSender contra un Graph API falso (httpx.MockTransport): reintentos,
+clasificación 429/5xx vs 4xx, estado final 'failed' y un destinatario lento
+que no frena a los demás.
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from app.models.all_models import NotificationOutboxDB
+from app.services import notification_sender as sender_module
+from app.services.notification_sender import NotificationSender, enqueue_notification
+
+
+@pytest.fixture(autouse=True)
+def graph_credentials(monkeypatch):
+    monkeypatch.setenv("WHATSAPP_TOKEN", "test-token")
+    monkeypatch.setenv("WHATSAPP_PHONE_NUMBER_ID", "123")
+    # Reintentos inmediatos (el backoff real es de segundos)
+    monkeypatch.setattr(sender_module, "_retry_delay", lambda attempts: 0.0)
+
+
+class FakeGraph:
+    """Responde según una lista de status por número destino (el último se repite)."""
+
+    def __init__(self, statuses, delay=0.0):
+        self.statuses = statuses
+        self.delay = delay
+        self.calls = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        to = json.loads(request.content)["to"]
+        self.calls.append(to)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        plan = self.statuses[to]
+        status = plan.pop(0) if len(plan) > 1 else plan[0]
+        if status == 200:
+            return httpx.Response(200, json={"messages": [{"id": f"wamid.{len(self.calls)}"}]})
+        return httpx.Response(status, text=f"error {status}")
+
+
+def _enqueue(db, *numbers):
+    for number in numbers:
+        enqueue_notification(db, number, f"Alerta para {number}")
+    db.commit()
+
+
+def _rows(db):
+    db.expire_all()
+    return {row.id: row for row in db.query(NotificationOutboxDB).order_by(NotificationOutboxDB.id)}
+
+
+def _run(sender, db, done, timeout=5.0):
+    async def main():
+        await sender.start()
+        deadline = time.monotonic() + timeout
+        while not done(_rows(db).values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        await sender.stop()
+
+    asyncio.run(main())
+    return _rows(db)
+
+
+def _settled(rows):
+    return all(row.status in ("sent", "failed") for row in rows)
+
+
+def _sender(graph, **kwargs):
+    kwargs.setdefault("recipient_interval", 0)
+    kwargs.setdefault("poll_interval", 0.02)
+    return NotificationSender(transport=httpx.MockTransport(graph.handler), **kwargs)
+
+
+def test_429_and_5xx_are_retried_until_sent(db):
+    graph = FakeGraph({"+571": [429, 200], "+572": [503, 500, 200]})
+    _enqueue(db, "+571", "+572")
+
+    rows = _run(_sender(graph), db, _settled)
+
+    assert [(r.status, r.attempts) for r in rows.values()] == [("sent", 2), ("sent", 3)]
+    assert all(r.provider_message_id for r in rows.values())
+
+
+def test_non_retryable_4xx_fails_without_retrying(db):
+    graph = FakeGraph({"+571": [400]})
+    _enqueue(db, "+571")
+
+    rows = _run(_sender(graph), db, _settled)
+
+    row = next(iter(rows.values()))
+    assert (row.status, row.attempts) == ("failed", 1)
+    assert row.last_error.startswith("400")
+    assert graph.calls == ["+571"]
+
+
+def test_retryable_error_ends_failed_after_max_attempts(db):
+    graph = FakeGraph({"+571": [503]})
+    _enqueue(db, "+571")
+
+    rows = _run(_sender(graph, max_attempts=3), db, _settled)
+
+    row = next(iter(rows.values()))
+    assert (row.status, row.attempts) == ("failed", 3)
+    assert len(graph.calls) == 3
+
+
+def test_slow_recipient_does_not_hold_back_others(db):
+    graph = FakeGraph({"+57noisy": [200], "+57quiet": [200]}, delay=0.1)
+    _enqueue(db, *(["+57noisy"] * 8), "+57quiet")
+
+    rows = _run(_sender(graph, concurrency=4), db, _settled)
+
+    assert all(r.status == "sent" for r in rows.values())
+    # Una entrega en vuelo por número: el otro destinatario sale en la primera tanda
+    # y su resultado se guarda enseguida, no al terminar las 8 alertas del ruidoso
+    assert graph.calls.index("+57quiet") <= 1
+    quiet = next(r for r in rows.values() if r.to_number == "+57quiet")
+    noisy = [r for r in rows.values() if r.to_number == "+57noisy"]
+    assert quiet.sent_at < max(r.sent_at for r in noisy)
+    # Cada fila del ruidoso se reclama recién cuando terminó la anterior (no espera con el lease corriendo)
+    claims = sorted(r.claimed_at for r in noisy)
+    assert all(later > earlier for earlier, later in zip(claims, claims[1:]))
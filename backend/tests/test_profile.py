@@ -0,0 +1,17 @@
+"""Validación del perfil (PUT /api/auth/me): el mensaje y el chequeo de retention_days coinciden."""
+
+import pytest
+from pydantic import ValidationError
+
+from app.api.endpoints.auth import UpdateProfileRequest
+
+
+@pytest.mark.parametrize("days", [0, 1, 3650])
+def test_retention_days_accepted(days):
+    assert UpdateProfileRequest(retention_days=days).retention_days == days
+
+
+@pytest.mark.parametrize("days", [-1, 3651])
+def test_retention_days_rejected(days):
+    with pytest.raises(ValidationError, match="entre 0 y 3650"):
+        UpdateProfileRequest(retention_days=days)
@@ -0,0 +1,90 @@
+"""
+Presupuesto de queries de los listados del panel (detector de N+1).
+
+Las cantidades no dependen de cuántas cámaras / alertas haya: si un cambio
+agrega una query por fila (lazy load, consulta por cámara...) estos tests fallan.
+"""
+
+from datetime import datetime, timedelta
+
+from app.db.query_counter import assert_max_queries
+from app.models.all_models import CameraDB, CameraLatestStateDB, EventDB, RuleDB, RuleHitDB
+
+N_CAMERAS = 8
+N_HITS = 30
+
+
+def _seed_cameras(db, user, legacy_snapshots=False):
+    now = datetime.utcnow()
+    for i in range(N_CAMERAS):
+        name = f"cam{i}"
+        db.add(CameraDB(name=name, user_id=user.id))
+        event = EventDB(
+            received_at=now, payload={"camera": name, "type": "end"}, camera=name, label="person",
+            user_id=user.id,
+            snapshot_hash=None if legacy_snapshots else f"{i:064x}",
+            snapshot_base64="aGVsbG8=" if legacy_snapshots else None,
+        )
+        db.add(event)
+        db.flush()
+        db.add(CameraLatestStateDB(
+            user_id=user.id, camera=name,
+            last_event_id=event.id, last_event_at=now, last_label="person",
+            snapshot_event_id=event.id, snapshot_hash=event.snapshot_hash, snapshot_at=now,
+        ))
+    db.commit()
+
+
+def _seed_hits(db, user):
+    now = datetime.utcnow()
+    rules = [RuleDB(name=f"Regla {i}", camera=f"cam{i}", label="person", user_id=user.id) for i in range(3)]
+    db.add_all(rules)
+    db.flush()
+    for i in range(N_HITS):
+        rule = rules[i % len(rules)]
+        event = EventDB(
+            received_at=now, payload={"camera": rule.camera}, camera=rule.camera, label="person",
+            top_score=0.9, frigate_type="end", user_id=user.id, snapshot_hash=f"{i:064x}",
+        )
+        db.add(event)
+        db.flush()
+        db.add(RuleHitDB(rule_id=rule.id, event_id=event.id, triggered_at=now - timedelta(seconds=i)))
+    db.commit()
+
+
+def test_list_cameras_query_count(client, db, user):
+    _seed_cameras(db, user)
+
+    with assert_max_queries(2, "GET /api/cameras/"):
+        response = client.get("/api/cameras/")
+
+    assert response.status_code == 200
+    assert len(response.json()["cameras"]) == N_CAMERAS
+
+
+def test_list_cameras_query_count_with_legacy_snapshots(client, db, user):
+    _seed_cameras(db, user, legacy_snapshots=True)
+
+    # Una query más para TODOS los snapshots base64 juntos, no una por cámara
+    with assert_max_queries(3, "GET /api/cameras/ (legacy)"):
+        response = client.get("/api/cameras/")
+
+    assert response.status_code == 200
+    assert all(camera["last_snapshot"] for camera in response.json()["cameras"])
+
+
+def test_list_rule_hits_query_count(client, db, user):
+    _seed_hits(db, user)
+
+    with assert_max_queries(2, "GET /api/rules/hits"):
+        response = client.get("/api/rules/hits", params={"page_size": 20})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["hits"]) == 20
+    assert body["total"] == N_HITS
+
+    # Páginas siguientes: sin COUNT (default con cursor), solo la página
+    with assert_max_queries(1, "GET /api/rules/hits (cursor)"):
+        response = client.get("/api/rules/hits", params={"cursor": body["next_cursor"]})
+    assert response.status_code == 200
+    assert len(response.json()["hits"]) == N_HITS - 20
@@ -0,0 +1,78 @@
+"""
+Historial de alertas: las páginas por cursor (keyset sobre (triggered_at, id))
+devuelven lo mismo que las de OFFSET, también con varias alertas en el mismo
+triggered_at, y el total solo se cuenta sin cursor.
+"""
+
+from datetime import datetime, timedelta
+
+from app.models.all_models import RuleDB, RuleHitDB
+
+N_HITS = 25
+PAGE_SIZE = 7
+
+
+def _seed(db, user):
+    rule = RuleDB(name="Puerta", camera="cam1", label="person", user_id=user.id)
+    db.add(rule)
+    db.flush()
+    base = datetime(2026, 1, 1, 12, 0, 0)
+    # De a 3 alertas con el mismo triggered_at: el orden lo desempata el id
+    db.add_all([
+        RuleHitDB(rule_id=rule.id, event_id=None, triggered_at=base + timedelta(seconds=i // 3))
+        for i in range(N_HITS)
+    ])
+    db.commit()
+    hits = db.query(RuleHitDB.id, RuleHitDB.triggered_at).all()
+    return [h.id for h in sorted(hits, key=lambda h: (h.triggered_at, h.id), reverse=True)]
+
+
+def _ids(response):
+    assert response.status_code == 200
+    return [hit["id"] for hit in response.json()["hits"]]
+
+
+def test_cursor_pages_match_offset_pages(client, db, user):
+    expected = _seed(db, user)
+
+    offset_pages = [
+        _ids(client.get("/api/rules/hits", params={"page": page, "page_size": PAGE_SIZE}))
+        for page in range(1, (N_HITS + PAGE_SIZE - 1) // PAGE_SIZE + 1)
+    ]
+
+    cursor_pages = []
+    body = client.get("/api/rules/hits", params={"page_size": PAGE_SIZE}).json()
+    cursor_pages.append([hit["id"] for hit in body["hits"]])
+    while body["next_cursor"]:
+        body = client.get(
+            "/api/rules/hits", params={"cursor": body["next_cursor"], "page_size": PAGE_SIZE}
+        ).json()
+        cursor_pages.append([hit["id"] for hit in body["hits"]])
+
+    assert cursor_pages == offset_pages
+    assert [hit_id for page in cursor_pages for hit_id in page] == expected
+
+
+def test_prev_cursor_returns_previous_page(client, db, user):
+    _seed(db, user)
+
+    first = client.get("/api/rules/hits", params={"page_size": PAGE_SIZE}).json()
+    assert first["prev_cursor"] is None
+    second = client.get("/api/rules/hits", params={"cursor": first["next_cursor"], "page_size": PAGE_SIZE}).json()
+    third = client.get("/api/rules/hits", params={"cursor": second["next_cursor"], "page_size": PAGE_SIZE}).json()
+
+    back = client.get("/api/rules/hits", params={"cursor": third["prev_cursor"], "page_size": PAGE_SIZE}).json()
+    assert [h["id"] for h in back["hits"]] == [h["id"] for h in second["hits"]]
+    back = client.get("/api/rules/hits", params={"cursor": back["prev_cursor"], "page_size": PAGE_SIZE}).json()
+    assert [h["id"] for h in back["hits"]] == [h["id"] for h in first["hits"]]
+
+
+def test_total_only_without_cursor(client, db, user):
+    _seed(db, user)
+
+    first = client.get("/api/rules/hits", params={"page_size": PAGE_SIZE}).json()
+    assert first["total"] == N_HITS
+
+    params = {"cursor": first["next_cursor"], "page_size": PAGE_SIZE}
+    assert "total" not in client.get("/api/rules/hits", params=params).json()
+    assert client.get("/api/rules/hits", params={**params, "include_total": "true"}).json()["total"] == N_HITS
@@ -0,0 +1,47 @@
+"""URLs firmadas de snapshots: sin firma válida, vencidas o de otro usuario no sirven."""
+
+import base64
+import time
+from datetime import datetime
+
+from app.models.all_models import EventDB, UserDB
+from app.services.snapshot_store import snapshot_store, snapshot_url
+
+JPEG = b"\xff\xd8\xff\xe0fake-jpeg"
+
+
+def _event_with_snapshot(db, user):
+    digest, size = snapshot_store.put_base64(base64.b64encode(JPEG).decode())
+    db.add(EventDB(received_at=datetime.utcnow(), payload={}, user_id=user.id, snapshot_hash=digest, snapshot_size=size))
+    db.commit()
+    return digest
+
+
+def test_signed_url_serves_owner_snapshot(client, db, user):
+    digest = _event_with_snapshot(db, user)
+
+    response = client.get(snapshot_url(digest, user.id))
+
+    assert response.status_code == 200
+    assert response.content == JPEG
+    assert "immutable" not in response.headers["cache-control"]
+
+
+def test_unsigned_tampered_or_expired_url_is_rejected(client, db, user):
+    digest = _event_with_snapshot(db, user)
+    url = snapshot_url(digest, user.id)
+
+    assert client.get(f"/api/events/snapshots/{digest}").status_code == 403
+    assert client.get(url[:-1] + ("0" if url[-1] != "0" else "1")).status_code == 403
+    expired = snapshot_url(digest, user.id, now=time.time() - 3 * 86400)
+    assert client.get(expired).status_code == 403
+
+
+def test_signed_url_for_another_user_is_not_found(client, db, user):
+    digest = _event_with_snapshot(db, user)
+    other = UserDB(username="other", email="other@example.com")
+    db.add(other)
+    db.commit()
+
+    # Firma válida, pero el snapshot no es de un evento de ese usuario
+    assert client.get(snapshot_url(digest, other.id)).status_code == 404
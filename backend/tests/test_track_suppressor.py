@@ -0,0 +1,93 @@
+"""
+Asociación de eventos a tracks (TrackSuppressor._match vía observe): mismo
+event_id de Frigate, solapamiento de cajas (IoU) y continuidad de path_data.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.track_suppressor import TrackSuppressor, iou
+
+RULE = SimpleNamespace(id=1, dedup_window_seconds=60.0, dedup_tolerance=None)
+
+
+@pytest.fixture()
+def tracks():
+    return TrackSuppressor()
+
+
+def _event(event_id, box=None, label="person", start=1000.0, end=1005.0, **extra):
+    return {"event_id": event_id, "box": box, "label": label, "start_time": start, "end_time": end, **extra}
+
+
+def test_iou():
+    assert iou((0, 0, 1, 1), (0, 0, 1, 1)) == pytest.approx(1.0)
+    assert iou((0, 0, 1, 1), (2, 2, 3, 3)) == 0.0
+    assert iou((0, 0, 2, 2), (1, 1, 3, 3)) == pytest.approx(1 / 7)
+
+
+def test_same_frigate_event_id_is_same_track(tracks):
+    first = tracks.observe(1, "cam1", _event("a", [0.1, 0.1, 0.3, 0.3]))
+    again = tracks.observe(1, "cam1", _event("a", [0.7, 0.7, 0.9, 0.9]))  # Se movió lejos
+    assert again is first
+
+
+def test_overlapping_box_is_same_track(tracks):
+    first = tracks.observe(1, "cam1", _event("a", [0.10, 0.10, 0.30, 0.30]))
+    # Otro id de Frigate, caja casi igual y poco después: el mismo objeto
+    second = tracks.observe(1, "cam1", _event("b", [0.12, 0.12, 0.32, 0.32], start=1010.0, end=1015.0))
+    assert second is first
+
+
+def test_low_iou_other_label_or_scope_is_new_track(tracks):
+    first = tracks.observe(1, "cam1", _event("a", [0.10, 0.10, 0.30, 0.30]))
+
+    far = tracks.observe(1, "cam1", _event("b", [0.25, 0.25, 0.45, 0.45]))  # IoU < 0.3
+    other_label = tracks.observe(1, "cam1", _event("c", [0.10, 0.10, 0.30, 0.30], label="car"))
+    other_camera = tracks.observe(1, "cam2", _event("d", [0.10, 0.10, 0.30, 0.30]))
+    other_user = tracks.observe(2, "cam1", _event("e", [0.10, 0.10, 0.30, 0.30]))
+
+    assert len({id(t) for t in (first, far, other_label, other_camera, other_user)}) == 5
+
+
+def test_overlap_after_long_gap_is_new_track_unless_stationary(tracks):
+    box = [0.10, 0.10, 0.30, 0.30]
+    moving = tracks.observe(1, "cam1", _event("a", box))
+    later = tracks.observe(1, "cam1", _event("b", box, start=1200.0, end=1201.0))  # Hueco > 60s
+    assert later is not moving
+
+    parked = tracks.observe(1, "cam2", _event("c", box, stationary=True))
+    still_parked = tracks.observe(1, "cam2", _event("d", box, start=1200.0, end=1201.0))
+    assert still_parked is parked
+
+
+def test_path_continuity_links_reacquired_object(tracks):
+    first = tracks.observe(1, "cam1", _event(
+        "a", [0.10, 0.10, 0.20, 0.20], path_data=[[[0.15, 0.15], 1000.0], [[0.30, 0.15], 1004.0]],
+    ))
+    # Sin solapamiento, pero el recorrido nuevo empieza donde terminó el anterior
+    second = tracks.observe(1, "cam1", _event(
+        "b", [0.31, 0.10, 0.41, 0.20], start=1006.0, end=1010.0,
+        path_data=[[[0.31, 0.15], 1006.0], [[0.40, 0.15], 1010.0]],
+    ))
+    assert second is first
+
+    # Empieza lejos del final del recorrido: otro objeto
+    third = tracks.observe(1, "cam1", _event(
+        "c", [0.45, 0.45, 0.55, 0.55], start=1012.0, end=1014.0,
+        path_data=[[[0.50, 0.50], 1012.0]],
+    ))
+    assert third is not first
+
+
+def test_check_and_record_once_per_track_and_undo(tracks):
+    track = tracks.observe(1, "cam1", _event("a", [0.1, 0.1, 0.3, 0.3]))
+
+    reason, undo = tracks.check_and_record(track, RULE, now=1000.0)
+    assert reason is None
+    assert tracks.check_and_record(track, RULE, now=1010.0)[0].code == "track"
+
+    undo()  # El hit no se guardó: el track puede volver a alertar
+    assert tracks.check_and_record(track, RULE, now=1011.0)[0] is None
+    assert tracks.check_and_record(track, RULE, now=1080.0)[0] is None  # Pasó la ventana
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Reporte de latencia por etapa a partir de los spans exportados en JSONL
+(app/core/tracing.py en el backend y Tracer en python-listener).
+
+Para cada etapa muestra p50/p95/p99/máx. de su duración y de la espera antes
+de empezar (spool, lote, cola de evaluación, outbox...), y al final la latencia
+total: fin del objeto en Frigate -> mensaje de WhatsApp aceptado.
+
+Los spans del listener y del backend se miden con relojes distintos: las
+esperas entre máquinas incluyen el desfase de reloj (NTP).
+
+Ejecutar:
+    python trace_report.py traces/listener-spans.jsonl traces/backend-spans.jsonl
+    python trace_report.py traces/*.jsonl --since-minutes 60 --slowest 5
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+
+# Orden del pipeline (las etapas desconocidas van al final)
+STAGES = [
+    "mqtt_receive",
+    "snapshot_download",
+    "snapshot_compress",
+    "cloud_post",
+    "ingest",
+    "snapshot_store",
+    "db_insert",
+    "rule_evaluation",
+    "whatsapp_send",
+]
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def load_spans(paths, since: float = 0.0) -> dict:
+    """trace_id -> lista de spans ordenada por inicio."""
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            for line_no, line in enumerate(fh, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    print(f"⚠️ {path}:{line_no}: línea inválida, se ignora", file=sys.stderr)
+                    continue
+                if span.get("start", 0) >= since:
+                    traces[span["trace_id"]].append(span)
+    for spans in traces.values():
+        spans.sort(key=lambda s: s["start"])
+    return traces
+
+
+def _stage_order(name: str):
+    return (STAGES.index(name), name) if name in STAGES else (len(STAGES), name)
+
+
+def _first_delivery(spans):
+    sends = [s for s in spans if s["name"] == "whatsapp_send" and s.get("attrs", {}).get("ok")]
+    return min(sends, key=lambda s: s["end"]) if sends else None
+
+
+def _frigate_end_time(spans):
+    for s in spans:
+        end_time = s.get("attrs", {}).get("frigate_end_time")
+        if s["name"] == "mqtt_receive" and end_time:
+            return float(end_time)
+    return None
+
+
+def analyze(traces: dict) -> dict:
+    durations = defaultdict(list)
+    waits = defaultdict(list)
+    totals = defaultdict(list)
+    for spans in traces.values():
+        finished = None
+        for span in spans:
+            durations[span["name"]].append(span["duration_ms"])
+            if finished is not None:
+                waits[span["name"]].append(max(0.0, (span["start"] - finished) * 1000))
+            finished = span["end"] if finished is None else max(finished, span["end"])
+
+        delivery = _first_delivery(spans)
+        frigate_end = _frigate_end_time(spans)
+        if frigate_end is not None:
+            totals["frigate_end → mqtt"].append((spans[0]["start"] - frigate_end) * 1000)
+        if delivery is not None:
+            totals["trace_start → whatsapp"].append((delivery["end"] - spans[0]["start"]) * 1000)
+            if frigate_end is not None:
+                totals["frigate_end → whatsapp"].append((delivery["end"] - frigate_end) * 1000)
+
+    def summary(samples: dict) -> dict:
+        out = {}
+        for name, values in samples.items():
+            values = sorted(values)
+            out[name] = {
+                "count": len(values),
+                "p50_ms": round(_percentile(values, 50), 1),
+                "p95_ms": round(_percentile(values, 95), 1),
+                "p99_ms": round(_percentile(values, 99), 1),
+                "max_ms": round(values[-1], 1),
+            }
+        return out
+
+    return {"traces": len(traces), "stages": summary(durations), "waits": summary(waits), "totals": summary(totals)}
+
+
+def _print_table(title: str, rows: dict, order=None):
+    if not rows:
+        return
+    print(f"\n{title}")
+    print(f"  {'etapa':<26}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'máx':>10}")
+    for name in sorted(rows, key=order) if order else rows:
+        r = rows[name]
+        print(f"  {name:<26}{r['count']:>7}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+
+
+def print_slowest(traces: dict, count: int):
+    ranked = []
+    for trace_id, spans in traces.items():
+        delivery = _first_delivery(spans)
+        if delivery is not None:
+            ranked.append((delivery["end"] - spans[0]["start"], trace_id))
+    ranked.sort(reverse=True)
+    for total, trace_id in ranked[:count]:
+        spans = traces[trace_id]
+        origin = spans[0]["start"]
+        camera = next((s["attrs"].get("camera") for s in spans if s.get("attrs", {}).get("camera")), "?")
+        print(f"\n🐢 {trace_id} ({camera}): {total * 1000:.0f} ms")
+        for s in spans:
+            print(f"  +{(s['start'] - origin) * 1000:>9.1f} ms  {s['name']:<20}{s['duration_ms']:>9.1f} ms  [{s.get('service', '?')}]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia por etapa (p50/p95/p99) a partir de los spans JSONL")
+    parser.add_argument("files", nargs="+", help="Archivos JSONL del listener y/o del backend")
+    parser.add_argument("--since-minutes", type=float, default=0, help="Solo spans de los últimos N minutos")
+    parser.add_argument("--slowest", type=int, default=0, help="Detalle de las N trazas más lentas")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    since = time.time() - args.since_minutes * 60 if args.since_minutes else 0.0
+    traces = load_spans(args.files, since)
+    report = analyze(traces)
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        sys.exit(0)
+
+    print(f"🧭 {report['traces']} trazas")
+    _print_table("⏱️ Duración por etapa (ms)", report["stages"], _stage_order)
+    _print_table("⏳ Espera antes de la etapa (ms)", report["waits"], _stage_order)
+    _print_table("📬 Latencia total (ms)", report["totals"])
+    if args.slowest:
+        print_slowest(traces, args.slowest)
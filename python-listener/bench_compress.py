@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark de compress_image: modo actual (decodificación completa + LANCZOS +
+optimize) vs. modo rápido (draft JPEG + SNAPSHOT_RESAMPLE + optimize configurable).
+
+Reporta, por imagen, el tiempo de CPU promedio y el tamaño de salida de cada modo.
+
+Ejecutar:
+    python bench_compress.py snapshot1.jpg snapshot2.jpg ...
+    python bench_compress.py carpeta_con_jpgs/ --repeat 20
+    python bench_compress.py              # usa una imagen sintética 1920x1080
+
+Usa SNAPSHOT_MAX_WIDTH / SNAPSHOT_MAX_HEIGHT / SNAPSHOT_QUALITY del entorno,
+igual que el listener.
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from io import BytesIO
+
+# listener.py exige CLOUD_API_URL al importarse; para el benchmark no se usa
+os.environ.setdefault("CLOUD_API_URL", "http://localhost/api/events/")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import listener  # noqa: E402
+
+MODES = {
+    "actual": {"fast": False, "optimize": True},
+    "rápido": {"fast": True, "optimize": None},  # None = SNAPSHOT_JPEG_OPTIMIZE
+}
+
+
+def synthetic_snapshot(width: int = 1920, height: int = 1080) -> bytes:
+    """JPEG con ruido y gradientes, parecido en peso a un snapshot real de Frigate."""
+    from PIL import Image
+
+    noise = Image.effect_noise((width, height), 64).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = Image.blend(noise, gradient, 0.5)
+    output = BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def load_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, "*.jpg")) + glob.glob(os.path.join(path, "*.jpeg")))
+        else:
+            files = [path]
+        for f in files:
+            with open(f, "rb") as fh:
+                images.append((os.path.basename(f), fh.read()))
+    return images
+
+
+def bench(image_bytes: bytes, repeat: int, fast: bool, optimize) -> tuple:
+    output = b""
+    start = time.process_time()
+    for _ in range(repeat):
+        output = listener.compress_image(
+            image_bytes,
+            max_width=listener.SNAPSHOT_MAX_WIDTH,
+            max_height=listener.SNAPSHOT_MAX_HEIGHT,
+            quality=listener.SNAPSHOT_QUALITY,
+            fast=fast,
+            optimize=optimize,
+        )
+    cpu_ms = (time.process_time() - start) / repeat * 1000
+    return cpu_ms, len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de compress_image (modo actual vs. rápido)")
+    parser.add_argument("paths", nargs="*", help="Archivos .jpg o carpetas")
+    parser.add_argument("--repeat", type=int, default=10, help="Repeticiones por imagen y modo")
+    args = parser.parse_args()
+
+    # Los logs por imagen de compress_image ensucian la tabla
+    logging.getLogger().setLevel(logging.WARNING)
+
+    images = load_images(args.paths) if args.paths else [("sintética 1920x1080", synthetic_snapshot())]
+    if not images:
+        print("❌ No se encontraron imágenes")
+        return
+
+    print(
+        f"📐 Destino {listener.SNAPSHOT_MAX_WIDTH}x{listener.SNAPSHOT_MAX_HEIGHT}, calidad {listener.SNAPSHOT_QUALITY}, "
+        f"resample rápido={listener.SNAPSHOT_RESAMPLE}, optimize rápido={listener.SNAPSHOT_JPEG_OPTIMIZE}, "
+        f"{args.repeat} repeticiones"
+    )
+    header = f"{'imagen':<28} {'entrada':>9}"
+    for mode in MODES:
+        header += f" {mode + ' CPU ms':>15} {mode + ' bytes':>14}"
+    print(header + f" {'speedup':>8}")
+
+    totals = {mode: [0.0, 0] for mode in MODES}
+    for name, data in images:
+        line = f"{name[:28]:<28} {len(data):>9}"
+        results = {}
+        for mode, opts in MODES.items():
+            cpu_ms, size = bench(data, args.repeat, **opts)
+            results[mode] = cpu_ms
+            totals[mode][0] += cpu_ms
+            totals[mode][1] += size
+            line += f" {cpu_ms:>15.1f} {size:>14}"
+        speedup = results["actual"] / results["rápido"] if results["rápido"] else 0.0
+        print(line + f" {speedup:>7.1f}x")
+
+    n = len(images)
+    line = f"{'PROMEDIO':<28} {'':>9}"
+    for mode in MODES:
+        line += f" {totals[mode][0] / n:>15.1f} {totals[mode][1] // n:>14}"
+    speedup = totals["actual"][0] / totals["rápido"][0] if totals["rápido"][0] else 0.0
+    print(line + f" {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,13 @@ import json
 import time
 import logging
 import base64
+import gzip
+import random
+import sqlite3
 from datetime import datetime, timezone
-from threading import Thread, Event
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BoundedSemaphore, Thread, Event, Lock
 from urllib.parse import urlparse
 
 import paho.mqtt.client as mqtt
@@ -46,6 +51,46 @@ MAX_SNAPSHOT_SIZE_B64 = int(os.getenv("MAX_SNAPSHOT_SIZE_B64", "150000"))
 SNAPSHOT_MAX_WIDTH = int(os.getenv("SNAPSHOT_MAX_WIDTH", "800"))  # Ancho máximo en píxeles
 SNAPSHOT_MAX_HEIGHT = int(os.getenv("SNAPSHOT_MAX_HEIGHT", "600"))  # Alto máximo en píxeles
 SNAPSHOT_QUALITY = int(os.getenv("SNAPSHOT_QUALITY", "75"))  # Calidad JPEG (1-100, menor = más compresión)
+# Calidad adaptativa: se busca la mayor calidad (<= SNAPSHOT_QUALITY) que entra en el presupuesto del evento
+SNAPSHOT_ADAPTIVE_QUALITY = os.getenv("SNAPSHOT_ADAPTIVE_QUALITY", "true").lower() in ("1", "true", "yes", "on")
+SNAPSHOT_MIN_QUALITY = int(os.getenv("SNAPSHOT_MIN_QUALITY", "30"))
+SNAPSHOT_MAX_ENCODES = int(os.getenv("SNAPSHOT_MAX_ENCODES", "4"))  # Encodes máximos por resolución
+# Modo rápido: decodificación draft de JPEG + filtro de reescalado barato (menos CPU en equipos pequeños)
+SNAPSHOT_FAST_MODE = os.getenv("SNAPSHOT_FAST_MODE", "true").lower() in ("1", "true", "yes", "on")
+SNAPSHOT_RESAMPLE = os.getenv("SNAPSHOT_RESAMPLE", "bilinear")  # nearest | bilinear | bicubic | lanczos (solo modo rápido)
+# optimize=True hace una pasada extra de Huffman (~5% menos bytes, bastante más CPU). Default: solo fuera del modo rápido
+SNAPSHOT_JPEG_OPTIMIZE = os.getenv("SNAPSHOT_JPEG_OPTIMIZE", "" if SNAPSHOT_FAST_MODE else "true").lower() in ("1", "true", "yes", "on")
+
+# Pipeline de snapshots (descarga + compresión fuera del hilo de MQTT)
+SNAPSHOT_FETCH_WORKERS = int(os.getenv("SNAPSHOT_FETCH_WORKERS", "4"))
+SNAPSHOT_COMPRESS_WORKERS = int(os.getenv("SNAPSHOT_COMPRESS_WORKERS", str(os.cpu_count() or 1)))
+SNAPSHOT_COMPRESS_EXECUTOR = os.getenv("SNAPSHOT_COMPRESS_EXECUTOR", "thread").lower()  # thread | process
+SNAPSHOT_PIPELINE_MAX_PENDING = int(os.getenv("SNAPSHOT_PIPELINE_MAX_PENDING", "32"))
+
+# Micro-batching hacia /api/events/batch
+# CLOUD_BATCH_SIZE=1 desactiva el batching (un POST por evento, como antes)
+CLOUD_BATCH_SIZE = int(os.getenv("CLOUD_BATCH_SIZE", "1"))  # Eventos máximos por lote
+CLOUD_BATCH_WINDOW_MS = int(os.getenv("CLOUD_BATCH_WINDOW_MS", "500"))  # Espera máxima antes de enviar un lote incompleto
+CLOUD_BATCH_MAX_BYTES = int(os.getenv("CLOUD_BATCH_MAX_BYTES", "2000000"))  # Tamaño máximo del lote (JSON sin comprimir)
+CLOUD_BATCH_COMPRESSION = os.getenv("CLOUD_BATCH_COMPRESSION", "gzip").lower()  # gzip | zstd | none
+
+# Spool local: los eventos se guardan en disco antes de enviarse a la nube
+LISTENER_SPOOL_PATH = os.getenv("LISTENER_SPOOL_PATH", "spool/events.db")
+LISTENER_SPOOL_MAX_MB = float(os.getenv("LISTENER_SPOOL_MAX_MB", "500"))
+SPOOL_RETRY_BASE_SECONDS = float(os.getenv("SPOOL_RETRY_BASE_SECONDS", "1"))
+SPOOL_RETRY_MAX_SECONDS = float(os.getenv("SPOOL_RETRY_MAX_SECONDS", "60"))
+# Intentos fallidos (el backend respondió con error a ESE evento) antes de pasarlo a dead_letter
+LISTENER_SPOOL_MAX_ATTEMPTS = int(os.getenv("LISTENER_SPOOL_MAX_ATTEMPTS", "10"))
+
+# Trazas de latencia (spans en el mismo formato que el backend, ver Tracer)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes", "on")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces/listener-spans.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "listener")
+
+# El error 431 generalmente ocurre con payloads > 200KB: por encima de esto se quita el snapshot
+MAX_EVENT_PAYLOAD_SIZE = 180000
 
 # Mapeo de nombres de cámaras: local_name:remote_name,local_name2:remote_name2
 # Lo que está haciendo es un arreglo para que el nombre de la cámara en frigate sea el mismo que el nombre de la cámara en la nube
@@ -76,8 +121,229 @@ def compute_api_base() -> str:
     return url  # fallback
 
 
+# Sesión HTTP compartida hacia la nube (keep-alive entre envíos)
+CLOUD_SESSION = requests.Session()
+
+# Sesión compartida con Frigate; el pool de conexiones alcanza para todos los hilos de fetch
+FRIGATE_SESSION = requests.Session()
+FRIGATE_SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(10, SNAPSHOT_FETCH_WORKERS)))
+FRIGATE_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(10, SNAPSHOT_FETCH_WORKERS)))
+
+
+# ---------- Trazas de latencia ----------
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """
+    Spans del listener: mqtt_receive, snapshot_download, snapshot_compress y cloud_post.
+
+    Mismo formato que app/core/tracing.py del backend: el contexto W3C
+    (traceparent) viaja en el evento ("traceparent") y en el header HTTP, así
+    el backend cuelga de la misma traza el insert, la evaluación de reglas y el
+    envío a WhatsApp. Solo se trazan los eventos 'end' (los únicos que llegan a
+    las reglas). Un evento no muestreado viaja con flag 00 y el backend tampoco
+    lo registra.
+
+    Los spans se exportan desde un hilo aparte a JSONL (TRACE_EXPORT_PATH) y/o
+    a un colector OTLP/HTTP JSON (TRACE_OTLP_ENDPOINT). Reporte por etapa:
+    python backend/trace_report.py traces/listener-spans.jsonl <spans del backend>
+    """
+
+    def __init__(self, enabled: bool, sample_rate: float, path: str, otlp_endpoint: str, service: str):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.path = path
+        self.otlp_endpoint = otlp_endpoint
+        self.service = service
+        self.dropped = 0
+        self._queue = None
+        self._lock = Lock()
+        if enabled:
+            import queue
+            self._queue = queue.Queue(maxsize=10000)
+            Thread(target=self._run, name="trace-exporter", daemon=True).start()
+            logging.info(f"🧭 Trazas activas (muestreo {sample_rate:.0%}) → {path or ''} {otlp_endpoint or ''}")
+
+    @staticmethod
+    def _parse(traceparent: str):
+        parts = traceparent.split("-") if isinstance(traceparent, str) else []
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        return parts[1], parts[2], parts[3] == "01"
+
+    def new_trace(self) -> str:
+        """traceparent raíz de un evento nuevo (None si las trazas están apagadas)."""
+        if not self.enabled:
+            return None
+        sampled = random.random() < self.sample_rate
+        return f"00-{random.getrandbits(128) or 1:032x}-{random.getrandbits(64) or 1:016x}-{'01' if sampled else '00'}"
+
+    def child(self, parent: str) -> str:
+        """traceparent de un span hijo de `parent` (None sin trazas o sin padre válido)."""
+        parsed = self._parse(parent) if self.enabled else None
+        if parsed is None:
+            return None
+        return f"00-{parsed[0]}-{random.getrandbits(64) or 1:016x}-{'01' if parsed[2] else '00'}"
+
+    def record(self, name: str, traceparent: str, parent: str, start: float, end: float, **attrs):
+        """Registra un span ya medido (tiempos de pared, en segundos)."""
+        parsed = self._parse(traceparent) if self.enabled else None
+        if parsed is None or not parsed[2]:
+            return
+        parent_parsed = self._parse(parent) if parent else None
+        record = {
+            "trace_id": parsed[0],
+            "span_id": parsed[1],
+            "parent_id": parent_parsed[1] if parent_parsed else None,
+            "name": name,
+            "service": self.service,
+            "start": round(start, 6),
+            "end": round(end, 6),
+            "duration_ms": round((end - start) * 1000, 3),
+            "attrs": attrs,
+        }
+        try:
+            self._queue.put_nowait(record)
+        except Exception:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        import queue
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + 1.0
+            while len(batch) < 512:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: list):
+        if self.path:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as fh:
+                    fh.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in batch))
+            except OSError as e:
+                logging.error(f"❌ No se pudieron escribir las trazas en {self.path}: {e}")
+        if self.otlp_endpoint:
+            spans = []
+            for r in batch:
+                span = {
+                    "traceId": r["trace_id"],
+                    "spanId": r["span_id"],
+                    "name": r["name"],
+                    "kind": 1,
+                    "startTimeUnixNano": str(int(r["start"] * 1e9)),
+                    "endTimeUnixNano": str(int(r["end"] * 1e9)),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in r["attrs"].items() if v is not None],
+                }
+                if r["parent_id"]:
+                    span["parentSpanId"] = r["parent_id"]
+                spans.append(span)
+            payload = {"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                "scopeSpans": [{"scope": {"name": "frigate-alerts"}, "spans": spans}],
+            }]}
+            try:
+                resp = requests.post(self.otlp_endpoint, json=payload, timeout=5)
+                if resp.status_code >= 300:
+                    logging.warning(f"⚠ Colector OTLP respondió {resp.status_code}: {resp.text[:200]}")
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"⚠ No se pudieron enviar {len(spans)} spans a {self.otlp_endpoint}: {e}")
+
+
+TRACER = Tracer(TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_EXPORT_PATH, TRACE_OTLP_ENDPOINT, TRACE_SERVICE_NAME)
+
+
 # ---------- Función para comprimir imagen ----------
-def compress_image(image_bytes: bytes, max_width: int = None, max_height: int = None, quality: int = 75) -> bytes:
+def _resample_filter(name: str):
+    from PIL import Image
+    return getattr(Image.Resampling, name.upper(), Image.Resampling.BILINEAR)
+
+
+def prepare_image(image_bytes: bytes, max_width: int = None, max_height: int = None, fast: bool = None):
+    """
+    Decodifica la imagen y la deja en RGB y dentro de max_width x max_height.
+
+    En modo rápido se usa el draft de JPEG: libjpeg decodifica directamente a
+    1/2, 1/4 o 1/8 de la resolución (escalado en el dominio DCT), así un
+    snapshot 1920x1080 nunca se decodifica completo. Después basta un filtro
+    barato (SNAPSHOT_RESAMPLE) para el ajuste final.
+    """
+    from PIL import Image
+    from io import BytesIO
+
+    if fast is None:
+        fast = SNAPSHOT_FAST_MODE
+
+    # Abrir imagen desde bytes
+    img = Image.open(BytesIO(image_bytes))
+
+    width, height = img.size
+    ratio = 1.0
+    if max_width or max_height:
+        # Calcular nuevo tamaño manteniendo proporción
+        ratio = min(
+            (max_width or width) / width,
+            (max_height or height) / height
+        )
+
+    if fast and ratio < 1.0 and img.format == 'JPEG':
+        # Pide al decoder la escala más chica que siga siendo >= al tamaño final
+        img.draft('RGB', (int(width * ratio), int(height * ratio)))
+
+    # Convertir a RGB si es necesario (para JPEG)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Crear fondo blanco para imágenes con transparencia
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        rgb_img.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+        img = rgb_img
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Solo redimensionar si la imagen es más grande
+    if ratio < 1.0:
+        new_width = max(1, int(width * ratio))
+        new_height = max(1, int(height * ratio))
+        if img.size != (new_width, new_height):
+            resample = _resample_filter(SNAPSHOT_RESAMPLE) if fast else Image.Resampling.LANCZOS
+            decoded_size = img.size
+            img = img.resize((new_width, new_height), resample)
+            logging.debug(f"📐 Imagen redimensionada: {width}x{height} (decodificada {decoded_size[0]}x{decoded_size[1]}) → {new_width}x{new_height}")
+
+    return img
+
+
+def encode_jpeg(img, quality: int, optimize: bool = None) -> bytes:
+    from io import BytesIO
+
+    if optimize is None:
+        optimize = SNAPSHOT_JPEG_OPTIMIZE
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=quality, optimize=optimize)
+    return output.getvalue()
+
+
+def compress_image(image_bytes: bytes, max_width: int = None, max_height: int = None, quality: int = 75,
+                   fast: bool = None, optimize: bool = None) -> bytes:
     """
     Comprime una imagen JPEG reduciendo tamaño y/o calidad.
     
@@ -86,49 +352,19 @@ def compress_image(image_bytes: bytes, max_width: int = None, max_height: int =
         max_width: Ancho máximo en píxeles (None = mantener proporción)
         max_height: Alto máximo en píxeles (None = mantener proporción)
         quality: Calidad JPEG (1-100, menor = más compresión)
+        fast: Modo rápido (draft + filtro barato). None = SNAPSHOT_FAST_MODE
+        optimize: Pasada extra de Huffman optimizado. None = SNAPSHOT_JPEG_OPTIMIZE
     
     Returns:
         Bytes de la imagen comprimida
     """
     try:
-        from PIL import Image
-        from io import BytesIO
-        
-        # Abrir imagen desde bytes
-        img = Image.open(BytesIO(image_bytes))
         original_size = len(image_bytes)
-        
-        # Convertir a RGB si es necesario (para JPEG)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # Crear fondo blanco para imágenes con transparencia
-            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            rgb_img.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = rgb_img
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Redimensionar si es necesario
-        if max_width or max_height:
-            # Calcular nuevo tamaño manteniendo proporción
-            width, height = img.size
-            ratio = min(
-                (max_width or width) / width,
-                (max_height or height) / height
-            )
-            
-            # Solo redimensionar si la imagen es más grande
-            if ratio < 1.0:
-                new_width = int(width * ratio)
-                new_height = int(height * ratio)
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                logging.debug(f"📐 Imagen redimensionada: {width}x{height} → {new_width}x{new_height}")
-        
+
+        img = prepare_image(image_bytes, max_width, max_height, fast)
+
         # Comprimir a JPEG
-        output = BytesIO()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
-        compressed_bytes = output.getvalue()
+        compressed_bytes = encode_jpeg(img, quality, optimize)
         compressed_size = len(compressed_bytes)
         
         # Log de compresión
@@ -145,42 +381,292 @@ def compress_image(image_bytes: bytes, max_width: int = None, max_height: int =
 
 
 # ---------- Función para descargar snapshot de Frigate ----------
-def download_snapshot(event_id: str) -> str:
-    """Descarga el snapshot de Frigate, lo comprime y lo retorna como base64."""
+def fetch_snapshot(event_id: str) -> bytes:
+    """Descarga el snapshot original de Frigate (sin comprimir). None si no está disponible."""
     try:
         snapshot_url = f"{FRIGATE_URL}/api/events/{event_id}/snapshot.jpg"
         logging.info(f"📸 Descargando snapshot: {snapshot_url}")
 
-        resp = requests.get(snapshot_url, timeout=5)
+        resp = FRIGATE_SESSION.get(snapshot_url, timeout=5)
 
         if resp.status_code == 200:
-            original_size = len(resp.content)
-            
-            # Comprimir imagen antes de convertir a base64
-            compressed_bytes = compress_image(
-                resp.content,
-                max_width=SNAPSHOT_MAX_WIDTH,
-                max_height=SNAPSHOT_MAX_HEIGHT,
-                quality=SNAPSHOT_QUALITY
-            )
-            
-            # Convertir a base64
-            snapshot_b64 = base64.b64encode(compressed_bytes).decode('utf-8')
-            final_size = len(snapshot_b64)
-            
-            logging.info(f"✔ Snapshot descargado y comprimido: {original_size} bytes → {len(compressed_bytes)} bytes (base64: {final_size} bytes)")
-            return snapshot_b64
-        else:
-            logging.warning(f"⚠ No se pudo descargar snapshot: {resp.status_code}")
-            return None
+            return resp.content
+        logging.warning(f"⚠ No se pudo descargar snapshot: {resp.status_code}")
+        return None
     except Exception as e:
         logging.error(f"❌ Error descargando snapshot: {e}")
         return None
 
 
+def compress_to_budget(image_bytes: bytes, budget: int, start_quality: int = None) -> tuple:
+    """
+    Busca la mayor calidad JPEG (y, si hace falta, la mayor resolución) cuyo
+    resultado entra en `budget` bytes.
+
+    - Búsqueda binaria de calidad entre SNAPSHOT_MIN_QUALITY y SNAPSHOT_QUALITY,
+      empezando por `start_quality` (la última usada en esa cámara), con como
+      máximo SNAPSHOT_MAX_ENCODES encodes por resolución.
+    - Si ni la calidad mínima entra, se reduce la resolución y se repite.
+
+    Retorna (bytes, calidad). La calidad es None si no se pudo comprimir.
+    """
+    try:
+        img = prepare_image(image_bytes, SNAPSHOT_MAX_WIDTH, SNAPSHOT_MAX_HEIGHT)
+    except ImportError:
+        logging.warning("⚠ Pillow no está instalado, no se puede comprimir la imagen")
+        return image_bytes, None
+    except Exception as e:
+        logging.error(f"❌ Error comprimiendo imagen: {e}")
+        return image_bytes, None
+
+    min_q = min(SNAPSHOT_MIN_QUALITY, SNAPSHOT_QUALITY)
+    max_q = SNAPSHOT_QUALITY
+    smallest = None
+
+    for _ in range(4):  # Como mucho 3 reducciones de resolución
+        lo, hi = min_q, max_q
+        quality = min(max(start_quality or max_q, lo), hi)
+        best = None
+        for _ in range(max(1, SNAPSHOT_MAX_ENCODES)):
+            data = encode_jpeg(img, quality)
+            if smallest is None or len(data) < len(smallest):
+                smallest = data
+            if len(data) <= budget:
+                best = (data, quality)
+                lo = quality + 1
+            else:
+                hi = quality - 1
+            if lo > hi:
+                break
+            quality = (lo + hi + 1) // 2
+
+        if best:
+            if best[1] < max_q:
+                logging.debug(f"🎯 Snapshot ajustado al presupuesto: calidad {best[1]}, {img.size[0]}x{img.size[1]}, {len(best[0])}/{budget} bytes")
+            return best
+
+        # Ni con la calidad mínima entra: bajamos la resolución proporcionalmente al exceso
+        scale = max(0.5, min(0.9, (budget / len(smallest)) ** 0.5))
+        new_size = (max(1, int(img.size[0] * scale)), max(1, int(img.size[1] * scale)))
+        logging.info(f"📐 Snapshot no entra en {budget} bytes, reduciendo a {new_size[0]}x{new_size[1]}")
+        img = img.resize(new_size, _resample_filter(SNAPSHOT_RESAMPLE))
+        start_quality = max_q
+
+    return smallest, min_q
+
+
+def compress_snapshot(image_bytes: bytes, budget: int = None, start_quality: int = None) -> tuple:
+    """
+    Comprime el snapshot con la configuración del listener (se puede ejecutar en otro proceso).
+    Retorna (bytes, calidad usada).
+    """
+    if budget and SNAPSHOT_ADAPTIVE_QUALITY:
+        return compress_to_budget(image_bytes, budget, start_quality)
+    compressed = compress_image(
+        image_bytes,
+        max_width=SNAPSHOT_MAX_WIDTH,
+        max_height=SNAPSHOT_MAX_HEIGHT,
+        quality=SNAPSHOT_QUALITY
+    )
+    return compressed, SNAPSHOT_QUALITY
+
+
+def _timed_compress(image_bytes: bytes, budget: int = None, start_quality: int = None) -> tuple:
+    """compress_snapshot + (inicio, fin) en tiempo de pared, para el span snapshot_compress (vale entre procesos)."""
+    started = time.time()
+    compressed, quality = compress_snapshot(image_bytes, budget, start_quality)
+    return compressed, quality, started, time.time()
+
+
+def snapshot_budget(event_payload: dict) -> int:
+    """
+    Bytes de JPEG que caben en el evento: el snapshot en base64 no debe pasar
+    MAX_SNAPSHOT_SIZE_B64 ni hacer que el evento supere MAX_EVENT_PAYLOAD_SIZE
+    (que es cuando send_event_to_cloud lo quitaría).
+    """
+    event_size = len(json.dumps(event_payload)) + len(', "snapshot_base64": ""')
+    budget_b64 = min(MAX_SNAPSHOT_SIZE_B64, MAX_EVENT_PAYLOAD_SIZE - event_size)
+    return max(0, budget_b64) * 3 // 4
+
+
+def attach_snapshot(event_payload: dict, compressed_bytes: bytes):
+    """Agrega el snapshot en base64 al evento si no excede MAX_SNAPSHOT_SIZE_B64."""
+    snapshot_b64 = base64.b64encode(compressed_bytes).decode('utf-8')
+    snapshot_size = len(snapshot_b64)
+    if snapshot_size > MAX_SNAPSHOT_SIZE_B64:
+        logging.warning(
+            f"⚠ Snapshot demasiado grande ({snapshot_size} bytes), "
+            f"excede el límite de {MAX_SNAPSHOT_SIZE_B64} bytes. No se incluirá en el evento."
+        )
+        return
+    event_payload['snapshot_base64'] = snapshot_b64
+
+
+# ---------- Pipeline de snapshots ----------
+class _PendingEvent:
+    __slots__ = ("event", "done")
+
+    def __init__(self, event: dict):
+        self.event = event
+        self.done = False
+
+
+class SnapshotPipeline:
+    """
+    Descarga y comprime snapshots fuera del hilo de MQTT, en dos etapas:
+
+    1. fetch: pool de hilos sobre una sesión HTTP compartida con Frigate.
+    2. compress: pool de hilos o procesos del tamaño de los núcleos (Pillow),
+       ajustando la calidad al presupuesto de bytes del evento.
+
+    - Acotado: como máximo SNAPSHOT_PIPELINE_MAX_PENDING eventos en vuelo;
+      si se llena, on_message espera (backpressure hacia MQTT).
+    - Orden por cámara: los eventos de una cámara salen hacia el spool en el
+      orden en que llegaron, aunque sus snapshots terminen desordenados.
+      Cámaras distintas no se esperan entre sí.
+    """
+
+    def __init__(self, sink, fetch_workers: int, compress_workers: int, max_pending: int,
+                 compress_executor: str = "thread"):
+        self.sink = sink
+        self._fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="snapshot-fetch")
+        if compress_executor == "process":
+            self._compress_pool = ProcessPoolExecutor(max_workers=compress_workers)
+        else:
+            self._compress_pool = ThreadPoolExecutor(max_workers=compress_workers, thread_name_prefix="snapshot-compress")
+        self._slots = BoundedSemaphore(max_pending)
+        self._lock = Lock()
+        self._by_camera = {}  # cámara -> deque de _PendingEvent en orden de llegada
+        self._quality_by_camera = {}  # cámara -> última calidad JPEG que entró en el presupuesto
+        logging.info(
+            f"🧵 Pipeline de snapshots: fetch={fetch_workers} hilos, "
+            f"compress={compress_workers} {compress_executor}s, máx. {max_pending} en vuelo"
+        )
+
+    def submit(self, event_payload: dict, needs_snapshot: bool):
+        camera = event_payload.get("camera") or ""
+        pending = _PendingEvent(event_payload)
+        with self._lock:
+            self._by_camera.setdefault(camera, deque()).append(pending)
+
+        if not needs_snapshot:
+            self._complete(camera, pending)
+            return
+
+        self._slots.acquire()
+        try:
+            self._fetch_pool.submit(self._fetch, camera, pending)
+        except RuntimeError:
+            # Pool cerrado (apagando): enviamos el evento sin snapshot
+            self._release(camera, pending)
+
+    def _fetch(self, camera: str, pending: _PendingEvent):
+        started = time.time()
+        image_bytes = fetch_snapshot(pending.event.get("event_id"))
+        parent = pending.event.get("traceparent")
+        TRACER.record("snapshot_download", TRACER.child(parent), parent, started, time.time(),
+                      ok=image_bytes is not None, bytes=len(image_bytes) if image_bytes else 0)
+        if image_bytes is None:
+            self._release(camera, pending)
+            return
+        budget = snapshot_budget(pending.event)
+        start_quality = self._quality_by_camera.get(camera)
+        try:
+            future = self._compress_pool.submit(_timed_compress, image_bytes, budget, start_quality)
+        except RuntimeError:
+            self._release(camera, pending)
+            return
+        future.add_done_callback(lambda f: self._compressed(camera, pending, len(image_bytes), f))
+
+    def _compressed(self, camera: str, pending: _PendingEvent, original_size: int, future):
+        try:
+            compressed_bytes, quality, started, finished = future.result()
+            parent = pending.event.get("traceparent")
+            TRACER.record("snapshot_compress", TRACER.child(parent), parent, started, finished,
+                          bytes_in=original_size, bytes_out=len(compressed_bytes), quality=quality)
+            if quality is not None:
+                # La próxima búsqueda de esta cámara arranca desde aquí (converge en 1-2 encodes)
+                self._quality_by_camera[camera] = quality
+            logging.info(f"✔ Snapshot descargado y comprimido: {original_size} bytes → {len(compressed_bytes)} bytes (calidad {quality})")
+            attach_snapshot(pending.event, compressed_bytes)
+        except Exception as e:
+            logging.error(f"❌ Error comprimiendo snapshot: {e}")
+        finally:
+            self._release(camera, pending)
+
+    def _release(self, camera: str, pending: _PendingEvent):
+        self._slots.release()
+        self._complete(camera, pending)
+
+    def _complete(self, camera: str, pending: _PendingEvent):
+        # El sink se llama con el lock tomado para que el orden por cámara se respete entre hilos
+        with self._lock:
+            pending.done = True
+            queue = self._by_camera.get(camera)
+            while queue and queue[0].done:
+                self.sink(queue.popleft().event)
+            if queue is not None and not queue:
+                del self._by_camera[camera]
+
+    def shutdown(self):
+        self._fetch_pool.shutdown(wait=True)
+        self._compress_pool.shutdown(wait=True)
+
+
 # ---------- Función para enviar evento a la nube ----------
-def send_event_to_cloud(event_payload: dict):
-    """Hace POST del evento al backend en la nube."""
+# Resultado de enviar un evento al backend
+SENT = "sent"                # Guardado: sale del spool
+REJECTED = "rejected"        # Inválido (malformado o demasiado grande): a dead_letter sin reintentar
+FAILED = "failed"            # El backend falló con ESTE evento (p.ej. 500): cuenta para LISTENER_SPOOL_MAX_ATTEMPTS
+UNAVAILABLE = "unavailable"  # Caída, timeout, sobrecarga o configuración: se reintenta sin límite
+
+
+def _classify_status(status_code: int) -> str:
+    """
+    400/413/422: reintentarlo no lo arregla. 401/403/404 (API key rotada, URL mal
+    configurada), 408/429 y 502/503/504 (deploy, sobrecarga) no dependen del
+    evento: se reintenta sin contar intentos. Cualquier otro error (500...) puede
+    ser culpa del evento y cuenta como intento fallido.
+    """
+    if 200 <= status_code < 300:
+        return SENT
+    if status_code in (400, 413, 422):
+        return REJECTED
+    if status_code in (401, 403, 404, 405, 408, 429, 502, 503, 504):
+        return UNAVAILABLE
+    return FAILED
+
+
+def _log_config_error(status_code: int, url: str):
+    """401/403/404 no se arreglan solos: hay que avisar fuerte (los eventos se acumulan en el spool)."""
+    if status_code in (401, 403):
+        logging.error(f"🔑 El backend rechazó la autenticación ({status_code}): revisa CLOUD_API_KEY")
+        logging.error(f"   Los eventos quedan en el spool ({len(SPOOL) if SPOOL else 0}) y se reintentan hasta que se corrija")
+    elif status_code == 404:
+        logging.error(f"❌ Error 404: el endpoint no existe ({url}), revisa CLOUD_API_URL")
+        logging.error(f"   Los eventos quedan en el spool ({len(SPOOL) if SPOOL else 0}) y se reintentan hasta que se corrija")
+
+
+def send_event_to_cloud(event_payload: dict) -> tuple:
+    """
+    Hace POST del evento al backend; con trazas activas, lo registra como span cloud_post.
+    Retorna (resultado, detalle del error): SENT | REJECTED | FAILED | UNAVAILABLE.
+    """
+    parent = event_payload.get("traceparent")
+    traceparent = TRACER.child(parent)
+    if traceparent is None:
+        return _post_event_to_cloud(event_payload)
+
+    # El backend cuelga sus spans de este POST (header + campo del evento)
+    event_payload = {**event_payload, "traceparent": traceparent}
+    started = time.time()
+    outcome, detail = _post_event_to_cloud(event_payload, traceparent)
+    TRACER.record("cloud_post", traceparent, parent, started, time.time(), mode="single", done=outcome == SENT)
+    return outcome, detail
+
+
+def _post_event_to_cloud(event_payload: dict, traceparent: str = None) -> tuple:
+    """Hace POST del evento al backend en la nube. Retorna (resultado, detalle del error)."""
     try:
         headers = {
             "Content-Type": "application/json"
@@ -188,6 +674,8 @@ def send_event_to_cloud(event_payload: dict):
 
         if CLOUD_API_KEY:
             headers["Authorization"] = f"Bearer {CLOUD_API_KEY}"
+        if traceparent:
+            headers["traceparent"] = traceparent
 
         # Calcular tamaño aproximado del payload
         import json as json_lib
@@ -195,10 +683,7 @@ def send_event_to_cloud(event_payload: dict):
         snapshot_size = len(event_payload.get('snapshot_base64', ''))
         
         # Verificar tamaño total del payload antes de enviar
-        # El error 431 generalmente ocurre con payloads > 200KB
-        MAX_PAYLOAD_SIZE = 180000  # 180KB para dejar margen
-        
-        if payload_size > MAX_PAYLOAD_SIZE:
+        if payload_size > MAX_EVENT_PAYLOAD_SIZE:
             logging.warning(f"⚠ Payload demasiado grande ({payload_size} bytes), removiendo snapshot...")
             if 'snapshot_base64' in event_payload:
                 snapshot_size = len(event_payload.get('snapshot_base64', ''))
@@ -211,7 +696,7 @@ def send_event_to_cloud(event_payload: dict):
         else:
             logging.debug(f"📤 Enviando evento a: {CLOUD_API_URL} (payload: ~{payload_size} bytes)")
         
-        resp = requests.post(
+        resp = CLOUD_SESSION.post(
             CLOUD_API_URL,
             json=event_payload,
             headers=headers,
@@ -220,6 +705,7 @@ def send_event_to_cloud(event_payload: dict):
 
         if 200 <= resp.status_code < 300:
             logging.info(f"✔ Evento enviado a la nube (status {resp.status_code})")
+            return SENT, None
         else:
             logging.warning(
                 f"⚠ Error enviando a la nube: {resp.status_code} | {resp.text}"
@@ -232,7 +718,7 @@ def send_event_to_cloud(event_payload: dict):
                     logging.info(f"🔄 Reintentando envío sin snapshot...")
                     event_without_snapshot = event_payload.copy()
                     del event_without_snapshot['snapshot_base64']
-                    retry_resp = requests.post(
+                    retry_resp = CLOUD_SESSION.post(
                         CLOUD_API_URL,
                         json=event_without_snapshot,
                         headers=headers,
@@ -240,24 +726,383 @@ def send_event_to_cloud(event_payload: dict):
                     )
                     if 200 <= retry_resp.status_code < 300:
                         logging.info(f"✔ Evento enviado sin snapshot (status {retry_resp.status_code})")
-                    else:
-                        logging.error(f"❌ Error al reintentar sin snapshot: {retry_resp.status_code} | {retry_resp.text}")
-                else:
-                    logging.error(f"   Considera reducir el tamaño del payload")
+                        return SENT, None
+                    logging.error(f"❌ Error al reintentar sin snapshot: {retry_resp.status_code} | {retry_resp.text}")
+                    _log_config_error(retry_resp.status_code, CLOUD_API_URL)
+                    return _classify_status(retry_resp.status_code), f"{retry_resp.status_code}: {retry_resp.text[:500]}"
+                logging.error(f"   Considera reducir el tamaño del payload")
+                return REJECTED, f"431: {resp.text[:500]}"
             elif resp.status_code == 502:
                 logging.error(f"❌ Error 502: El backend no está respondiendo")
                 logging.error(f"   Verifica que el backend esté funcionando en Railway")
                 logging.error(f"   URL intentada: {CLOUD_API_URL}")
+            _log_config_error(resp.status_code, CLOUD_API_URL)
+            return _classify_status(resp.status_code), f"{resp.status_code}: {resp.text[:500]}"
     except requests.exceptions.Timeout:
         logging.error(f"❌ Timeout enviando evento a la nube (URL: {CLOUD_API_URL})")
         logging.error(f"   El backend tardó más de 7 segundos en responder")
+        return UNAVAILABLE, "timeout"
     except requests.exceptions.ConnectionError as e:
         logging.error(f"❌ Error de conexión a la nube: {e}")
         logging.error(f"   URL intentada: {CLOUD_API_URL}")
         logging.error(f"   Verifica que la URL sea correcta y el backend esté accesible")
+        return UNAVAILABLE, f"{type(e).__name__}: {e}"
     except Exception as e:
+        # Error inesperado (p.ej. payload no serializable): reintentarlo no lo arregla
         logging.error(f"❌ Excepción enviando evento a la nube: {type(e).__name__}: {e}")
         logging.error(f"   URL intentada: {CLOUD_API_URL}")
+        return REJECTED, f"{type(e).__name__}: {e}"
+
+
+# ---------- Envío por lotes ----------
+def _encode_batch(body: bytes, compression: str) -> tuple:
+    """Comprime el cuerpo del lote (gzip | zstd | none). Retorna (bytes, content-encoding)."""
+    if compression == "zstd":
+        try:
+            import zstandard
+            return zstandard.ZstdCompressor(level=3).compress(body), "zstd"
+        except ImportError:
+            logging.warning("⚠ zstandard no está instalado, usando gzip")
+    if compression in ("gzip", "zstd"):
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return body, None
+
+
+def _encode_event(event_payload: dict) -> bytes:
+    """Serializa el evento para el lote; si es demasiado grande se quita el snapshot (como send_event_to_cloud)."""
+    encoded = json.dumps(event_payload).encode("utf-8")
+    if len(encoded) > MAX_EVENT_PAYLOAD_SIZE and 'snapshot_base64' in event_payload:
+        logging.warning(f"⚠ Evento demasiado grande ({len(encoded)} bytes), removiendo snapshot...")
+        event_payload = {k: v for k, v in event_payload.items() if k != 'snapshot_base64'}
+        encoded = json.dumps(event_payload).encode("utf-8")
+    return encoded
+
+
+# ---------- Spool local en disco ----------
+class EventSpool:
+    """
+    Cola persistente (SQLite en modo WAL) entre MQTT y el envío HTTP.
+
+    on_message solo escribe aquí; un hilo aparte vacía la cola hacia la nube.
+    Si el backend está caído (p.ej. durante un deploy en Railway) los eventos
+    esperan en disco y se reenvían en el mismo orden en que llegaron.
+    El tamaño está acotado por LISTENER_SPOOL_MAX_MB: al superarlo se
+    descartan los eventos más viejos.
+
+    Un evento que el backend rechaza (400/413/422) o que falla
+    LISTENER_SPOOL_MAX_ATTEMPTS veces se mueve a la tabla dead_letter del mismo
+    archivo (con el último error) para no frenar a los que vienen detrás.
+    Se puede revisar con: sqlite3 spool/events.db "SELECT * FROM dead_letter"
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " created_at REAL NOT NULL,"
+            " payload BLOB NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(spool)")}
+        if "attempts" not in columns:  # Spool creado por una versión anterior
+            self._conn.execute("ALTER TABLE spool ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            " id INTEGER PRIMARY KEY,"
+            " created_at REAL NOT NULL,"
+            " failed_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " error TEXT,"
+            " payload BLOB NOT NULL)"
+        )
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM spool").fetchone()
+        self._count, self._bytes = row
+        if self._count:
+            logging.info(f"💾 Spool con {self._count} eventos pendientes de una ejecución anterior ({self._bytes} bytes)")
+
+    def put(self, event_payload: dict):
+        payload = json.dumps(event_payload).encode("utf-8")
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO spool (created_at, payload) VALUES (?, ?)", (time.time(), payload)
+            )
+            self._count += 1
+            self._bytes += len(payload)
+            if self._bytes > self.max_bytes:
+                self._trim()
+
+    def _trim(self):
+        """Descarta los eventos más viejos hasta bajar al 90% del límite (con el lock tomado)."""
+        dropped = 0
+        while self._bytes > self.max_bytes * 0.9 and self._count > 1:
+            row = self._conn.execute(
+                "SELECT id, LENGTH(payload) FROM spool ORDER BY id LIMIT 1"
+            ).fetchone()
+            if not row:
+                break
+            self._conn.execute("DELETE FROM spool WHERE id = ?", (row[0],))
+            self._count -= 1
+            self._bytes -= row[1]
+            dropped += 1
+        if dropped:
+            logging.error(f"❌ Spool lleno ({self.max_bytes} bytes): se descartaron {dropped} eventos antiguos")
+
+    def peek(self, limit: int) -> list:
+        """Retorna hasta `limit` eventos pendientes, del más viejo al más nuevo: [(id, created_at, payload)]."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, created_at, payload FROM spool ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+
+    def record_failure(self, row_id: int) -> int:
+        """Suma un intento fallido al evento. Retorna los intentos acumulados."""
+        with self._lock:
+            self._conn.execute("UPDATE spool SET attempts = attempts + 1 WHERE id = ?", (row_id,))
+            row = self._conn.execute("SELECT attempts FROM spool WHERE id = ?", (row_id,)).fetchone()
+            return row[0] if row else 0
+
+    def dead_letter(self, row_id: int, error: str):
+        """Mueve el evento a dead_letter (sale del spool y de su cuenta de bytes)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, attempts, payload FROM spool WHERE id = ?", (row_id,)
+            ).fetchone()
+            if not row:
+                return
+            created_at, attempts, payload = row
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dead_letter (id, created_at, failed_at, attempts, error, payload)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (row_id, created_at, time.time(), attempts, error, payload),
+            )
+            self._conn.execute("DELETE FROM spool WHERE id = ?", (row_id,))
+            self._conn.execute("COMMIT")
+            self._count -= 1
+            self._bytes -= len(payload)
+            dead = self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        logging.error(
+            f"☠️ Evento {row_id} movido a dead_letter ({attempts} intentos fallidos, último error: {error}); "
+            f"{dead} eventos en dead_letter ({self.path})"
+        )
+
+    def ack(self, ids: list):
+        if not ids:
+            return
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            removed = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM spool WHERE id IN ({placeholders})", ids
+            ).fetchone()
+            self._conn.execute(f"DELETE FROM spool WHERE id IN ({placeholders})", ids)
+            self._count -= removed[0]
+            self._bytes -= removed[1]
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CloudSender:
+    """
+    Hilo que vacía el spool hacia el backend.
+
+    - Orden estricto: siempre se envía primero lo más viejo; si falla, se
+      reintenta lo mismo con backoff exponencial (con jitter) antes de seguir.
+    - Un evento rechazado (400/413/422) o que falla LISTENER_SPOOL_MAX_ATTEMPTS
+      veces con un error propio (500...) pasa a dead_letter y la cola sigue.
+      Las caídas, timeouts, 502/503/504 y errores de configuración no cuentan:
+      esos eventos esperan sin límite (ver _classify_status).
+    - Con CLOUD_BATCH_SIZE > 1 agrupa eventos en un POST a /api/events/batch
+      (por cantidad, tamaño o CLOUD_BATCH_WINDOW_MS). Si el backend no tiene el
+      endpoint (404/405) vuelve al envío de a un evento.
+    """
+
+    def __init__(self, spool: EventSpool, batch_size: int = 1, window_ms: int = 0,
+                 max_bytes: int = 2000000, compression: str = "gzip"):
+        self.spool = spool
+        self.batch_size = max(1, batch_size)
+        self.window = window_ms / 1000.0
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.url = f"{compute_api_base()}/api/events/batch"
+        self._batch_supported = self.batch_size > 1
+        self._wakeup = Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="cloud-sender", daemon=True)
+        self._thread.start()
+        if self._batch_supported:
+            logging.info(
+                f"📦 Batching activo: hasta {self.batch_size} eventos / {int(self.window * 1000)} ms "
+                f"→ {self.url} ({self.compression})"
+            )
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _wait(self, seconds: float):
+        self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+    def _run(self):
+        backoff = SPOOL_RETRY_BASE_SECONDS
+        while not STOP_EVENT.is_set():
+            rows = self.spool.peek(self.batch_size if self._batch_supported else 1)
+            if not rows:
+                self._wait(1)
+                continue
+
+            # Lote incompleto: esperamos a que se llene o a que venza la ventana del más viejo
+            while self._batch_supported and len(rows) < self.batch_size and not STOP_EVENT.is_set():
+                remaining = rows[0][1] + self.window - time.time()
+                if remaining <= 0:
+                    break
+                self._wait(remaining)
+                rows = self.spool.peek(self.batch_size)
+
+            try:
+                sent_ids, rejected, failed = self._send(rows)
+            except Exception as e:
+                logging.error(f"❌ Error inesperado enviando desde el spool: {type(e).__name__}: {e}")
+                sent_ids, rejected, failed = [], [], None
+
+            self.spool.ack(sent_ids)
+            for row_id, error in rejected:
+                self.spool.dead_letter(row_id, error)
+            progressed = bool(sent_ids or rejected)
+            if failed is not None:
+                row_id, error = failed
+                attempts = self.spool.record_failure(row_id)
+                logging.warning(f"⚠ Evento {row_id} falló ({error}), intento {attempts}/{LISTENER_SPOOL_MAX_ATTEMPTS}")
+                if attempts >= LISTENER_SPOOL_MAX_ATTEMPTS:
+                    self.spool.dead_letter(row_id, error)
+                    progressed = True
+
+            if progressed:
+                backoff = SPOOL_RETRY_BASE_SECONDS
+                continue
+
+            # Backend caído o saturado: reintentar lo mismo más tarde
+            delay = backoff / 2 + random.uniform(0, backoff / 2)
+            logging.warning(f"⏳ {len(self.spool)} eventos en el spool, reintentando en {delay:.1f}s")
+            STOP_EVENT.wait(delay)
+            backoff = min(backoff * 2, SPOOL_RETRY_MAX_SECONDS)
+
+    def _send(self, rows: list) -> tuple:
+        """
+        Envía las filas del spool, en orden. Retorna (ids enviados, [(id, error)]
+        rechazados, (id, error) del evento que falló con un error propio o None).
+        """
+        if not self._batch_supported:
+            row_id, _, payload = rows[0]
+            return self._send_each([(row_id, payload)])
+
+        batch, batch_bytes, spans = [], 0, []
+        for row_id, _, payload in rows:
+            event_payload = json.loads(payload)
+            parent = event_payload.get("traceparent")
+            traceparent = TRACER.child(parent)
+            if traceparent:
+                event_payload["traceparent"] = traceparent
+            encoded = _encode_event(event_payload)
+            if batch and batch_bytes + len(encoded) > self.max_bytes:
+                break
+            batch.append((row_id, encoded))
+            batch_bytes += len(encoded)
+            spans.append((row_id, traceparent, parent))
+
+        started = time.time()
+        result = self._send_batch(batch)
+        finished, sent = time.time(), set(result[0])
+        for row_id, traceparent, parent in spans:
+            TRACER.record("cloud_post", traceparent, parent, started, finished,
+                          mode="batch", batch_size=len(batch), done=row_id in sent)
+        return result
+
+    @staticmethod
+    def _send_each(batch: list) -> tuple:
+        """Envío de a un evento (sin batching, o para aislar al culpable de un lote fallido)."""
+        sent_ids, rejected = [], []
+        for row_id, encoded in batch:
+            outcome, error = send_event_to_cloud(json.loads(encoded))
+            if outcome == SENT:
+                sent_ids.append(row_id)
+            elif outcome == REJECTED:
+                rejected.append((row_id, error))
+            elif outcome == FAILED:
+                return sent_ids, rejected, (row_id, error)
+            else:
+                break
+        return sent_ids, rejected, None
+
+    def _send_batch(self, batch: list) -> tuple:
+        raw = b"[" + b",".join(encoded for _, encoded in batch) + b"]"
+        body, encoding = _encode_batch(raw, self.compression)
+        headers = {"Content-Type": "application/json"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if CLOUD_API_KEY:
+            headers["Authorization"] = f"Bearer {CLOUD_API_KEY}"
+
+        try:
+            resp = CLOUD_SESSION.post(self.url, data=body, headers=headers, timeout=15)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"❌ Error enviando lote de {len(batch)} eventos: {e}")
+            return [], [], None
+
+        if 200 <= resp.status_code < 300:
+            # El lote ya está guardado: un cuerpo inesperado no debe hacer que se reenvíe
+            try:
+                stored = resp.json().get("stored")
+            except (ValueError, AttributeError):
+                stored = "?"
+            logging.info(
+                f"✔ Lote enviado a la nube: {len(batch)} eventos, {stored} guardados "
+                f"({len(raw)} → {len(body)} bytes)"
+            )
+            return [row_id for row_id, _ in batch], [], None
+
+        if resp.status_code in (404, 405):
+            logging.warning("⚠ El backend no soporta /api/events/batch, volviendo a envío por evento")
+            self._batch_supported = False
+            return [], [], None
+        if resp.status_code == 415 and encoding == "zstd":
+            logging.warning("⚠ El backend no acepta zstd, usando gzip")
+            self.compression = "gzip"
+            return [], [], None
+
+        logging.warning(f"⚠ Error enviando lote a la nube: {resp.status_code} | {resp.text[:500]}")
+        if _classify_status(resp.status_code) == UNAVAILABLE:
+            _log_config_error(resp.status_code, self.url)
+            return [], [], None
+        # Lote rechazado (400/413/422) o con un error propio (500...): evento por evento,
+        # así los válidos pasan y solo el culpable va sumando intentos (o a dead_letter)
+        return self._send_each(batch)
+
+
+SPOOL = None
+SENDER = None
+PIPELINE = None
+
+
+def spool_event(event_payload: dict):
+    """Deja el evento en el spool y despierta al hilo que envía a la nube."""
+    SPOOL.put(event_payload)
+    SENDER.wake()
 
 
 # ---------- Normalización de evento de Frigate ----------
@@ -512,6 +1357,7 @@ def on_connect(client, userdata, flags, rc):
 
 
 def on_message(client, userdata, msg):
+    received_at = time.time()
     try:
         payload_str = msg.payload.decode("utf-8")
         data = json.loads(payload_str)
@@ -536,26 +1382,50 @@ def on_message(client, userdata, msg):
     event_id = normalized_event.get('event_id')
     has_snapshot = normalized_event.get('has_snapshot')
     frigate_type = normalized_event.get('frigate_type')
+    needs_snapshot = bool(event_id and has_snapshot and frigate_type == 'end')
+
+    # TRAZAS: la traza del evento empieza aquí; frigate_lag_ms = fin del objeto en Frigate -> llegada por MQTT
+    if frigate_type == 'end':
+        traceparent = TRACER.new_trace()
+        if traceparent:
+            end_time = normalized_event.get('end_time')
+            TRACER.record(
+                "mqtt_receive", traceparent, None, received_at, time.time(),
+                camera=normalized_event.get('camera'), event_id=event_id,
+                frigate_end_time=end_time,
+                frigate_lag_ms=round((received_at - float(end_time)) * 1000, 1) if end_time else None,
+            )
+            normalized_event["traceparent"] = traceparent
 
-    if event_id and has_snapshot and frigate_type == 'end':
-        snapshot_b64 = download_snapshot(event_id)
-        if snapshot_b64:
-            snapshot_size = len(snapshot_b64)
-            if snapshot_size > MAX_SNAPSHOT_SIZE_B64:
-                logging.warning(
-                    f"⚠ Snapshot demasiado grande ({snapshot_size} bytes), "
-                    f"excede el límite de {MAX_SNAPSHOT_SIZE_B64} bytes. No se incluirá en el evento."
-                )
-            else:
-                normalized_event['snapshot_base64'] = snapshot_b64
-
-    send_event_to_cloud(normalized_event)
+    # PIPELINE: La descarga/compresión del snapshot corre en sus propios pools y el
+    # evento llega al spool (nunca bloqueamos el loop de MQTT con la red hacia la nube)
+    PIPELINE.submit(normalized_event, needs_snapshot)
 
 
 # ---------- Loop principal ----------
 def main():
+    global SPOOL, SENDER, PIPELINE
     client = mqtt.Client()
 
+    SPOOL = EventSpool(LISTENER_SPOOL_PATH, int(LISTENER_SPOOL_MAX_MB * 1024 * 1024))
+    SENDER = CloudSender(
+        SPOOL,
+        batch_size=CLOUD_BATCH_SIZE,
+        window_ms=CLOUD_BATCH_WINDOW_MS,
+        max_bytes=CLOUD_BATCH_MAX_BYTES,
+        compression=CLOUD_BATCH_COMPRESSION,
+    )
+    SENDER.start()
+    logging.info(f"💾 Spool de eventos en {os.path.abspath(LISTENER_SPOOL_PATH)}")
+
+    PIPELINE = SnapshotPipeline(
+        spool_event,
+        fetch_workers=SNAPSHOT_FETCH_WORKERS,
+        compress_workers=SNAPSHOT_COMPRESS_WORKERS,
+        max_pending=SNAPSHOT_PIPELINE_MAX_PENDING,
+        compress_executor=SNAPSHOT_COMPRESS_EXECUTOR,
+    )
+
     if MQTT_USER and MQTT_PASSWORD:
         client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
 